@@ -0,0 +1,57 @@
+"""Measures finding the subscribers of a bus event.
+
+Usage: python -m benchmark.bus_dispatch [--subscribers 10000] [--events 10000]
+
+Run it as a module from the repository root, so that vj4 can be imported. Running the file as a
+script (python benchmark/bus_dispatch.py) fails unless the root is on PYTHONPATH.
+
+Every subscriber stands for an open notification connection with its own push_received-<uid> key,
+one in ten also watches record_change. Events are push_received of a single user, compared
+between scanning all subscribers as before and subscription.Registry.
+"""
+import argparse
+import random
+import timeit
+
+from vj4.util import subscription
+
+
+class Connection(object):
+  async def on_push_received(self, e):
+    pass
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--subscribers', type=int, default=10000)
+  parser.add_argument('--events', type=int, default=10000)
+  args = parser.parse_args()
+  scan = {}
+  registry = subscription.Registry()
+  for uid in range(args.subscribers):
+    keys = ['push_received-' + str(uid)]
+    if uid % 10 == 0:
+      keys.append('record_change')
+    callback = Connection().on_push_received
+    scan[callback] = keys
+    registry.subscribe(callback, keys)
+  keys = ['push_received-' + str(random.randrange(args.subscribers)) for _ in range(args.events)]
+
+  def run_scan():
+    for key in keys:
+      [subscriber for subscriber, key_set in scan.items() if key in key_set]
+
+  def run_registry():
+    for key in keys:
+      registry.get(key)
+
+  before = timeit.timeit(run_scan, number=1) / args.events
+  after = timeit.timeit(run_registry, number=1) / args.events
+  print('%d subscribers' % args.subscribers)
+  print('scan:     %10.3f us per event' % (before * 1e6))
+  print('registry: %10.3f us per event' % (after * 1e6))
+  print('ratio:    %10.1fx' % (before / after))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,86 @@
+"""Measures work queue publish throughput against a running message queue.
+
+Usage: python -m benchmark.mq_publish [--messages 10000] [--concurrency 100] [--mq-host localhost]
+                                      [--batch-delays 0,0.001,0.002,0.005]
+                                      [--batch-sizes 16,64,256,1024]
+
+Publishes --messages judge-sized messages to a scratch queue from --concurrency coroutines, once
+the way queue.publish worked before, declaring the queue on every publish without confirms, and
+once with queue.publish, which declares once and waits for batched publisher confirms. The latter
+runs for every combination of --batch-delays and --batch-sizes, which stand for the
+mq_publish_batch_delay and mq_publish_batch_size options. The queue is deleted afterwards.
+"""
+import argparse
+import asyncio
+import time
+
+import bson
+from bson import objectid
+
+from vj4 import mq
+from vj4.service import queue
+from vj4.util import options
+
+QUEUE_NAME = 'benchmark_mq_publish'
+
+
+async def _publish_before(channel, message):
+  await channel.queue_declare(QUEUE_NAME)
+  await channel.basic_publish(bson.BSON.encode(message), '', QUEUE_NAME)
+
+
+async def _publish_after(channel, message):
+  await queue.publish(QUEUE_NAME, **message)
+
+
+async def _run(publish, num_messages, concurrency, *, own_channels):
+  # aioamqp allows one declaration of a queue name in flight per channel, so coroutines
+  # publishing the old way get their own channels.
+  if own_channels:
+    channels = [await mq.channel() for _ in range(concurrency)]
+  else:
+    channels = [None] * concurrency
+
+  async def worker(channel, count):
+    for _ in range(count):
+      await publish(channel, {'rid': objectid.ObjectId()})
+
+  begin_at = time.perf_counter()
+  await asyncio.gather(*[worker(channel, num_messages // concurrency) for channel in channels])
+  elapsed = time.perf_counter() - begin_at
+  for channel in channels:
+    if channel:
+      await channel.close()
+  return num_messages // concurrency * concurrency / elapsed
+
+
+async def _main(args):
+  before = await _run(_publish_before, args.messages, args.concurrency, own_channels=True)
+  print('before: %10.0f messages/sec (no confirms)' % before)
+  for batch_delay in args.batch_delays:
+    for batch_size in args.batch_sizes:
+      options.mq_publish_batch_delay = batch_delay
+      options.mq_publish_batch_size = batch_size
+      after = await _run(_publish_after, args.messages, args.concurrency, own_channels=False)
+      print('after:  %10.0f messages/sec (confirmed, delay %.3fs, size %4d), %.1fx'
+            % (after, batch_delay, batch_size, after / before))
+  channel = await mq.channel()
+  await channel.queue_delete(QUEUE_NAME)
+  await channel.close()
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--messages', type=int, default=10000)
+  parser.add_argument('--concurrency', type=int, default=100)
+  parser.add_argument('--batch-delays', type=lambda value: [float(v) for v in value.split(',')],
+                      default=[options.mq_publish_batch_delay])
+  parser.add_argument('--batch-sizes', type=lambda value: [int(v) for v in value.split(',')],
+                      default=[options.mq_publish_batch_size])
+  # Options such as --mq-host are parsed by vj4.util.options.
+  args, _ = parser.parse_known_args()
+  asyncio.get_event_loop().run_until_complete(_main(args))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,56 @@
+"""Benchmark for the seed calculation of vj4.job.rating.
+
+Usage: python -m benchmark.rating [--sizes 1000,10000,50000] [--reference-max 10000]
+
+The reference is the per-contestant get_seed() loop which process() used before SeedTable. It is
+quadratic in pure Python, so it is only run up to --reference-max contestants.
+"""
+import argparse
+import math
+import random
+import time
+
+from vj4.job import rating
+
+
+def _contestants(n, rand):
+  return [rating.Contestant(uid, uid + 1, max(rating.RATING_MIN, int(rand.gauss(1500, 350))))
+          for uid in range(n)]
+
+
+def _need_ratings(contestants, get_seed_func):
+  result = []
+  for c in contestants:
+    seed = get_seed_func(c.rating) - 0.5
+    mid_rank = math.sqrt(c.rank * seed)
+    result.append((seed, rating.get_rating_to_rank(contestants, mid_rank, None, get_seed_func)))
+  return result
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--sizes', default='1000,10000,50000')
+  parser.add_argument('--reference-max', type=int, default=10000)
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+  rand = random.Random(args.seed)
+  for n in map(int, args.sizes.split(',')):
+    contestants = _contestants(n, rand)
+    begin = time.perf_counter()
+    table_result = _need_ratings(contestants, rating.SeedTable(contestants).get)
+    table_time = time.perf_counter() - begin
+    line = '%6d contestants: table %8.2fs' % (n, table_time)
+    if n <= args.reference_max:
+      seed_cache = {}
+      begin = time.perf_counter()
+      reference_result = _need_ratings(
+          contestants, lambda r: rating.get_seed(contestants, r, seed_cache))
+      reference_time = time.perf_counter() - begin
+      assert reference_result == table_result, 'results differ'
+      line += ', reference %8.2fs, speedup %5.1fx, identical' % (
+          reference_time, reference_time / table_time)
+    print(line, flush=True)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,65 @@
+"""Measures the bus traffic of record_change events.
+
+Usage: python -m benchmark.record_change [--cases 200] [--code-bytes 16384] [--rate 10]
+
+A synthetic record is judged case by case and every record_change event is BSON-encoded, once
+with the whole record as published before and once with record.PROJECTION_CHANGE. --rate is the
+number of judged submissions per second.
+"""
+import argparse
+import datetime
+
+import bson
+from bson import objectid
+
+from vj4 import constant
+from vj4.model import record
+
+
+def _events(num_cases, code_bytes):
+  rdoc = {'_id': objectid.ObjectId(), 'rev': 1, 'hidden': False,
+          'status': constant.record.STATUS_WAITING, 'score': 0, 'time_ms': 0, 'memory_kb': 0,
+          'domain_id': 'system', 'pid': 1000, 'uid': 2, 'lang': 'cc', 'code': 'x' * code_bytes,
+          'ttype': None, 'tid': None, 'data_id': None, 'type': constant.record.TYPE_SUBMISSION}
+  yield rdoc
+  rdoc.update({'rev': 2, 'status': constant.record.STATUS_FETCHED, 'judge_uid': 1,
+               'judge_token': 'token', 'judge_at': datetime.datetime.utcnow(),
+               'compiler_texts': ['compiled'], 'judge_texts': [], 'cases': [], 'progress': 0.0})
+  yield rdoc
+  for i in range(num_cases):
+    rdoc['rev'] += 1
+    rdoc['status'] = constant.record.STATUS_JUDGING
+    rdoc['progress'] = (i + 1) * 100.0 / num_cases
+    rdoc['cases'].append({'status': constant.record.STATUS_ACCEPTED, 'score': 100 // num_cases,
+                          'time_ms': 15, 'memory_kb': 1024, 'judge_text': 'ok'})
+    yield rdoc
+  rdoc['rev'] += 1
+  rdoc.update({'status': constant.record.STATUS_ACCEPTED, 'score': 100})
+  del rdoc['progress']
+  yield rdoc
+
+
+def _size(value):
+  return len(bson.BSON.encode({'key': 'record_change', 'value': value}))
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--cases', type=int, default=200)
+  parser.add_argument('--code-bytes', type=int, default=16384)
+  parser.add_argument('--rate', type=float, default=10)
+  args = parser.parse_args()
+  before = after = num_events = 0
+  for rdoc in _events(args.cases, args.code_bytes):
+    num_events += 1
+    before += _size(rdoc)
+    after += _size({'_id': rdoc['_id'],
+                    **{key: rdoc[key] for key in record.PROJECTION_CHANGE if key in rdoc}})
+  print('%d events per submission' % num_events)
+  print('before: %10d bytes per submission, %12.0f bytes/sec' % (before, before * args.rate))
+  print('after:  %10d bytes per submission, %12.0f bytes/sec' % (after, after * args.rate))
+  print('ratio:  %10.1fx' % (before / after))
+
+
+if __name__ == '__main__':
+  main()
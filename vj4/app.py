@@ -8,10 +8,15 @@ from aiohttp import web
 
 from vj4 import db
 from vj4 import error
+from vj4.model import fs as fs_model
+from vj4.model import opcount
 from vj4.model import system
+from vj4.model import token
 from vj4.service import bus
 from vj4.service import dataset
-from vj4.service import worker
+from vj4.service import postjudge
+from vj4.service import problemindex
+from vj4.service import scoreboard
 from vj4.service import smallcache
 from vj4.service import staticmanifest
 from vj4.util import json
@@ -80,14 +85,17 @@ class Application(web.Application):
     # Initialize components.
     staticmanifest.init(static_path)
     smallcache.init()
-    dataset.init()
-    worker.init()
+    token.init()
+    fs_model.init()
+    opcount.init()
+    scoreboard.init()
+    problemindex.init()
 
     async def _init_app(app):
       await db.init()
       await system.setup()
       await system.ensure_db_version()
-      await asyncio.gather(tools.ensure_all_indexes(), bus.init())
+      await asyncio.gather(tools.ensure_all_indexes(), bus.init(), dataset.init())
 
       for handler, name, prefix, Manager in app._pending_sockjs_endpoints:
         sockjs.add_endpoint(app, handler, name=name, prefix=prefix,
@@ -98,6 +106,14 @@ class Application(web.Application):
 
     self.on_startup.append(_init_app)
 
+    async def _flush_app(app):
+      await asyncio.gather(postjudge.flush_all(), token._flush_refreshes())
+
+    # Post-judge updates and session refreshes are batched in memory. Flush them when the server
+    # stops accepting requests, and again after the requests in progress are done.
+    self.on_shutdown.append(_flush_app)
+    self.on_cleanup.append(_flush_app)
+
     # Load views.
     from vj4.handler import contest
     from vj4.handler import discussion
@@ -12,7 +12,7 @@ class AnnouncementHandler(base.Handler):
     @base.post_argument
     @base.limit_rate("global_announcement", 3600, 10)
     async def post(self, message: str):
-        await bus.publish('worker_global_announcement', {
+        await bus.publish('global_announcement', {
             'message': message,
             'made_by': self.user['_id'],
             'made_at': datetime.datetime.utcnow(),
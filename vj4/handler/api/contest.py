@@ -9,31 +9,51 @@ from vj4.util import pagination
 @app.api_route("/contest", "contest_main")
 class ContestMainHandler(base.Handler):
     CONTESTS_PER_PAGE = 20
+    SORT = [("begin_at", -1), ("doc_id", -1)]
 
     @base.require_perm(builtin.PERM_VIEW_CONTEST)
     @base.get_argument
     @base.sanitize
-    async def get(self, page: int = 1):
+    async def get(self, page: int = 1, cursor: str = None):
         query = {}
         query["hidden"] = {"$ne": True}
         if self.has_perm(builtin.PERM_EDIT_CONTEST):
             del query["hidden"]
-        tdocs = contest.get_multi(
-            self.domain_id,
-            document.TYPE_CONTEST,
-            fields={
-                "_id": 1,
-                "begin_at": 1,
-                "end_at": 1,
-                "hidden": 1,
-                "title": 1,
-                "rule": 1,
-                "attend": 1,
-            },
-            **query,
-        )
+
+        def get_tdocs(keyset_query=None):
+            return contest.get_multi(
+                self.domain_id,
+                document.TYPE_CONTEST,
+                fields={
+                    "_id": 1,
+                    "doc_id": 1,
+                    "begin_at": 1,
+                    "end_at": 1,
+                    "hidden": 1,
+                    "title": 1,
+                    "rule": 1,
+                    "attend": 1,
+                },
+                **query,
+                **(keyset_query or {}),
+            )
+
+        if cursor is not None:
+            # Opt-in keyset pagination: pass an empty cursor for the first page.
+            tdocs, next_cursor, _ = await pagination.paginate_keyset(
+                get_tdocs, self.SORT, cursor, self.CONTESTS_PER_PAGE
+            )
+            self.json(
+                {
+                    "cursor": cursor,
+                    "next_cursor": next_cursor,
+                    "page_size": self.CONTESTS_PER_PAGE,
+                    "contests": tdocs,
+                }
+            )
+            return
         tdocs, tpcount, count = await pagination.paginate(
-            tdocs, page, self.CONTESTS_PER_PAGE
+            get_tdocs(), page, self.CONTESTS_PER_PAGE
         )
         self.json(
             {
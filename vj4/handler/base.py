@@ -145,7 +145,7 @@ class HandlerBase(setting.SettingMixin):
   async def update_session(self, *, new_saved=False, **kwargs):
     """Update or create session if necessary.
 
-    If 'sid' in cookie, the 'expire_at' field is updated.
+    If 'sid' in cookie, the 'expire_at' field is refreshed (see token.refresh).
     If 'sid' not in cookie, only create when there is extra data.
 
     Args:
@@ -165,10 +165,10 @@ class HandlerBase(setting.SettingMixin):
       token_type = token.TYPE_UNSAVED_SESSION
       session_expire_seconds = options.unsaved_session_expire_seconds
     if sid:
-      session = await token.update(sid, token_type, session_expire_seconds,
-                                   **{**kwargs,
-                                      'update_ip': self.remote_ip,
-                                      'update_ua': self.request.headers.get('User-Agent')})
+      session = await token.refresh(sid, token_type, session_expire_seconds,
+                                    **{**kwargs,
+                                       'update_ip': self.remote_ip,
+                                       'update_ua': self.request.headers.get('User-Agent')})
     if kwargs and not session:
       sid, session = await token.add(token_type, session_expire_seconds,
                                      **{**kwargs,
@@ -311,9 +311,11 @@ class Handler(web.View, HandlerBase):
     self.response.headers.add('Pragma', 'no-cache')
     self.response.text = json.encode(obj)
 
-  async def binary(self, data, content_type='application/octet-stream', file_name=None):
+  async def prepare_binary(self, content_type='application/octet-stream', file_name=None,
+                           content_length=None):
     self.response = web.StreamResponse()
-    self.response.content_length = len(data)
+    if content_length is not None:
+      self.response.content_length = content_length
     self.response.content_type = content_type
     if file_name:
       for char in '/<>:\"\'\\|?* ':
@@ -321,6 +323,9 @@ class Handler(web.View, HandlerBase):
       self.response.headers.add('Content-Disposition',
                                 'attachment; filename="{}"'.format(file_name))
     await self.response.prepare(self.request)
+
+  async def binary(self, data, content_type='application/octet-stream', file_name=None):
+    await self.prepare_binary(content_type, file_name, len(data))
     await self.response.write(data)
 
   @property
@@ -526,7 +531,7 @@ def multipart_argument(coro):
           except:
             await grid_in.abort()
             raise
-          file_id = await fs.link_by_md5(getattr(grid_in, 'md5', None), grid_in._id)
+          file_id = await fs.link_by_sha256(grid_in.sha256, grid_in._id)
           if file_id:
             await fs.unlink(grid_in._id)
           else:
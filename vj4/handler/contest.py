@@ -22,6 +22,7 @@ from vj4.model.adaptor import clarification
 from vj4.handler import base
 from vj4.util import misc
 from vj4.util import pagination
+from vj4.util import zipstream
 
 
 @app.route("/contest", "contest_main")
@@ -177,6 +178,8 @@ class ContestDetailHandler(contest.ContestMixin, base.OperationHandler):
 
 @app.route("/contest/{tid:\w{24}}/code", "contest_code")
 class ContestCodeHandler(base.OperationHandler):
+    RECORDS_PER_BATCH = 50
+
     @base.limit_rate("contest_code", 3600, 60)
     @base.route_argument
     @base.require_perm(builtin.PERM_VIEW_CONTEST)
@@ -192,22 +195,18 @@ class ContestCodeHandler(base.OperationHandler):
                 rnames[pdetail["rid"]] = "U{}_P{}_R{}".format(
                     tsdoc["uid"], pdetail["pid"], pdetail["rid"]
                 )
-        output_buffer = io.BytesIO()
-        zip_file = zipfile.ZipFile(output_buffer, "a", zipfile.ZIP_DEFLATED)
-        rdocs = record.get_multi(_id={"$in": list(rnames.keys())})
-        async for rdoc in rdocs:
-            zip_file.writestr(rnames[rdoc["_id"]] +
-                              "." + rdoc["lang"], rdoc["code"])
-        # mark all files as created in Windows :p
-        for zfile in zip_file.filelist:
-            zfile.create_system = 0
-        zip_file.close()
-
-        await self.binary(
-            output_buffer.getvalue(),
-            "application/zip",
-            file_name="{}.zip".format(tdoc["title"]),
+        await self.prepare_binary(
+            "application/zip", file_name="{}.zip".format(tdoc["title"])
         )
+        zip_writer = zipstream.ZipStreamWriter(self.response)
+        rdocs = record.get_multi(
+            _id={"$in": list(rnames.keys())}, fields=["_id", "lang", "code"]
+        ).batch_size(self.RECORDS_PER_BATCH)
+        async for rdoc in rdocs:
+            await zip_writer.writestr(
+                rnames[rdoc["_id"]] + "." + rdoc["lang"], rdoc["code"]
+            )
+        await zip_writer.close()
 
 
 @app.route("/contest/{tid}/{pid:-?\d+|\w{24}}", "contest_detail_problem")
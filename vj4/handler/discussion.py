@@ -31,18 +31,25 @@ class DiscussionMainHandler(base.Handler):
   @base.require_perm(builtin.PERM_VIEW_DISCUSSION)
   @base.get_argument
   @base.sanitize
-  async def get(self, *, page: int=1):
-    # TODO(iceboy): continuation based pagination.
-    nodes, (ddocs, dpcount, _) = await asyncio.gather(
-        discussion.get_nodes(self.domain_id),
-        # TODO(twd2): exclude problem/contest discussions?
-        pagination.paginate(discussion.get_multi(self.domain_id), page, self.DISCUSSIONS_PER_PAGE))
+  async def get(self, *, page: int=None, cursor: str=''):
+    if page is None:
+      # TODO(twd2): exclude problem/contest discussions?
+      nodes, (ddocs, next_cursor, _) = await asyncio.gather(
+          discussion.get_nodes(self.domain_id),
+          pagination.paginate_keyset(lambda query: discussion.get_multi(self.domain_id, **query),
+                                     discussion.SORT, cursor, self.DISCUSSIONS_PER_PAGE))
+      page_kwargs = {'cursor': cursor, 'next_cursor': next_cursor}
+    else:
+      nodes, (ddocs, dpcount, _) = await asyncio.gather(
+          discussion.get_nodes(self.domain_id),
+          pagination.paginate(discussion.get_multi(self.domain_id), page, self.DISCUSSIONS_PER_PAGE))
+      page_kwargs = {'page': page, 'dpcount': dpcount}
     udict, dudict, vndict = await asyncio.gather(
         user.get_dict(ddoc['owner_uid'] for ddoc in ddocs),
         domain.get_dict_user_by_uid(domain_id=self.domain_id, uids=(ddoc['owner_uid'] for ddoc in ddocs)),
         discussion.get_dict_vnodes(self.domain_id, map(discussion.node_id, ddocs)))
     self.render('discussion_main_or_node.html', discussion_nodes=nodes, ddocs=ddocs,
-                udict=udict, dudict=dudict, vndict=vndict, page=page, dpcount=dpcount)
+                udict=udict, dudict=dudict, vndict=vndict, **page_kwargs)
 
 
 @app.route('/discuss/{doc_type:-?\d+}/{doc_id}', 'discussion_node_document_as_node')
@@ -1,6 +1,7 @@
 import asyncio
 import functools
 import mimetypes
+from aiohttp import web
 from bson import objectid
 
 from vj4 import app
@@ -12,6 +13,7 @@ from vj4.model.adaptor import userfile
 
 FILE_MAX_LENGTH = 2 ** 27 # 128 MiB
 USER_QUOTA = 2 ** 27 # 128 MiB
+FILE_CHUNK_SIZE = 2 ** 18 # 256 KiB
 ALLOWED_MIMETYPE_PREFIX = ['image/', 'text/', 'application/zip']
 
 
@@ -20,49 +22,125 @@ class FsGetHandler(base.Handler):
   @base.route_argument
   @base.sanitize
   async def stream_data(self, *, secret: str, headers_only: bool=False):
-    grid_out = await fs.get_by_secret(secret)
+    fdoc = await fs.get_meta_by_secret(secret)
+    length = fdoc['length']
 
-    self.response.content_type = grid_out.content_type or 'application/octet-stream'
-    # FIXME(iceboy): For some reason setting response.content_length doesn't work in aiohttp 2.0.6.
-    self.response.headers['Content-Length'] = str(grid_out.length)
+    # Unlike Response, StreamResponse writes the headers in prepare(), so they precede the body
+    # even when it is written by sendfile.
+    self.response = web.StreamResponse()
+
+    self.response.content_type = fdoc.get('contentType') or 'application/octet-stream'
     ext = mimetypes.guess_extension(self.response.content_type)
     if not ext:
       ext = ''
     self.response.headers.add('Content-Disposition',
                               'attachment; filename="{}{}"'.format(secret, ext))
+    self.response.headers['Accept-Ranges'] = 'bytes'
 
     # Cache control.
-    self.response.last_modified = grid_out.upload_date
-    # Use md5 if available (Motor 2.x), otherwise use file_id (Motor 3.x removed MD5)
-    etag = getattr(grid_out, 'md5', None) or str(grid_out._id)
-    self.response.headers['Etag'] = '"{}"'.format(etag)
+    self.response.last_modified = fdoc['uploadDate']
+    # Use md5 if available, otherwise use file_id.
+    etag = '"{}"'.format(fdoc.get('md5') or str(fdoc['_id']))
+    self.response.headers['Etag'] = etag
     self.response.headers['Cache-Control'] = 'max-age=2592000' # 30 days = 2592000 seconds
 
     # Handle If-Modified-Since & If-None-Match.
     not_modified = False
     if self.request.if_modified_since:
       if_modified_since = self.request.if_modified_since.replace(tzinfo=None)
-      last_modified = grid_out.upload_date.replace(microsecond=0)
+      last_modified = fdoc['uploadDate'].replace(microsecond=0)
       not_modified = not_modified or (last_modified <= if_modified_since)
     if self.request.headers.get('If-None-Match', ''):
       not_modified = not_modified \
-        or ('"{0}"'.format(etag) == self.request.headers.get('If-None-Match', ''))
+        or (etag == self.request.headers.get('If-None-Match', ''))
 
     if not_modified:
       self.response.set_status(304, None) # Not Modified
       return
 
+    # Handle Range & If-Range.
+    begin, end = 0, length
+    if 'Range' in self.request.headers and self.if_range_matches(etag, fdoc['uploadDate']):
+      try:
+        http_range = self.request.http_range
+      except ValueError:
+        http_range = None
+      if http_range:
+        begin, end, _ = http_range.indices(length)
+        if begin >= end:
+          self.response.set_status(416, None) # Range Not Satisfiable
+          self.response.headers['Content-Range'] = 'bytes */{}'.format(length)
+          self.response.headers['Content-Length'] = '0'
+          return
+        self.response.set_status(206, None) # Partial Content
+        self.response.headers['Content-Range'] = \
+          'bytes {}-{}/{}'.format(begin, end - 1, length)
+    # FIXME(iceboy): For some reason setting response.content_length doesn't work in aiohttp 2.0.6.
+    self.response.headers['Content-Length'] = str(end - begin)
+
     if not headers_only:
-      await self.response.prepare(self.request)
-      # TODO(twd2): Range
-      remaining = grid_out.length
-      chunk = await grid_out.readchunk()
-      while chunk and remaining >= len(chunk):
+      disk_file = await fs.open_disk_cache(fdoc)
+      if disk_file:
+        with disk_file:
+          await self.response.prepare(self.request)
+          await self.send_file(disk_file, begin, end - begin)
+      else:
+        await self.response.prepare(self.request)
+        await self.send_grid_out(fdoc, begin, end - begin)
+      await self.response.write_eof()
+
+  async def send_file(self, file_object, offset, count):
+    try:
+      await asyncio.get_event_loop().sendfile(self.request.transport, file_object, offset, count)
+    except NotImplementedError:
+      loop = asyncio.get_event_loop()
+      await loop.run_in_executor(None, file_object.seek, offset)
+      while count > 0:
+        chunk = await loop.run_in_executor(None, file_object.read, min(count, FILE_CHUNK_SIZE))
+        if not chunk:
+          break
+        count -= len(chunk)
+        await self.response.write(chunk)
+
+  async def send_grid_out(self, fdoc, offset, count):
+    grid_out = fs.open_meta(fdoc)
+    # Seeking moves to the chunk containing offset, nothing before it is read.
+    grid_out.seek(offset)
+    # Only complete reads populate the disk cache.
+    writer = fs.create_disk_cache_writer(fdoc) if count == fdoc['length'] else None
+    try:
+      remaining = count
+      chunk = await grid_out.readchunk() if remaining else b''
+      while chunk and remaining > len(chunk):
         remaining -= len(chunk)
+        if writer:
+          writer.write(chunk)
         _, chunk = await asyncio.gather(self.response.write(chunk), grid_out.readchunk())
       if chunk:
-        await self.response.write(chunk[:remaining])
-      await self.response.write_eof()
+        chunk = chunk[:remaining]
+        remaining -= len(chunk)
+        if writer:
+          writer.write(chunk)
+        await self.response.write(chunk)
+    except:
+      if writer:
+        writer.abort()
+      raise
+    if writer:
+      if remaining:
+        writer.abort()
+      else:
+        await writer.commit()
+
+  def if_range_matches(self, etag, last_modified):
+    if_range = self.request.headers.get('If-Range')
+    if not if_range:
+      return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+      return if_range == etag
+    if_range_date = self.request.if_range
+    return bool(if_range_date) \
+      and last_modified.replace(microsecond=0) <= if_range_date.replace(tzinfo=None)
 
   head = functools.partialmethod(stream_data, headers_only=True)
   get = stream_data
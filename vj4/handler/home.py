@@ -252,12 +252,18 @@ class HomePushNoitificationConnection(base.Connection):
   async def on_open(self):
     await super(HomePushNoitificationConnection, self).on_open()
     bus.subscribe(self.on_push_received, ['push_received-' + str(self.user['_id'])])
+    # Announcements are published once and delivered to every connection of each process.
+    bus.subscribe(self.on_global_announcement, ['global_announcement'])
 
   async def on_push_received(self, e):
     self.send(**e['value'])
 
+  async def on_global_announcement(self, e):
+    self.send(type='window-alert', message=e['value']['message'])
+
   async def on_close(self):
     bus.unsubscribe(self.on_push_received)
+    bus.unsubscribe(self.on_global_announcement)
 
 @app.connection_route('/home/messages-conn', 'home_messages-conn', global_route=True)
 class HomeMessagesConnection(base.Connection):
@@ -1,10 +1,8 @@
 import asyncio
 import collections
 import datetime
-import io
 import pytz
 import yaml
-import zipfile
 from bson import objectid
 
 from vj4 import app
@@ -20,6 +18,7 @@ from vj4.model.adaptor import contest
 from vj4.model.adaptor import problem
 from vj4.handler import base
 from vj4.util import pagination
+from vj4.util import zipstream
 
 
 def _parse_penalty_rules_yaml(penalty_rules):
@@ -129,6 +128,8 @@ class HomeworkDetailHandler(contest.ContestMixin, base.OperationHandler):
 
 @app.route('/homework/{tid:\w{24}}/code', 'homework_code')
 class HomeworkCodeHandler(base.OperationHandler):
+  RECORDS_PER_BATCH = 50
+
   @base.limit_rate('homework_code', 3600, 60)
   @base.route_argument
   @base.require_perm(builtin.PERM_VIEW_HOMEWORK)
@@ -140,18 +141,13 @@ class HomeworkCodeHandler(base.OperationHandler):
     for tsdoc in tsdocs:
       for pdetail in tsdoc.get('detail', []):
         rnames[pdetail['rid']] = 'U{}_P{}_R{}'.format(tsdoc['uid'], pdetail['pid'], pdetail['rid'])
-    output_buffer = io.BytesIO()
-    zip_file = zipfile.ZipFile(output_buffer, 'a', zipfile.ZIP_DEFLATED)
-    rdocs = record.get_multi(_id={'$in': list(rnames.keys())})
+    await self.prepare_binary('application/zip', file_name='{}.zip'.format(tdoc['title']))
+    zip_writer = zipstream.ZipStreamWriter(self.response)
+    rdocs = record.get_multi(_id={'$in': list(rnames.keys())},
+                             fields=['_id', 'lang', 'code']).batch_size(self.RECORDS_PER_BATCH)
     async for rdoc in rdocs:
-      zip_file.writestr(rnames[rdoc['_id']] + '.' + rdoc['lang'], rdoc['code'])
-    # mark all files as created in Windows :p
-    for zfile in zip_file.filelist:
-      zfile.create_system = 0
-    zip_file.close()
-
-    await self.binary(output_buffer.getvalue(), 'application/zip',
-                      file_name='{}.zip'.format(tdoc['title']))
+      await zip_writer.writestr(rnames[rdoc['_id']] + '.' + rdoc['lang'], rdoc['code'])
+    await zip_writer.close()
 
 
 @app.route('/homework/{tid}/{pid:-?\d+|\w{24}}', 'homework_detail_problem')
@@ -6,11 +6,10 @@ from bson import objectid
 
 from vj4 import app
 from vj4 import constant
-from vj4 import job
+from vj4 import error
 from vj4.handler import base
 from vj4.model import builtin
 from vj4.model import document
-from vj4.model import domain
 from vj4.model import judge
 from vj4.model import record
 from vj4.model import user
@@ -18,8 +17,11 @@ from vj4.model.adaptor import contest
 from vj4.model.adaptor import problem
 from vj4.model.adaptor import setting
 from vj4.service import bus
+from vj4.service import judgebuffer
+from vj4.service import postjudge
 from vj4.service import queue
 from vj4.util import locale
+from vj4.util import pagination
 
 _logger = logging.getLogger(__name__)
 
@@ -40,9 +42,19 @@ async def _send_ac_mail(handler, rdoc):
                           translate('P{0} - {1} Accepted!').format(pdoc['doc_id'], pdoc['title']),
                           'ac_mail.html', rdoc=rdoc, pdoc=pdoc, _=translate)
 
+async def _update_problem_status(rdoc, accept):
+  if await problem.update_status(rdoc['domain_id'], rdoc['pid'], rdoc['uid'],
+                                 rdoc['_id'], rdoc['status']):
+    if accept:
+      postjudge.inc_problem(rdoc['domain_id'], rdoc['pid'], num_accept=1)
+      postjudge.inc_domain_user(rdoc['domain_id'], rdoc['uid'], num_accept=1)
+  if accept:
+    postjudge.inc_problem(rdoc['domain_id'], rdoc['pid'], num_ac_submit=1)
+
+
 async def _post_judge(handler, rdoc):
   accept = rdoc['status'] == constant.record.STATUS_ACCEPTED
-  bus.publish_throttle('record_change', rdoc, rdoc['_id'])
+  record.publish_change(rdoc)
   bus.publish_throttle('push_received-' + str(rdoc['uid']), 
                         {'type': 'success' if accept else 'error', 'message': constant.record.STATUS_TEXTS[rdoc['status']]},
                         rdoc['uid'])
@@ -57,16 +69,10 @@ async def _post_judge(handler, rdoc):
                                               rdoc['uid'], rdoc['_id'], rdoc['pid'],
                                               accept, rdoc['score'], rdoc['status']))
     if not rdoc.get('rejudged'):
-      if await problem.update_status(rdoc['domain_id'], rdoc['pid'], rdoc['uid'],
-                                     rdoc['_id'], rdoc['status']):
-        if accept:
-          await problem.inc(rdoc['domain_id'], rdoc['pid'], 'num_accept', 1)
-          post_coros.append(domain.inc_user(rdoc['domain_id'], rdoc['uid'], num_accept=1))
-      if accept:
-        await problem.inc(rdoc['domain_id'], rdoc['pid'], 'num_ac_submit', 1)
+      post_coros.append(_update_problem_status(rdoc, accept))
     else:
-      await job.record.user_in_problem(rdoc['uid'], rdoc['domain_id'], rdoc['pid'])
-    post_coros.append(job.difficulty.update_problem(rdoc['domain_id'], rdoc['pid']))
+      postjudge.user_in_problem(rdoc['uid'], rdoc['domain_id'], rdoc['pid'])
+    postjudge.update_difficulty(rdoc['domain_id'], rdoc['pid'])
   await asyncio.gather(*post_coros)
 
 @app.route('/judge/clear', 'judge_clear')
@@ -108,18 +114,26 @@ class JudgeNoopHandler(base.Handler):
 class JudgeDataListHandler(base.Handler):
   @base.get_argument
   @base.sanitize
-  async def get(self, last: int=0):
+  async def get(self, last: int=0, limit: int=0, cursor: str=''):
     # TODO(iceboy): This function looks strange.
     # Judge will have PRIV_READ_PROBLEM_DATA,
     # domain administrator will have PERM_READ_PROBLEM_DATA.
     if not self.has_priv(builtin.PRIV_READ_PROBLEM_DATA):
       self.check_perm(builtin.PERM_READ_PROBLEM_DATA)
-    pids = await problem.get_data_list(last)
+    # Judges page with the same last and the returned cursor, then use the time of the first page
+    # as the next last.
+    now = calendar.timegm(datetime.datetime.utcnow().utctimetuple())
+    after = pagination.decode_token(cursor) if cursor else None
+    if after is not None and len(after) != 3:
+      raise error.ValidationError('cursor')
+    pids = await problem.get_data_list(last, limit, after)
     datalist = []
-    for domain_id, pid in pids:
+    for domain_id, pid, _ in pids:
       datalist.append({'domain_id': domain_id, 'pid': pid})
-    self.json({'pids': datalist,
-               'time': calendar.timegm(datetime.datetime.utcnow().utctimetuple())})
+    next_cursor = None
+    if limit and len(pids) == limit:
+      next_cursor = pagination.encode_token(pids[-1])
+    self.json({'pids': datalist, 'time': now, 'cursor': next_cursor})
 
 
 # TODO(iceboy): Move this to RecordCancelHandler.
@@ -160,6 +174,7 @@ class JudgeNotifyConnection(base.Connection):
   @base.require_priv(builtin.PRIV_READ_RECORD_CODE | builtin.PRIV_WRITE_RECORD)
   async def on_open(self):
     self.rids = {}  # delivery_tag -> rid
+    self.buffer = judgebuffer.Buffer(self.user['_id'], self.id)
     bus.subscribe(self.on_problem_data_change, ['problem_data_change'])
     self.channel = await queue.consume('judge', self._on_queue_message)
     asyncio.ensure_future(self.channel.close_event.wait()).add_done_callback(lambda _: self.close())
@@ -175,7 +190,7 @@ class JudgeNotifyConnection(base.Connection):
       self.rids[tag] = rdoc['_id']
       self.send(rid=str(rdoc['_id']), tag=tag, pid=str(rdoc['pid']), domain_id=rdoc['domain_id'],
                 lang=rdoc['lang'], code=rdoc['code'], type=rdoc['type'])
-      bus.publish_throttle('record_change', rdoc, rdoc['_id'])
+      record.publish_change(rdoc)
     else:
       # Record not found, eat it.
       await self.channel.basic_client_ack(tag)
@@ -200,12 +215,10 @@ class JudgeNotifyConnection(base.Connection):
         }
       if 'progress' in kwargs:
         update.setdefault('$set', {})['progress'] = float(kwargs['progress'])
-      rdoc = await record.next_judge(rid, self.user['_id'], self.id, **update)
-      if not rdoc:
-        return
-      bus.publish_throttle('record_change', rdoc, rdoc['_id'])
+      self.buffer.add(rid, update)
     elif key == 'end':
       rid = self.rids.pop(tag)
+      await self.buffer.flush(rid)
       rdoc, _ = await asyncio.gather(record.end_judge(rid, self.user['_id'], self.id,
                                                       int(kwargs['status']),
                                                       int(kwargs['score']),
@@ -217,12 +230,15 @@ class JudgeNotifyConnection(base.Connection):
       await _post_judge(self, rdoc)
 
   async def on_close(self):
+    bus.unsubscribe(self.on_problem_data_change)
+
     async def close():
       async def reset_record(rid):
         rdoc = await record.end_judge(rid, self.user['_id'], self.id,
                                       constant.record.STATUS_WAITING, 0, 0, 0)
-        bus.publish_throttle('record_change', rdoc, rdoc['_id'])
+        record.publish_change(rdoc)
 
+      await self.buffer.flush_all()
       await asyncio.gather(*[reset_record(rid) for rid in self.rids.values()])
       await self.channel.close()
 
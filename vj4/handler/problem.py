@@ -36,7 +36,8 @@ async def render_or_json_problem_list(self, page, ppcount, pcount, pdocs,
     kwargs['path_components'] = self.build_path((self.translate(self.NAME), None))
   if self.prefer_json:
     list_html = self.render_html('partials/problem_list.html', page=page, ppcount=ppcount,
-                                 pcount=pcount, pdocs=pdocs, psdict=psdict)
+                                 pcount=pcount, pdocs=pdocs, psdict=psdict,
+                                 add_qs=kwargs.get('add_qs', ''))
     stat_html = self.render_html('partials/problem_stat.html', pcount=pcount)
     lucky_html = self.render_html('partials/problem_lucky.html', category=category)
     path_html = self.render_html('partials/path.html', path_components=kwargs['path_components'])
@@ -51,6 +52,12 @@ async def render_or_json_problem_list(self, page, ppcount, pcount, pdocs,
                 **kwargs)
 
 
+async def get_ordered_pdocs(domain_id, pids):
+  # TODO(iceboy): projection.
+  pdict = await problem.get_dict(domain_id, pids)
+  return [pdict[pid] for pid in pids if pid in pdict]
+
+
 @app.route('/p', 'problem_main')
 class ProblemMainHandler(base.OperationHandler):
   PROBLEMS_PER_PAGE = 100
@@ -59,17 +66,12 @@ class ProblemMainHandler(base.OperationHandler):
   @base.get_argument
   @base.sanitize
   async def get(self, *, page: int=1, show_only_hidden: bool=False):
-    # TODO(iceboy): projection.
-    if not self.has_perm(builtin.PERM_VIEW_PROBLEM_HIDDEN):
-      f = {'$or': [{'hidden': False}, {'owner_uid': self.user['_id']}, {'shared_uids': self.user['_id']}]}
-    else:
-      f = {}
-    if show_only_hidden:
-      f['hidden'] = True
-    pdocs, ppcount, pcount = await pagination.paginate(problem.get_multi(domain_id=self.domain_id,
-                                                                         **f) \
-                                                              .sort([('doc_id', 1)]),
-                                                       page, self.PROBLEMS_PER_PAGE)
+    index = await problem.get_index(self.domain_id)
+    pids, ppcount, pcount = index.get_page(self.user['_id'],
+                                           self.has_perm(builtin.PERM_VIEW_PROBLEM_HIDDEN),
+                                           page, self.PROBLEMS_PER_PAGE,
+                                           only_hidden=show_only_hidden)
+    pdocs = await get_ordered_pdocs(self.domain_id, pids)
     if self.has_priv(builtin.PRIV_USER_PROFILE):
       # TODO(iceboy): projection.
       psdict = await problem.get_dict_status(self.domain_id,
@@ -117,44 +119,43 @@ class ProblemCategoryHandler(base.OperationHandler):
     return list(filter(lambda s: bool(s), map(lambda s: s.strip(), string.split(delim))))
 
   @staticmethod
-  def build_query(query_string):
-    category_groups = ProblemCategoryHandler.my_split(query_string, ' ')
-    if not category_groups:
-      return {}
-    query = {'$or': []}
-    for g in category_groups:
+  def parse_query(query_string):
+    """Returns groups of (key, value) pairs, where key is 'category' or 'tag'."""
+    groups = []
+    for g in ProblemCategoryHandler.my_split(query_string, ' '):
       categories = ProblemCategoryHandler.my_split(g, ',')
       if not categories:
         continue
-      sub_query = {'$and': []}
+      group = []
       for c in categories:
         if c in builtin.PROBLEM_CATEGORIES \
            or c in builtin.PROBLEM_SUB_CATEGORIES:
-          sub_query['$and'].append({'category': c})
+          group.append(('category', c))
         else:
-          sub_query['$and'].append({'tag': c})
-      query['$or'].append(sub_query)
-    return query
+          group.append(('tag', c))
+      groups.append(group)
+    return groups
+
+  @staticmethod
+  def build_query(query_string):
+    category_groups = ProblemCategoryHandler.parse_query(query_string)
+    if not category_groups:
+      return {}
+    return {'$or': [{'$and': [{key: value} for key, value in group]}
+                    for group in category_groups]}
 
   @base.require_perm(builtin.PERM_VIEW_PROBLEM)
   @base.get_argument
   @base.route_argument
   @base.sanitize
   async def get(self, *, category: str, page: int=1):
-    # TODO(iceboy): projection.
-    category_query = ProblemCategoryHandler.build_query(category)
-    query = {'$and': []}
-    if not self.has_perm(builtin.PERM_VIEW_PROBLEM_HIDDEN):
-      visibility_query = {'$or': []}
-      visibility_query['$or'].append({'hidden': False})
-      visibility_query['$or'].append({'owner_uid': self.user['_id']})
-      visibility_query['$or'].append({'shared_uids': self.user['_id']})
-      query['$and'].append(visibility_query)
-    query['$and'].append(category_query)
-    pdocs, ppcount, pcount = await pagination.paginate(problem.get_multi(domain_id=self.domain_id,
-                                                                         **query) \
-                                                              .sort([('doc_id', 1)]),
-                                                       page, self.PROBLEMS_PER_PAGE)
+    index = await problem.get_index(self.domain_id)
+    pids, ppcount, pcount = index.get_page(self.user['_id'],
+                                           self.has_perm(builtin.PERM_VIEW_PROBLEM_HIDDEN),
+                                           page, self.PROBLEMS_PER_PAGE,
+                                           category_groups=ProblemCategoryHandler.parse_query(
+                                               category))
+    pdocs = await get_ordered_pdocs(self.domain_id, pids)
     if self.has_priv(builtin.PRIV_USER_PROFILE):
       # TODO(iceboy): projection.
       psdict = await problem.get_dict_status(self.domain_id,
@@ -370,7 +371,10 @@ class ProblemPretestConnection(record_handler.RecordVisibilityMixin, base.Connec
       show_status, tdoc = await self.rdoc_contest_visible(rdoc)
       if not show_status:
         return
-    self.send(rdoc=rdoc)
+    # The event does not carry the cases and texts.
+    rdoc = await record.get(rdoc['_id'], record.PROJECTION_PUBLIC)
+    if rdoc:
+      self.send(rdoc=rdoc)
 
   async def on_close(self):
     bus.unsubscribe(self.on_record_change)
@@ -838,10 +842,13 @@ class ProblemStatisticsHandler(base.Handler):
 
 @app.route('/p/search', 'problem_search')
 class ProblemSearchHandler(base.Handler):
+  PROBLEMS_PER_PAGE = 100
+
+  @base.require_perm(builtin.PERM_VIEW_PROBLEM)
   @base.get_argument
   @base.route_argument
   @base.sanitize
-  async def get(self, *, q: str):
+  async def get(self, *, q: str, page: int=1):
     q = q.strip()
     if not q:
       self.json_or_redirect(self.referer_or_main)
@@ -853,5 +860,24 @@ class ProblemSearchHandler(base.Handler):
     if pdoc:
       self.redirect(self.reverse_url('problem_detail', pid=pdoc['doc_id']))
       return
-    self.redirect('http://cn.bing.com/search?q={0}+site%3A{1}' \
-                  .format(parse.quote(q), parse.quote(options.url_prefix)))
+    query = {}
+    if not self.has_perm(builtin.PERM_VIEW_PROBLEM_HIDDEN):
+      query['$or'] = [{'hidden': False},
+                      {'owner_uid': self.user['_id']},
+                      {'shared_uids': self.user['_id']}]
+    pdocs, ppcount, pcount = await pagination.paginate(
+        problem.search(self.domain_id, q, **query), page, self.PROBLEMS_PER_PAGE)
+    if self.has_priv(builtin.PRIV_USER_PROFILE):
+      psdict = await problem.get_dict_status(self.domain_id,
+                                             self.user['_id'],
+                                             (pdoc['doc_id'] for pdoc in pdocs))
+    else:
+      psdict = None
+    page_title = '{0}: {1}'.format(self.translate('Search'), q)
+    path_components = self.build_path(
+        (self.translate('problem_main'), self.reverse_url('problem_main')),
+        (q, None))
+    await render_or_json_problem_list(self, page=page, ppcount=ppcount, pcount=pcount,
+                                      pdocs=pdocs, category='', psdict=psdict,
+                                      page_title=page_title, path_components=path_components,
+                                      q=q, add_qs=parse.urlencode({'q': q}))
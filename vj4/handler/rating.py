@@ -53,6 +53,18 @@ class RatingDeleteHandler(base.Handler):
     await rating_model.delete_rating(domain_id=self.domain_id, contest_id=tid)
     self.redirect(self.reverse_url('contest_detail', tid=tid))
 
+@app.route('/rating/{tid:\w{24}}/process', 'rating_process')
+class RatingReplayHandler(base.Handler):
+
+  @base.require_perm(builtin.PERM_PROCESS_RATING)
+  @base.get_argument
+  @base.route_argument
+  @base.sanitize
+  async def get(self, *, tid: objectid.ObjectId):
+    await rating_job.replay_contest_ratings(domain_id=self.domain_id, tid=tid)
+    await rank_job.run(domain_id=self.domain_id, keyword='rating')
+    self.redirect(self.reverse_url('contest_detail', tid=tid))
+
 @app.route('/rating/process', 'rating_process_all')
 class RatingProcessHandler(base.Handler):
   
@@ -1,6 +1,8 @@
 import asyncio
 import calendar
+import collections
 import datetime
+import itertools
 import struct
 import urllib.parse
 from bson import objectid
@@ -25,10 +27,13 @@ from vj4.util import options
 class RecordVisibilityMixin(contest.ContestVisibilityMixin):
   async def rdoc_contest_visible(self, rdoc):
     tdoc = await contest.get(rdoc['domain_id'], rdoc.get('ttype', document.TYPE_CONTEST), rdoc['tid'])
+    return self.rdoc_tdoc_visible(rdoc, tdoc), tdoc
+
+  def rdoc_tdoc_visible(self, rdoc, tdoc):
     if self.user['_id'] == rdoc['uid']:
-      return self.can_show_record(tdoc), tdoc
+      return self.can_show_record(tdoc)
     else:
-      return self.can_show_scoreboard(tdoc), tdoc
+      return self.can_show_scoreboard(tdoc)
 
 
 class RecordCommonOperationMixin(object):
@@ -119,6 +124,73 @@ class RecordMainHandler(RecordMixin, base.Handler):
         query_string=query_string)
 
 
+class _RecordMainDispatcher(object):
+  """Dispatches record_change events to the matching RecordMainConnections.
+
+  Connections are indexed by their filter on (domain_id, uid, pid, tid), so an event only visits
+  the connections it may match. The documents of an event are fetched once, and each row is
+  rendered once for all connections which would render it identically.
+  """
+  INDEX_KEYS = ('domain_id', 'uid', 'pid', 'tid')
+  ANY = object()
+
+  def __init__(self):
+    self.index = collections.defaultdict(set)
+    self.index_keys = {}
+
+  def add(self, conn):
+    if not self.index:
+      bus.subscribe(self.on_record_change, ['record_change'])
+    key = tuple(conn.query.get(key, self.ANY) for key in self.INDEX_KEYS)
+    self.index_keys[conn] = key
+    self.index[key].add(conn)
+
+  def remove(self, conn):
+    key = self.index_keys.pop(conn, None)
+    if key is None:
+      return
+    conns = self.index[key]
+    conns.remove(conn)
+    if not conns:
+      del self.index[key]
+      if not self.index:
+        bus.unsubscribe(self.on_record_change)
+
+  def match(self, rdoc):
+    for index_key in itertools.product(*((rdoc[key], self.ANY) for key in self.INDEX_KEYS)):
+      for conn in self.index.get(index_key, ()):
+        if all(key in self.INDEX_KEYS or rdoc[key] == value for key, value in conn.query.items()):
+          yield conn
+
+  async def on_record_change(self, e):
+    rdoc = e['value']
+    conns = list(self.match(rdoc))
+    if rdoc['tid'] and conns:
+      tdoc = await contest.get(rdoc['domain_id'], rdoc.get('ttype', document.TYPE_CONTEST),
+                               rdoc['tid'])
+      conns = [conn for conn in conns if conn.rdoc_tdoc_visible(rdoc, tdoc)]
+    if not conns:
+      return
+    domain_ids = list(set(conn.domain_id for conn in conns))
+    udoc, pdoc, *dudocs = await asyncio.gather(
+        user.get_by_uid(rdoc['uid']),
+        problem.get(rdoc['domain_id'], rdoc['pid']),
+        *[domain.get_user(domain_id, rdoc['uid']) for domain_id in domain_ids])
+    dudict = dict(zip(domain_ids, dudocs))
+    htmls = {}
+    for conn in conns:
+      show_pdoc = conn.can_show_record_pdoc(pdoc)
+      key = conn.get_render_key(rdoc, show_pdoc)
+      if key not in htmls:
+        htmls[key] = conn.render_html('record_main_tr.html', rdoc=rdoc, udoc=udoc,
+                                      dudoc=dudict[conn.domain_id],
+                                      pdoc=pdoc if show_pdoc else None)
+      conn.send(html=htmls[key])
+
+
+_record_main_dispatcher = _RecordMainDispatcher()
+
+
 @app.connection_route('/records-conn', 'record_main-conn')
 class RecordMainConnection(RecordMixin, base.Connection):
   @base.get_argument
@@ -126,28 +198,24 @@ class RecordMainConnection(RecordMixin, base.Connection):
   async def on_open(self, *, uid_or_name: str='', pid: str='', tid: str=''):
     await super(RecordMainConnection, self).on_open()
     self.query = await self.get_filter_query(uid_or_name, pid, tid)
-    bus.subscribe(self.on_record_change, ['record_change'])
+    _record_main_dispatcher.add(self)
 
-  async def on_record_change(self, e):
-    rdoc = e['value']
-    for key, value in self.query.items():
-      if rdoc[key] != value:
-        return
-    if rdoc['tid']:
-      show_status, tdoc = await self.rdoc_contest_visible(rdoc)
-      if not show_status:
-        return
-    # TODO(iceboy): projection.
-    udoc, dudoc, pdoc = await asyncio.gather(user.get_by_uid(rdoc['uid']),
-                                             domain.get_user(self.domain_id, rdoc['uid']),
-                                             problem.get(rdoc['domain_id'], rdoc['pid']))
+  def can_show_record_pdoc(self, pdoc):
     # check permission for visibility: hidden problem
-    if pdoc.get('hidden', False) and (pdoc['domain_id'] != self.domain_id or not self.can_see_pdoc(pdoc)):
-      pdoc = None
-    self.send(html=self.render_html('record_main_tr.html', rdoc=rdoc, udoc=udoc, dudoc=dudoc, pdoc=pdoc))
+    return not pdoc.get('hidden', False) or (pdoc['domain_id'] == self.domain_id
+                                             and self.can_see_pdoc(pdoc))
+
+  def get_render_key(self, rdoc, show_pdoc):
+    """Connections with the same key render the same row for the record."""
+    if ((rdoc['domain_id'] == self.domain_id and self.has_perm(builtin.PERM_REJUDGE))
+        or self.has_priv(builtin.PRIV_REJUDGE)):
+      csrf_token = self.csrf_token
+    else:
+      csrf_token = None
+    return self.domain_id, self.view_lang, self.timezone, show_pdoc, csrf_token
 
   async def on_close(self):
-    bus.unsubscribe(self.on_record_change)
+    _record_main_dispatcher.remove(self)
 
 
 @app.route('/records/{rid}', 'record_detail')
@@ -208,13 +276,18 @@ class RecordDetailConnection(RecordMixin, base.Connection):
       if not show_status:
         self.close()
         return
+    self.rev = rdoc.get('rev', 0)
     bus.subscribe(self.on_record_change, ['record_change'])
     self.send_record(rdoc)
 
   async def on_record_change(self, e):
-    rdoc = e['value']
-    if rdoc['_id'] != self.rid:
+    if e['value']['_id'] != self.rid or e['value'].get('rev', 0) < self.rev:
+      return
+    # The event does not carry the cases and texts.
+    rdoc = await record.get(self.rid, record.PROJECTION_PUBLIC)
+    if not rdoc or rdoc.get('rev', 0) < self.rev:
       return
+    self.rev = rdoc.get('rev', 0)
     self.send_record(rdoc)
 
   def send_record(self, rdoc):
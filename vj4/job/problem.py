@@ -0,0 +1,46 @@
+import logging
+
+from vj4 import db
+from vj4 import error
+from vj4.model import document
+from vj4.model.adaptor import problem
+from vj4.util import argmethod
+
+
+_logger = logging.getLogger(__name__)
+
+
+@argmethod.wrap
+async def sync_data_changed_at():
+  """Set data_changed_at of problems uploaded before it existed, from the upload date.
+
+  Problems without the field are not in the judge data list. Run by upgrader.from_1_to_2.
+  """
+  _logger.info('Problem data changed time')
+  coll = db.coll('document')
+  pdocs = coll.find({'doc_type': document.TYPE_PROBLEM,
+                     'data': {'$ne': None},
+                     'data_changed_at': {'$exists': False}})
+  bulk = coll.initialize_unordered_bulk_op()
+  execute = False
+  _logger.info('Syncing')
+  async for pdoc in pdocs:
+    try:
+      fdoc = await problem.get_data(pdoc)
+    except error.ProblemNotFoundError:
+      # Copied from a deleted problem.
+      _logger.warning('Source of problem %s/%s not found, skipped',
+                      pdoc['domain_id'], pdoc['doc_id'])
+      continue
+    if not fdoc or not fdoc.get('uploadDate'):
+      continue
+    bulk.find({'_id': pdoc['_id']}) \
+        .update_one({'$set': {'data_changed_at': fdoc['uploadDate']}})
+    execute = True
+  if execute:
+    _logger.info('Committing')
+    await bulk.execute()
+
+
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
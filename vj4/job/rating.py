@@ -1,5 +1,8 @@
+import asyncio
 import datetime
+import functools
 import math
+import operator
 
 from bson import objectid
 from pymongo import errors
@@ -33,6 +36,11 @@ class Contestant:
         self.delta = 0
 
 
+DEFAULT_RATING = 400
+RATING_MIN = 1
+RATING_MAX = 8000
+
+
 def get_seed(contestants, rating, seed_cache):
     if rating in seed_cache:
         return seed_cache[rating]
@@ -45,12 +53,14 @@ def get_seed(contestants, rating, seed_cache):
     return result
 
 
-def get_rating_to_rank(contestants, rank, seed_cache):
-    left = 1
-    right = 8000
+def get_rating_to_rank(contestants, rank, seed_cache, get_seed_func=None):
+    if get_seed_func is None:
+        get_seed_func = lambda rating: get_seed(contestants, rating, seed_cache)
+    left = RATING_MIN
+    right = RATING_MAX
     while right - left > 1:
         mid = (left + right) // 2
-        if get_seed(contestants, mid, seed_cache) < rank:
+        if get_seed_func(mid) < rank:
             right = mid
         else:
             left = mid
@@ -61,6 +71,48 @@ def get_elo_win_probability(ra, rb):
     return 1.0 / (1.0 + math.pow(10, (rb - ra) / 400.0))
 
 
+class SeedTable:
+    """Seeds of a contest computed from a precomputed win probability curve.
+
+    get_elo_win_probability() only depends on the rating difference, so the curve is computed once
+    for every difference which can be probed. A seed is then a gather from the curve followed by a
+    left-to-right sum in contestant order, which gives the same floating point result as
+    get_seed().
+    """
+
+    def __init__(self, contestants):
+        ratings = [c.rating for c in contestants]
+        low = min(RATING_MIN, min(ratings))
+        high = max(RATING_MAX, max(ratings))
+        self._low = low
+        self._high = high
+        max_rating = max(ratings)
+        min_rating = min(ratings)
+        self._curve = [get_elo_win_probability(0, diff)
+                       for diff in range(low - max_rating, high - min_rating + 1)]
+        indices = [max_rating - rating for rating in ratings]
+        if len(indices) == 1:
+            self._gather = lambda curve: (curve[indices[0]],)
+        else:
+            self._gather = operator.itemgetter(*indices)
+        self._cache = {}
+
+    @staticmethod
+    def supports(contestants):
+        return all(type(c.rating) is int for c in contestants)
+
+    def get(self, rating):
+        if rating in self._cache:
+            return self._cache[rating]
+        if not self._low <= rating <= self._high:
+            raise ValueError('rating out of range')
+        # curve[rating - low + max_rating - other.rating] is the win probability of other.
+        offset = rating - self._low
+        result = functools.reduce(operator.add, self._gather(self._curve[offset:]), 1)
+        self._cache[rating] = result
+        return result
+
+
 def sort_by_rating_desc(contestants):
     contestants.sort(key=lambda x: x.rating, reverse=True)
 
@@ -69,14 +121,18 @@ def process(contestants):
     if not contestants:
         return
 
-    # Caches the calculated seed for a given rating
-    seed_cache = {}
+    if SeedTable.supports(contestants):
+        get_seed_func = SeedTable(contestants).get
+    else:
+        # Caches the calculated seed for a given rating
+        seed_cache = {}
+        get_seed_func = lambda rating: get_seed(contestants, rating, seed_cache)
 
     for contestant in contestants:
         rating = contestant.rating
-        contestant.seed = get_seed(contestants, rating, seed_cache) - 0.5
+        contestant.seed = get_seed_func(rating) - 0.5
         mid_rank = math.sqrt(contestant.rank * contestant.seed)
-        contestant.need_rating = get_rating_to_rank(contestants, mid_rank, seed_cache)
+        contestant.need_rating = get_rating_to_rank(contestants, mid_rank, None, get_seed_func)
         contestant.delta = (contestant.need_rating - rating) // 2
 
     sort_by_rating_desc(contestants)
@@ -139,23 +195,52 @@ async def delete_rating(domain_id: str, tid: objectid.ObjectId):
 
 @argmethod.wrap
 async def process_all_contest_ratings(domain_id: str):
-    contests = await rating_model.get_sorted_by_attend_at(domain_id)
-    for contest in contests:
-        await process_contest_rating(domain_id, contest["_id"])
+    await replay_contest_ratings(domain_id)
 
 
-async def process_contest_rating(domain_id: str, tid: objectid.ObjectId):
-    tdoc, rows, udict = await contest.get_scoreboard_details(
-        domain_id, document.TYPE_CONTEST, tid, True, False
-    )
-    previous_rating = {}
+@argmethod.wrap
+async def replay_contest_ratings(domain_id: str, tid: objectid.ObjectId = None):
+    """Recompute the ratings of the contest and every later rated contest.
 
-    previous_rating_changes = await rating_model.get_latest_rating_changes(
-        domain_id, [u for u in udict]
+    The ratings before the contest are restored from the rating_changes of the earlier contests,
+    and all new rating changes are written in one bulk operation at the end. Without tid, every
+    rated contest is replayed.
+    """
+    contests = await rating_model.get_sorted_by_attend_at(domain_id)
+    rating_ids = [c["_id"] for c in contests]
+    if tid is None:
+        start = 0
+    elif tid in rating_ids:
+        start = rating_ids.index(tid)
+    else:
+        raise error.DocumentNotFoundError(domain_id, "rating", tid)
+    replay_ids = rating_ids[start:]
+    ratings, affected_uids = await asyncio.gather(
+        rating_model.get_checkpoint(domain_id, rating_ids[:start]),
+        rating_model.get_rating_change_uids(domain_id, replay_ids),
     )
+    calculated_at = datetime.datetime.utcnow()
+    rating_changes = {}
+    for rating_id in replay_ids:
+        tdoc, rows, udict = await contest.get_scoreboard_details(
+            domain_id, document.TYPE_CONTEST, rating_id, True, False
+        )
+        changes = get_contest_rating_changes(domain_id, tdoc, rows, ratings, calculated_at)
+        for change in changes:
+            ratings[change["uid"]] = change["new_rating"]
+        rating_changes[rating_id] = changes
+    affected_uids = set(affected_uids)
+    for changes in rating_changes.values():
+        affected_uids.update(change["uid"] for change in changes)
+    await rating_model.replace_rating_changes(
+        domain_id, rating_changes, {uid: ratings.get(uid) for uid in affected_uids}
+    )
+    return rating_changes
 
-    for u in previous_rating_changes:
-        previous_rating[u["uid"]] = u["rating"] if "rating" in u else 400
+
+def get_contest_rating_changes(
+    domain_id: str, tdoc, rows, previous_rating: Dict[int, int], calculated_at
+):
     contestants: List[Contestant] = []
 
     ranks = {}
@@ -163,21 +248,21 @@ async def process_contest_rating(domain_id: str, tid: objectid.ObjectId):
         uid = row[1]["raw"]["_id"]
         rank = row[0]["value"]
         ranks[uid] = rank
-        prev_rating = previous_rating[uid]
+        prev_rating = previous_rating.get(uid, DEFAULT_RATING)
         c = Contestant(uid, rank, prev_rating)
         contestants.append(c)
 
     rating_delta = calculate_rating_changes(contestants)
     rating_changes = []
-    calculated_at = datetime.datetime.utcnow()
     for uid in rating_delta:
+        prev_rating = previous_rating.get(uid, DEFAULT_RATING)
         rating_changes.append(
             {
                 "domain_id": domain_id,
-                "rating_id": tid,
+                "rating_id": tdoc["doc_id"],
                 "uid": uid,
-                "new_rating": previous_rating[uid] + rating_delta[uid],
-                "previous_rating": previous_rating[uid],
+                "new_rating": prev_rating + rating_delta[uid],
+                "previous_rating": prev_rating,
                 "delta": rating_delta[uid],
                 "attend_at": tdoc["begin_at"],
                 "calculated_at": calculated_at,
@@ -185,12 +270,6 @@ async def process_contest_rating(domain_id: str, tid: objectid.ObjectId):
                 "rank": ranks[uid],
             }
         )
-
-    await rating_model.add_rating_changes(
-        domain_id,
-        rating_changes
-    )
-
     return rating_changes
 
 
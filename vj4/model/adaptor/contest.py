@@ -15,6 +15,7 @@ from vj4.model import document
 from vj4.model import user
 from vj4.model import domain
 from vj4.model.adaptor import problem
+from vj4.service import scoreboard
 from vj4.util import argmethod
 from vj4.util import misc
 from vj4.util import rank
@@ -465,6 +466,13 @@ RULES = {
 }
 
 
+def _get_status_sort_key(rule):
+  """Python sort key which orders status documents like the MongoDB sort of the rule."""
+  status_sort = RULES[rule].status_sort
+  return lambda tsdoc: tuple(-tsdoc.get(k, 0) if v == -1 else tsdoc.get(k, 0)
+                             for k, v in status_sort)
+
+
 @argmethod.wrap
 async def add(domain_id: str, doc_type: int,
               title: str, content: str, owner_uid: int, rule: int,
@@ -560,7 +568,9 @@ async def edit(domain_id: str, doc_type: int, tid: objectid.ObjectId, **kwargs):
         effective_scores = _fit_cf_max_scores(effective_pids, effective_scores)
       kwargs['cf_max_scores'] = effective_scores
       _validate_cf_max_scores(effective_pids, effective_scores)
-  return await document.set(domain_id, doc_type, tid, **kwargs)
+  tdoc = await document.set(domain_id, doc_type, tid, **kwargs)
+  scoreboard.invalidate(domain_id, doc_type, tid)
+  return tdoc
 
 
 def get_multi(domain_id: str, doc_type: int, fields=None, **kwargs):
@@ -587,7 +597,9 @@ async def attend(domain_id: str, doc_type: int, tid: objectid.ObjectId, uid: int
       raise error.ContestAlreadyAttendedError(domain_id, tid, uid) from None
     elif doc_type == document.TYPE_HOMEWORK:
       raise error.HomeworkAlreadyAttendedError(domain_id, tid, uid) from None
-  return await document.inc(domain_id, doc_type, tid, 'attend', 1)
+  tdoc = await document.inc(domain_id, doc_type, tid, 'attend', 1)
+  scoreboard.invalidate(domain_id, doc_type, tid)
+  return tdoc
 
 
 @argmethod.wrap
@@ -662,6 +674,8 @@ async def update_status(domain_id: str, doc_type: int, tid: objectid.ObjectId, u
   stats = RULES[tdoc['rule']].stat_func(tdoc, journal)
   tsdoc = await document.rev_set_status(domain_id, tdoc['doc_type'], tid, uid, tsdoc['rev'],
                                         journal=journal, **stats)
+  if tsdoc:
+    scoreboard.publish_status(domain_id, tdoc['doc_type'], tid, tsdoc)
   return tsdoc
 
 
@@ -680,6 +694,7 @@ async def recalc_status(domain_id: str, doc_type: int, tid: objectid.ObjectId):
       stats = RULES[tdoc['rule']].stat_func(tdoc, journal)
       await document.rev_set_status(domain_id, doc_type, tid, tsdoc['uid'], tsdoc['rev'],
                                     return_doc=False, journal=journal, **stats)
+  scoreboard.invalidate(domain_id, doc_type, tid)
 
 @argmethod.wrap
 async def get_scoreboard_details(domain_id: str, doc_type: int, tid: objectid.ObjectId, filter_no_submission: bool=True, is_export: bool=False):
@@ -702,6 +717,21 @@ async def get_scoreboard_rows(domain_id: str, doc_type: int, tid: objectid.Objec
     tdoc, rows, udict = await get_scoreboard_details(domain_id, doc_type, tid, filter_no_submission, is_export)
     return rows
 
+async def _load_scoreboard(domain_id, doc_type, tid):
+  tdoc, tsdocs = await get_and_list_status(domain_id, doc_type, tid, fields={'journal': 0})
+  udict, dudict, pdict = await asyncio.gather(
+      user.get_dict([tsdoc['uid'] for tsdoc in tsdocs]),
+      domain.get_dict_user_by_uid(domain_id, [tsdoc['uid'] for tsdoc in tsdocs]),
+      problem.get_dict(domain_id, tdoc['pids']))
+  return scoreboard.Board(tdoc, tsdocs, udict, dudict, pdict, _get_status_sort_key(tdoc['rule']))
+
+
+def _build_scoreboard_rows(is_export, translate, board):
+  rule = RULES[board.tdoc['rule']]
+  return rule.scoreboard_func(is_export, translate, board.tdoc, rule.rank_func(board.tsdocs),
+                              board.udict, board.dudict, board.pdict)
+
+
 def _parse_pids(pids_str):
   pids = misc.dedupe(map(document.convert_doc_id, pids_str.split(',')))
   return pids
@@ -821,20 +851,17 @@ class ContestCommonOperationMixin(object):
   async def get_scoreboard(self, doc_type: int, tid: objectid.ObjectId, is_export: bool=False):
     if doc_type not in [document.TYPE_CONTEST, document.TYPE_HOMEWORK]:
       raise error.InvalidArgumentError('doc_type')
-    tdoc, tsdocs = await get_and_list_status(self.domain_id, doc_type, tid)
+    board = await scoreboard.get((self.domain_id, doc_type, tid), _load_scoreboard)
+    tdoc = board.tdoc
     if not self.can_show_scoreboard(tdoc):
       if doc_type == document.TYPE_CONTEST:
         raise error.ContestScoreboardHiddenError(self.domain_id, tid)
       elif doc_type == document.TYPE_HOMEWORK:
         raise error.HomeworkScoreboardHiddenError(self.domain_id, tid)
-    udict, dudict, pdict = await asyncio.gather(
-        user.get_dict([tsdoc['uid'] for tsdoc in tsdocs]),
-        domain.get_dict_user_by_uid(self.domain_id, [tsdoc['uid'] for tsdoc in tsdocs]),
-        problem.get_dict(self.domain_id, tdoc['pids']))
-    ranked_tsdocs = RULES[tdoc['rule']].rank_func(tsdocs)
-    rows = RULES[tdoc['rule']].scoreboard_func(is_export, self.translate, tdoc,
-                                                       ranked_tsdocs, udict, dudict, pdict)
-    return tdoc, rows, udict
+    # The rows are shared with other requests through the board, do not modify them.
+    rows = board.get_rows((is_export, self.view_lang),
+                          functools.partial(_build_scoreboard_rows, is_export, self.translate))
+    return tdoc, rows, board.udict
   
   async def get_unfrozen_scoreboard(self, doc_type: int, tid: objectid.ObjectId, is_export: bool=False):
     if doc_type not in [document.TYPE_CONTEST, document.TYPE_HOMEWORK]:
@@ -858,9 +885,7 @@ class ContestCommonOperationMixin(object):
       journal = _get_status_journal(tsdoc)
       stats = RULES[tdoc['rule']].stat_func(tdoc, journal)
       tsdoc.update(stats)
-    # convert mongodb sort to python sort
-    sort_func = lambda x: tuple((x.get(k, 0) * -1 if v == -1 else x.get(k, 0)) for k, v in RULES[tdoc['rule']].status_sort)
-    tsdocs = sorted(tsdocs, key=sort_func)
+    tsdocs = sorted(tsdocs, key=_get_status_sort_key(tdoc['rule']))
     ranked_tsdocs = RULES[tdoc['rule']].rank_func(tsdocs)
     rows = RULES[tdoc['rule']].scoreboard_func(is_export, self.translate, tdoc,
                                                        ranked_tsdocs, udict, dudict, pdict)
@@ -15,6 +15,7 @@ from vj4.util import validator
 
 ALLOWED_DOC_TYPES = [document.TYPE_PROBLEM, document.TYPE_PROBLEM_LIST,
                      document.TYPE_CONTEST, document.TYPE_TRAINING]
+SORT = [('update_at', -1), ('doc_id', -1)]
 
 
 def node_id(ddoc):
@@ -184,8 +185,7 @@ def get_multi(domain_id: str, *, fields=None, **kwargs):
                             doc_type=document.TYPE_DISCUSSION,
                             fields=fields,
                             **kwargs) \
-                 .sort([('update_at', -1),
-                        ('doc_id', -1)])
+                 .sort(SORT)
 
 
 @argmethod.wrap
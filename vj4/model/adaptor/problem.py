@@ -1,3 +1,4 @@
+import asyncio
 import collections
 import datetime
 import itertools
@@ -13,6 +14,8 @@ from vj4.model import document
 from vj4.model import domain
 from vj4.model import fs
 from vj4.service import bus
+from vj4.service import problemindex
+from vj4.service import queue
 from vj4.util import argmethod
 from vj4.util import validator
 
@@ -40,11 +43,15 @@ async def add(domain_id: str, title: str, content: str, owner_uid: int,
   validator.check_title(title)
   validator.check_content(content)
   validator.check_dataset_hint(dataset_hint)
+  kwargs = {}
+  if data:
+    kwargs['data_changed_at'] = _get_data_changed_at()
   pid = await document.add(domain_id, content, owner_uid, document.TYPE_PROBLEM,
                            pid, title=title, data=data, category=category, tag=tag,
                            hidden=hidden, num_submit=0, num_accept=0, num_ac_submit=0, 
-                           ac_msg=ac_msg, dataset_hint=dataset_hint)
-  await domain.inc_user(domain_id, owner_uid, num_problems=1)
+                           ac_msg=ac_msg, dataset_hint=dataset_hint, **kwargs)
+  await asyncio.gather(domain.inc_user(domain_id, owner_uid, num_problems=1),
+                       problemindex.invalidate(domain_id))
   return pid
 
 
@@ -91,6 +98,8 @@ async def edit(domain_id: str, pid: document.convert_doc_id, **kwargs):
   pdoc = await document.set(domain_id, document.TYPE_PROBLEM, pid, **kwargs)
   if not pdoc:
     raise error.DocumentNotFoundError(domain_id, document.TYPE_PROBLEM, pid)
+  if problemindex.INDEX_FIELDS.intersection(kwargs):
+    await problemindex.invalidate(domain_id)
   return pdoc
 
 
@@ -105,6 +114,23 @@ def get_multi(*, fields=None, **kwargs):
   return document.get_multi(doc_type=document.TYPE_PROBLEM, fields=fields, **kwargs)
 
 
+def search(domain_id: str, query: str, *, fields=None, **kwargs):
+  """Search problems by title, content, tags and categories, most relevant first."""
+  return get_multi(domain_id=domain_id, fields=fields, **{'$text': {'$search': query}}, **kwargs) \
+         .sort([('score', {'$meta': 'textScore'}), ('doc_id', 1)])
+
+
+async def _load_index(domain_id):
+  return await get_multi(domain_id=domain_id, fields=problemindex.FIELDS) \
+                 .sort([('doc_id', 1)]) \
+                 .to_list()
+
+
+async def get_index(domain_id):
+  """Get the cached problemindex.Index of a domain."""
+  return await problemindex.get(domain_id, _load_index)
+
+
 @argmethod.wrap
 async def get_random_id(domain_id: str, **kwargs):
   # Motor 3.x removed cursor.count(). Use collection.count_documents() instead
@@ -299,12 +325,26 @@ async def get_data(pdoc):
   return await fs.get_meta(data)
 
 
+def _get_data_changed_at():
+  # MongoDB stores milliseconds, truncate so that cursors compare equal to the stored value.
+  now = datetime.datetime.utcnow()
+  return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
 @argmethod.wrap
 async def set_data(domain_id: str, pid: document.convert_doc_id, data: objectid.ObjectId):
-  pdoc = await document.set(domain_id, document.TYPE_PROBLEM, pid, data=data)
+  data_changed_at = _get_data_changed_at()
+  pdoc = await document.set(domain_id, document.TYPE_PROBLEM, pid,
+                            data=data, data_changed_at=data_changed_at)
   if not pdoc:
     raise error.DocumentNotFoundError(domain_id, document.TYPE_PROBLEM, pid)
-  await bus.publish('problem_data_change', {'domain_id': domain_id, 'pid': pid})
+  # Copied problems link to the data of this problem, so their data changes too.
+  await db.coll('document').update_many({'doc_type': document.TYPE_PROBLEM,
+                                         'data.domain': domain_id,
+                                         'data.pid': pid},
+                                        {'$set': {'data_changed_at': data_changed_at}})
+  await asyncio.gather(bus.publish('problem_data_change', {'domain_id': domain_id, 'pid': pid}),
+                       queue.publish('dataset', domain_id=domain_id, pid=pid))
   return pdoc
 
 
@@ -313,26 +353,30 @@ async def set_hidden(domain_id: str, pid: document.convert_doc_id, hidden: bool)
   pdoc = await document.set(domain_id, document.TYPE_PROBLEM, pid, hidden=hidden)
   if not pdoc:
     raise error.DocumentNotFoundError(domain_id, document.TYPE_PROBLEM, pid)
+  await problemindex.invalidate(domain_id)
   return pdoc
 
 
 @argmethod.wrap
-async def get_data_list(last: int):
-  last_datetime = datetime.datetime.utcfromtimestamp(last)
-  # TODO(twd2): performance improve, more elegant
-  coll = db.coll('document')
-  pdocs = coll.find({'doc_type': document.TYPE_PROBLEM})
-  pids = []  # with domain_id
-  async for pdoc in pdocs:
-    data = await get_data(pdoc)
-    if not data:
-      continue
-    date = data['uploadDate']
-    if not date:
-      continue
-    if last_datetime < date:
-      pids.append((pdoc['domain_id'], pdoc['doc_id']))
-  return list(set(pids))
+async def get_data_list(last: int, limit: int=0, after: list=None):
+  """Get problems whose data changed after the timestamp last.
+
+  Returns a list of (domain_id, pid, data_changed_at) ordered by (data_changed_at, domain_id, pid).
+  Pass the last tuple of a page as after to get the next page.
+  """
+  query = {'doc_type': document.TYPE_PROBLEM,
+           'data_changed_at': {'$gt': datetime.datetime.utcfromtimestamp(last)}}
+  if after:
+    after_domain_id, after_pid, after_at = after
+    query['$or'] = [{'data_changed_at': {'$gt': after_at}},
+                    {'data_changed_at': after_at, 'domain_id': {'$gt': after_domain_id}},
+                    {'data_changed_at': after_at, 'domain_id': after_domain_id,
+                     'doc_id': {'$gt': after_pid}}]
+  pdocs = db.coll('document').find(query, projection={'domain_id': 1, 'doc_id': 1,
+                                                      'data_changed_at': 1}) \
+                             .sort([('data_changed_at', 1), ('domain_id', 1), ('doc_id', 1)]) \
+                             .limit(limit)
+  return [(pdoc['domain_id'], pdoc['doc_id'], pdoc['data_changed_at']) async for pdoc in pdocs]
 
 
 @argmethod.wrap
@@ -352,11 +396,15 @@ async def update_status(domain_id: str, pid: document.convert_doc_id, uid: int,
 
 @argmethod.wrap
 async def share(domain_id: str, pid: document.convert_doc_id, uid: int):
-  return await document.add_element_to_set(domain_id, document.TYPE_PROBLEM, pid, 'shared_uids', uid)
+  pdoc = await document.add_element_to_set(domain_id, document.TYPE_PROBLEM, pid, 'shared_uids', uid)
+  await problemindex.invalidate(domain_id)
+  return pdoc
 
 @argmethod.wrap
 async def unshare(domain_id: str, pid: document.convert_doc_id, uid: int):
-  return await document.pull(domain_id, document.TYPE_PROBLEM, pid, 'shared_uids', [uid])
+  pdoc = await document.pull(domain_id, document.TYPE_PROBLEM, pid, 'shared_uids', [uid])
+  await problemindex.invalidate(domain_id)
+  return pdoc
 
 if __name__ == '__main__':
   argmethod.invoke_by_args()
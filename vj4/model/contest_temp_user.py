@@ -13,6 +13,7 @@ from vj4.model import user
 from vj4.model import document
 from vj4.model import domain
 from vj4.model import system
+from vj4.service import scoreboard
 from vj4.util import argmethod
 
 
@@ -311,6 +312,7 @@ async def delete_with_user(domain_id: str, tid: objectid.ObjectId, temp_user_id:
             })
         except:
             pass  # Status might not exist
+        scoreboard.invalidate(domain_id, document.TYPE_CONTEST, tid)
         
         try:
             # Delete user - mark as deleted or remove (depending on system design)
@@ -423,6 +423,26 @@ async def ensure_indexes():
                            ('tag', 1),
                            ('doc_id', 1),
                            ('owner_uid', 1)], sparse=True)
+  await coll.create_index([('doc_type', 1),
+                           ('data_changed_at', 1),
+                           ('domain_id', 1),
+                           ('doc_id', 1)],
+                          partialFilterExpression={'data_changed_at': {'$exists': True}})
+  await coll.create_index([('doc_type', 1),
+                           ('data.domain', 1),
+                           ('data.pid', 1)],
+                          partialFilterExpression={'data.domain': {'$exists': True}})
+  # Full-text problem search. Statements mix languages, so no stemming or stop words.
+  await coll.create_index([('domain_id', 1),
+                           ('doc_type', 1),
+                           ('title', 'text'),
+                           ('content', 'text'),
+                           ('tag', 'text'),
+                           ('category', 'text')],
+                          name='problem_text',
+                          weights={'title': 10, 'tag': 5, 'category': 5, 'content': 1},
+                          default_language='none',
+                          partialFilterExpression={'doc_type': TYPE_PROBLEM})
   # for problem solution
   await coll.create_index([('domain_id', 1),
                            ('doc_type', 1),
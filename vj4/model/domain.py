@@ -8,9 +8,14 @@ from vj4 import db
 from vj4 import error
 from vj4.model import builtin
 from vj4.model import system
+from vj4.service import smallcache
 from vj4.util import argmethod
+from vj4.util import options
 from vj4.util import validator
 
+options.define('domain_cache_expire_seconds', default=60,
+               help='Expire time for cached domains, in seconds.')
+
 PROJECTION_PUBLIC = {
   '_id': 1,
   'name': 1,
@@ -72,6 +77,7 @@ async def add(domain_id: str, owner_uid: int,
   await add_user_role(domain_id, owner_uid, builtin.ROLE_ROOT)
   await coll.update_one({'_id': domain_id},
                         {'$unset': {'pending': ''}})
+  await _unset_cache(domain_id)
   return domain_id
 
 
@@ -89,13 +95,35 @@ async def add_continue(domain_id: str, ensure_owner_uid: int=None):
   coll = db.coll('domain')
   await coll.update_one({'_id': domain_id},
                         {'$unset': {'pending': ''}})
+  await _unset_cache(domain_id)
+
+
+def _compile_roles(ddoc):
+  builtin_roles = {role: rd.default_permission for role, rd in builtin.BUILTIN_ROLE_DESCRIPTORS.items()}
+  return {**builtin_roles, **ddoc['roles']}
+
+
+_builtin_cache = {ddoc['_id']: (ddoc, _compile_roles(ddoc)) for ddoc in builtin.DOMAINS}
+
+
+async def _unset_cache(domain_id):
+  await smallcache.unset_global(smallcache.PREFIX_DOMAIN + domain_id)
 
 
 @argmethod.wrap
 async def get(domain_id: str, fields=None):
+  """Get a domain.
+
+  Without fields, the domain document is served from a process-local cache together with its
+  compiled roles (see get_all_roles()). It is shared between callers and must not be modified.
+  """
   for domain in builtin.DOMAINS:
     if domain['_id'] == domain_id:
       return domain
+  if fields is None:
+    entry = smallcache.get_direct(smallcache.PREFIX_DOMAIN + domain_id)
+    if entry:
+      return entry[0]
   coll = db.coll('domain')
   ddoc = await coll.find_one(domain_id, fields)
   if not ddoc:
@@ -103,6 +131,10 @@ async def get(domain_id: str, fields=None):
   # Deserialize roles if present
   if 'roles' in ddoc:
     ddoc['roles'] = _deserialize_roles(ddoc['roles'])
+  if fields is None:
+    smallcache.set_local_direct(smallcache.PREFIX_DOMAIN + domain_id,
+                                (ddoc, _compile_roles(ddoc) if 'roles' in ddoc else None),
+                                options.domain_cache_expire_seconds)
   return ddoc
 
 
@@ -140,6 +172,7 @@ async def edit(domain_id: str, **kwargs):
   ddoc = await coll.find_one_and_update(filter={'_id': domain_id},
                                         update={'$set': {**kwargs}},
                                         return_document=ReturnDocument.AFTER)
+  await _unset_cache(domain_id)
   # Deserialize roles if present
   if ddoc and 'roles' in ddoc:
     ddoc['roles'] = _deserialize_roles(ddoc['roles'])
@@ -152,6 +185,7 @@ async def unset(domain_id, fields):
   ddoc = await coll.find_one_and_update(filter={'_id': domain_id},
                                         update={'$unset': dict((f, '') for f in set(fields))},
                                         return_document=ReturnDocument.AFTER)
+  await _unset_cache(domain_id)
   # Deserialize roles if present
   if ddoc and 'roles' in ddoc:
     ddoc['roles'] = _deserialize_roles(ddoc['roles'])
@@ -202,6 +236,7 @@ async def set_roles(domain_id: str, roles: dict[str, int]):
   ddoc = await coll.find_one_and_update(filter={'_id': domain_id},
                                         update={'$set': update},
                                         return_document=ReturnDocument.AFTER)
+  await _unset_cache(domain_id)
   # Deserialize roles before returning
   if ddoc and 'roles' in ddoc:
     ddoc['roles'] = _deserialize_roles(ddoc['roles'])
@@ -226,10 +261,12 @@ async def delete_roles(domain_id: str, roles):
   await user_coll.update_many({'domain_id': domain_id, 'role': {'$in': list(roles)}},
                               {'$unset': {'role': ''}})
   coll = db.coll('domain')
-  return await coll.find_one_and_update(filter={'_id': domain_id},
+  ddoc = await coll.find_one_and_update(filter={'_id': domain_id},
                                         update={'$unset': dict(('roles.{0}'.format(role), '')
                                                                for role in roles)},
                                         return_document=ReturnDocument.AFTER)
+  await _unset_cache(domain_id)
+  return ddoc
 
 
 @argmethod.wrap
@@ -238,9 +275,11 @@ async def transfer(domain_id: str, old_owner_uid: int, new_owner_uid: int):
     if domain['_id'] == domain_id:
       raise error.BuiltinDomainError(domain_id)
   coll = db.coll('domain')
-  return await coll.find_one_and_update(filter={'_id': domain_id, 'owner_uid': old_owner_uid},
+  ddoc = await coll.find_one_and_update(filter={'_id': domain_id, 'owner_uid': old_owner_uid},
                                         update={'$set': {'owner_uid': new_owner_uid}},
                                         return_document=ReturnDocument.AFTER)
+  await _unset_cache(domain_id)
+  return ddoc
 
 
 @argmethod.wrap
@@ -357,9 +396,15 @@ async def get_dict_user_by_domain_id(uid, *, fields=None):
 
 
 def get_all_roles(ddoc):
-  builtin_roles = {role: rd.default_permission for role, rd in builtin.BUILTIN_ROLE_DESCRIPTORS.items()}
-  domain_roles = ddoc['roles']
-  return {**builtin_roles, **domain_roles}
+  """Get the permission of every role in the domain, built-in roles included.
+
+  The result is precomputed for domains returned by get() and must not be modified.
+  """
+  entry = _builtin_cache.get(ddoc['_id']) or smallcache.get_direct(
+      smallcache.PREFIX_DOMAIN + ddoc['_id'])
+  if entry and entry[0] is ddoc and entry[1] is not None:
+    return entry[1]
+  return _compile_roles(ddoc)
 
 
 def get_join_settings(ddoc, now):
@@ -1,37 +1,202 @@
+import asyncio
+import collections
+import hashlib
+import os
 import sys
 import mimetypes
+import tempfile
+import time
+from os import path
 
 from bson import objectid
+from motor import motor_asyncio
 from pymongo import ReturnDocument
 
 from vj4 import db
 from vj4 import error
+from vj4.service import bus
 from vj4.util import argmethod
+from vj4.util import options
 from vj4.util import pwhash
 
+options.define('fs_meta_cache_max_entries', default=1024,
+               help='Maximum number of file metadata documents cached by secret.')
+options.define('fs_meta_cache_expire_seconds', default=300,
+               help='Time a cached file metadata document is used, in seconds.')
+
+options.define('fs_disk_cache_dir', default='',
+               help='Directory caching GridFS files on local disk, empty to disable.')
+options.define('fs_disk_cache_max_bytes', default=2 ** 30,
+               help='Maximum total size of the local disk cache in bytes.')
+
+DISK_CACHE_TEMP_PREFIX = '.tmp-'
+DISK_CACHE_TEMP_EXPIRE_SECONDS = 3600
+
+# File metadata cache: secret -> (expire_at, files document). Files are immutable, entries are
+# only dropped when the file is deleted.
+_meta_cache = collections.OrderedDict()
+
+
+def _meta_cache_unset(secret):
+  _meta_cache.pop(secret, None)
+
+
+def _disk_cache_path(secret):
+  return path.join(options.fs_disk_cache_dir, secret)
+
+
+def _disk_cache_unset(secret):
+  if not options.fs_disk_cache_dir:
+    return
+  try:
+    os.remove(_disk_cache_path(secret))
+  except FileNotFoundError:
+    pass
+
+
+def _disk_cache_evict():
+  """Removes the least recently used files until the cache fits.
+
+  The directory may be shared by all processes on a host, so the file system is the index and
+  the modification time is the recency.
+  """
+  now = time.time()
+  entries = []
+  total = 0
+  with os.scandir(options.fs_disk_cache_dir) as it:
+    for entry in it:
+      try:
+        stat = entry.stat()
+        if entry.name.startswith(DISK_CACHE_TEMP_PREFIX):
+          if stat.st_mtime < now - DISK_CACHE_TEMP_EXPIRE_SECONDS:
+            os.remove(entry.path)
+          continue
+      except FileNotFoundError:
+        continue
+      entries.append((stat.st_mtime, entry.path, stat.st_size))
+      total += stat.st_size
+  entries.sort()
+  for _, pathname, size in entries:
+    if total <= options.fs_disk_cache_max_bytes:
+      break
+    try:
+      os.remove(pathname)
+    except FileNotFoundError:
+      pass
+    total -= size
+
+
+def _open_disk_cache(secret, length):
+  try:
+    file_object = open(_disk_cache_path(secret), 'rb')
+  except FileNotFoundError:
+    return None
+  if os.fstat(file_object.fileno()).st_size != length:
+    file_object.close()
+    return None
+  os.utime(file_object.fileno())
+  return file_object
+
+
+async def open_disk_cache(fdoc):
+  """Open the local copy of a file for reading. Returns None if it is not cached."""
+  if not options.fs_disk_cache_dir:
+    return None
+  return await asyncio.get_event_loop().run_in_executor(
+      None, _open_disk_cache, fdoc['metadata']['secret'], fdoc['length'])
+
+
+class DiskCacheWriter:
+  """Collects the chunks of a file being read and adds the file to the local disk cache."""
+  def __init__(self, secret):
+    self._secret = secret
+    self._file_object = tempfile.NamedTemporaryFile(dir=options.fs_disk_cache_dir,
+                                                    prefix=DISK_CACHE_TEMP_PREFIX, delete=False)
+
+  def write(self, data):
+    self._file_object.write(data)
+
+  def _commit(self):
+    self._file_object.close()
+    os.replace(self._file_object.name, _disk_cache_path(self._secret))
+    _disk_cache_evict()
+
+  async def commit(self):
+    # Eviction scans the whole directory, keep it off the event loop.
+    await asyncio.get_event_loop().run_in_executor(None, self._commit)
+
+  def abort(self):
+    self._file_object.close()
+    os.remove(self._file_object.name)
+
+
+def create_disk_cache_writer(fdoc):
+  """Returns a DiskCacheWriter for the file, or None if it should not be cached."""
+  if not options.fs_disk_cache_dir or fdoc['length'] > options.fs_disk_cache_max_bytes:
+    return None
+  return DiskCacheWriter(fdoc['metadata']['secret'])
+
+
+async def _on_unset(e):
+  _meta_cache_unset(e['value'])
+  _disk_cache_unset(e['value'])
+
+
+def init():
+  if options.fs_disk_cache_dir:
+    os.makedirs(options.fs_disk_cache_dir, exist_ok=True)
+  bus.subscribe(_on_unset, ['fs_unset'])
+
+
+def uninit():
+  bus.unsubscribe(_on_unset)
+  _meta_cache.clear()
+
 
 class GridInWrapper:
-  """Wrapper around Motor's GridIn to add content_type support."""
+  """Wrapper around Motor's GridIn to add content_type support and content hashes."""
   def __init__(self, grid_in, content_type):
     self._grid_in = grid_in
     self._content_type = content_type
     self._closed = False
-  
+    self._md5 = hashlib.md5()
+    self._sha256 = hashlib.sha256()
+
   async def write(self, data):
-    """Write data to the file."""
-    return await self._grid_in.write(data)
-  
+    """Write data to the file. data is bytes or a file object."""
+    if not hasattr(data, 'read'):
+      self._md5.update(data)
+      self._sha256.update(data)
+      return await self._grid_in.write(data)
+    chunk = data.read(self._grid_in.chunk_size)
+    while chunk:
+      self._md5.update(chunk)
+      self._sha256.update(chunk)
+      await self._grid_in.write(chunk)
+      chunk = data.read(self._grid_in.chunk_size)
+
   async def close(self):
-    """Close the file and update content_type field."""
+    """Close the file and update content_type and hash fields."""
     if not self._closed:
       await self._grid_in.close()
       self._closed = True
       # Update the files document to add contentType at top level
       # This is for backward compatibility with old GridFS content_type property
+      # Motor 3.x no longer calculates MD5, both hashes are computed while writing.
+      update = {'md5': self._md5.hexdigest(), 'sha256': self._sha256.hexdigest()}
       if self._content_type:
-        coll = db.coll('fs.files')
-        await coll.update_one({'_id': self._grid_in._id}, {'$set': {'contentType': self._content_type}})
-  
+        update['contentType'] = self._content_type
+      coll = db.coll('fs.files')
+      await coll.update_one({'_id': self._grid_in._id}, {'$set': update})
+
+  @property
+  def md5(self):
+    return self._md5.hexdigest()
+
+  @property
+  def sha256(self):
+    return self._sha256.hexdigest()
+
   @property
   def _id(self):
     """Get the file ID."""
@@ -82,6 +247,31 @@ async def get(file_id):
   return await fs.open_download_stream(file_id)
 
 
+def open_meta(fdoc):
+  """Open a file from its files document without looking it up again. Returns MotorGridOut."""
+  # MotorGridOut takes the Motor collection itself, not the wrapper from db.coll().
+  return motor_asyncio.AsyncIOMotorGridOut(db.coll('fs')._collection, file_document=fdoc)
+
+
+async def get_meta_by_secret(secret):
+  """Get all metadata of a file by secret, cached in memory."""
+  secret = str(secret)
+  entry = _meta_cache.get(secret)
+  if entry and entry[0] > time.monotonic():
+    _meta_cache.move_to_end(secret)
+    return entry[1]
+  coll = db.coll('fs.files')
+  fdoc = await coll.find_one({'metadata.secret': secret})
+  if not fdoc:
+    _meta_cache_unset(secret)
+    raise error.NotFoundError(secret)
+  _meta_cache_unset(secret)
+  _meta_cache[secret] = (time.monotonic() + options.fs_meta_cache_expire_seconds, fdoc)
+  if len(_meta_cache) > options.fs_meta_cache_max_entries:
+    _meta_cache.popitem(False)
+  return fdoc
+
+
 async def get_by_secret(secret):
   """Get a file by secret. Returns MotorGridOut."""
   file_id = await get_file_id(str(secret))
@@ -157,24 +347,33 @@ async def cat(file_id: objectid.ObjectId):
     buf = await grid_out.read()
 
 
-@argmethod.wrap
-async def link_by_md5(file_md5: str, except_id: objectid.ObjectId=None):
-  """Link a file by MD5 if exists."""
-  # MD5 is no longer calculated by default in Motor 3.x
-  # This function will not work without MD5, so return None
-  if not file_md5:
+async def _link_by(key, value, except_id):
+  if not value:
     return None
   query = {}
   if except_id:
     query['_id'] = {'$ne': except_id}
   coll = db.coll('fs.files')
-  doc = await coll.find_one_and_update(filter={'md5': file_md5, **query},
+  # A file with no links left is being deleted and must not be revived.
+  doc = await coll.find_one_and_update(filter={key: value, 'metadata.link': {'$gt': 0}, **query},
                                        update={'$inc': {'metadata.link': 1}})
   if doc:
     return doc['_id']
   return None
 
 
+@argmethod.wrap
+async def link_by_md5(file_md5: str, except_id: objectid.ObjectId=None):
+  """Link a file by MD5 if exists."""
+  return await _link_by('md5', file_md5, except_id)
+
+
+@argmethod.wrap
+async def link_by_sha256(file_sha256: str, except_id: objectid.ObjectId=None):
+  """Link a file by SHA-256 if exists."""
+  return await _link_by('sha256', file_sha256, except_id)
+
+
 @argmethod.wrap
 async def unlink(file_id: objectid.ObjectId):
   """Unlink a file."""
@@ -185,6 +384,9 @@ async def unlink(file_id: objectid.ObjectId):
   if doc and not doc['metadata']['link']:
     fs = db.fs('fs')
     await fs.delete(file_id)
+    _meta_cache_unset(doc['metadata']['secret'])
+    _disk_cache_unset(doc['metadata']['secret'])
+    await bus.publish('fs_unset', doc['metadata']['secret'])
 
 
 @argmethod.wrap
@@ -192,6 +394,7 @@ async def ensure_indexes():
   coll = db.coll('fs.files')
   await coll.create_index('metadata.secret', unique=True)
   await coll.create_index('md5')
+  await coll.create_index('sha256', sparse=True)
 
 
 if __name__ == '__main__':
@@ -1,4 +1,9 @@
+import asyncio
+import collections
 import datetime
+import logging
+import os
+import socket
 import time
 
 from pymongo import errors
@@ -6,11 +11,25 @@ from pymongo import ReturnDocument
 
 from vj4 import db
 from vj4 import error
+from vj4.service import bus
 from vj4.util import argmethod
+from vj4.util import options
 
+options.define('opcount_backend', default='memory',
+               help='Backend of operation counters, "memory" or "db".')
+options.define('opcount_sync_interval_seconds', default=1,
+               help='Interval of exchanging in-memory operation counts between processes.')
 
-@argmethod.wrap
-async def inc(op: str, ident: str, period_secs: int, max_operations: int):
+_logger = logging.getLogger(__name__)
+_worker_id = '{0}-{1}'.format(socket.gethostname(), os.getpid())
+# (op, ident) -> (period_secs, deque of operation timestamps).
+_windows = dict()
+# (op, ident) -> {worker_id: (reported_at, period_secs, count)}.
+_remote_counts = collections.defaultdict(dict)
+_dirty_keys = set()
+
+
+async def _inc_db(op, ident, period_secs, max_operations):
   coll = db.coll('opcount')
   cur_time = int(time.time())
   begin_at = datetime.datetime.utcfromtimestamp(cur_time - cur_time % period_secs)
@@ -28,6 +47,90 @@ async def inc(op: str, ident: str, period_secs: int, max_operations: int):
     raise error.OpcountExceededError(op, period_secs, max_operations)
 
 
+def _get_window(key, now):
+  period_secs, window = _windows[key]
+  while window and window[0] <= now - period_secs:
+    window.popleft()
+  return window
+
+
+def _get_remote_count(key, now):
+  return sum(count for reported_at, period_secs, count in _remote_counts.get(key, {}).values()
+             if reported_at > now - period_secs)
+
+
+def _inc_memory(op, ident, period_secs, max_operations):
+  """Sliding window counter. Operations of other processes are included as last reported."""
+  key = (op, ident)
+  now = time.time()
+  if key not in _windows:
+    _windows[key] = (period_secs, collections.deque())
+  window = _get_window(key, now)
+  if len(window) + _get_remote_count(key, now) >= max_operations:
+    raise error.OpcountExceededError(op, period_secs, max_operations)
+  window.append(now)
+  _dirty_keys.add(key)
+
+
+async def _on_sync(e):
+  value = e['value']
+  if value['worker_id'] == _worker_id:
+    return
+  for op, ident, period_secs, count in value['counts']:
+    _remote_counts[(op, ident)][value['worker_id']] = (value['reported_at'], period_secs, count)
+
+
+async def _sync():
+  now = time.time()
+  counts = []
+  for key in _dirty_keys:
+    if key in _windows:
+      counts.append([*key, _windows[key][0], len(_get_window(key, now))])
+  _dirty_keys.clear()
+  for key in [key for key in _windows if not _get_window(key, now)]:
+    del _windows[key]
+  for key, reports in list(_remote_counts.items()):
+    for worker_id, (reported_at, period_secs, _) in list(reports.items()):
+      if reported_at <= now - period_secs:
+        del reports[worker_id]
+    if not reports:
+      del _remote_counts[key]
+  if counts:
+    await bus.publish('opcount_sync',
+                      {'worker_id': _worker_id, 'reported_at': now, 'counts': counts})
+
+
+async def _sync_loop():
+  while True:
+    await asyncio.sleep(options.opcount_sync_interval_seconds)
+    try:
+      await _sync()
+    except Exception as e:
+      _logger.exception(e)
+
+
+def init():
+  bus.subscribe(_on_sync, ['opcount_sync'])
+  asyncio.get_event_loop().create_task(_sync_loop())
+
+
+@argmethod.wrap
+async def inc(op: str, ident: str, period_secs: int, max_operations: int):
+  """Count an operation.
+
+  With the memory backend, each process counts in a sliding window and the counts are exchanged
+  between processes every opcount_sync_interval_seconds. The db backend counts in fixed windows in
+  MongoDB.
+
+  Raises:
+    OpcountExceededError: there were already max_operations operations in period_secs.
+  """
+  if options.opcount_backend == 'memory':
+    return _inc_memory(op, ident, period_secs, max_operations)
+  else:
+    return await _inc_db(op, ident, period_secs, max_operations)
+
+
 @argmethod.wrap
 async def ensure_indexes():
   coll = db.coll('opcount')
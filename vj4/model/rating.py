@@ -41,6 +41,60 @@ async def add_rating_changes(domain_id: str, rating_changes: List[Dict]):
     await bulk_domain_users.execute()
 
 
+async def get_checkpoint(domain_id: str, rating_ids: List[objectid.ObjectId]):
+    """Return the rating of every user after the given contests, as a dict of uid to rating.
+
+    The rating_changes of a contest record the rating of each contestant after it, so they serve
+    as per-user checkpoints and replaying the later contests only needs this state.
+    """
+    coll = db.coll("rating_changes")
+    pipeline = [
+        {"$match": {"domain_id": domain_id, "rating_id": {"$in": rating_ids}}},
+        {"$sort": {"attend_at": 1, "rating_id": 1}},
+        {"$group": {"_id": "$uid", "rating": {"$last": "$new_rating"}}},
+    ]
+    return {doc["_id"]: doc["rating"] async for doc in coll.aggregate(pipeline)}
+
+
+async def get_rating_change_uids(domain_id: str, rating_ids: List[objectid.ObjectId]):
+    coll = db.coll("rating_changes")
+    return await coll.distinct(
+        "uid", {"domain_id": domain_id, "rating_id": {"$in": rating_ids}}
+    )
+
+
+async def replace_rating_changes(
+    domain_id: str, rating_changes: Dict[objectid.ObjectId, List[Dict]], ratings: Dict[int, int]
+):
+    """Replace the rating_changes of the given contests and set the ratings of the given users.
+
+    rating_changes maps each replayed contest to its new rating changes. ratings maps each affected
+    user to the new rating, or None if the user has no rating any more.
+    """
+    bulk_rating_changes = db.coll("rating_changes").initialize_unordered_bulk_op()
+    for rating_id, changes in rating_changes.items():
+        for rating_change in changes:
+            bulk_rating_changes.find(
+                {"rating_id": rating_id, "uid": rating_change["uid"]}
+            ).upsert().replace_one(rating_change)
+        bulk_rating_changes.find(
+            {
+                "domain_id": domain_id,
+                "rating_id": rating_id,
+                "uid": {"$nin": [rating_change["uid"] for rating_change in changes]},
+            }
+        ).remove()
+    bulk_domain_users = db.coll("domain.user").initialize_unordered_bulk_op()
+    for uid, rating in ratings.items():
+        if rating is None:
+            update = {"$unset": {"rating": ""}}
+        else:
+            update = {"$set": {"rating": rating}}
+        bulk_domain_users.find({"domain_id": domain_id, "uid": uid}).update_one(update)
+    await bulk_rating_changes.execute()
+    await bulk_domain_users.execute()
+
+
 async def get_latest_rating_changes(domain_id: str, uids: List[int]):
     coll = db.coll("domain.user")
     return await coll.find({"domain_id": domain_id, "uid": {"$in": uids}}).to_list()
@@ -108,7 +162,11 @@ async def count(**kwargs):
 
 async def get_sorted_by_attend_at(domain_id: str):
     coll = db.coll("rating")
-    return await coll.find({"domain_id": domain_id}).sort("attend_at", 1).to_list()
+    return (
+        await coll.find({"domain_id": domain_id})
+        .sort([("attend_at", 1), ("_id", 1)])
+        .to_list()
+    )
 
 
 @argmethod.wrap
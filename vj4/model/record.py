@@ -1,5 +1,6 @@
 import asyncio
 import datetime
+import logging
 from bson import objectid
 from pymongo import ReturnDocument
 
@@ -11,10 +12,38 @@ from vj4.model.adaptor import problem
 from vj4.service import bus
 from vj4.service import queue
 from vj4.util import argmethod
+from vj4.util import options
 from vj4.util import validator
 
+options.define('rejudge_batch_size', default=100,
+               help='Number of records reset and enqueued at a time when rejudging in bulk.')
+options.define('rejudge_rate', default=20.0,
+               help='Maximum number of records enqueued per second when rejudging in bulk, '
+                    '0 for unlimited.')
+options.define('rejudge_max_pending', default=50,
+               help='Bulk rejudging waits while the judge queue holds more messages, '
+                    '0 to disable.')
+
+REJUDGE_POLL_SECONDS = 1
+
+_logger = logging.getLogger(__name__)
+
 PROJECTION_PUBLIC = {'code': 0}
 PROJECTION_ALL = None
+# Fields carried by record_change events. Subscribers which need more fetch the record themselves.
+PROJECTION_CHANGE = ['rev', 'hidden', 'status', 'score', 'time_ms', 'memory_kb', 'progress',
+                     'domain_id', 'pid', 'uid', 'lang', 'ttype', 'tid', 'type', 'rejudged']
+
+
+def publish_change(rdoc):
+  """Publish a record_change event with the PROJECTION_CHANGE fields of the record.
+
+  The rev field is incremented on every update of the record, so subscribers can tell stale
+  events and fetched records apart.
+  """
+  value = {key: rdoc[key] for key in PROJECTION_CHANGE if key in rdoc}
+  value['_id'] = rdoc['_id']
+  bus.publish_throttle('record_change', value, rdoc['_id'])
 
 
 @argmethod.wrap
@@ -23,7 +52,8 @@ async def add(domain_id: str, pid: document.convert_doc_id, type: int, uid: int,
               ttype=None, tid: objectid.ObjectId=None, hidden=False):
   validator.check_lang(lang)
   coll = db.coll('record')
-  doc = {'hidden': hidden,
+  doc = {'rev': 1,
+         'hidden': hidden,
          'status': constant.record.STATUS_WAITING,
          'score': 0,
          'time_ms': 0,
@@ -38,7 +68,7 @@ async def add(domain_id: str, pid: document.convert_doc_id, type: int, uid: int,
          'data_id': data_id,
          'type': type}
   rid = (await coll.insert_one(doc)).inserted_id
-  bus.publish_throttle('record_change', doc, rid)
+  publish_change(doc)
   post_coros = [queue.publish('judge', rid=rid)]
   if type == constant.record.TYPE_SUBMISSION:
     post_coros.extend([problem.inc_status(domain_id, pid, uid, 'num_submit', 1),
@@ -54,28 +84,54 @@ async def get(record_id: objectid.ObjectId, fields=PROJECTION_ALL):
   return await coll.find_one(record_id, fields)
 
 
+_REJUDGE_UPDATE = {'$unset': {'judge_uid': '',
+                               'judge_token': '',
+                               'judge_at': '',
+                               'compiler_texts': '',
+                               'judge_texts': '',
+                               'cases': ''},
+                   '$set': {'status': constant.record.STATUS_WAITING,
+                            'score': 0,
+                            'time_ms': 0,
+                            'memory_kb': 0,
+                            'rejudged': True},
+                   '$inc': {'rev': 1}}
+
+
 @argmethod.wrap
 async def rejudge(record_id: objectid.ObjectId, enqueue: bool=True):
   coll = db.coll('record')
   doc = await coll.find_one_and_update(filter={'_id': record_id},
-                                       update={'$unset': {'judge_uid': '',
-                                                          'judge_token': '',
-                                                          'judge_at': '',
-                                                          'compiler_texts': '',
-                                                          'judge_texts': '',
-                                                          'cases': ''},
-                                               '$set': {'status': constant.record.STATUS_WAITING,
-                                                        'score': 0,
-                                                        'time_ms': 0,
-                                                        'memory_kb': 0,
-                                                        'rejudged': True}},
+                                       update=_REJUDGE_UPDATE,
                                        return_document=ReturnDocument.AFTER)
-  bus.publish_throttle('record_change', doc, doc['_id'])
+  publish_change(doc)
   if enqueue:
     await queue.publish('judge', rid=doc['_id'])
 
+
+async def _rejudge_batch(rids):
+  coll = db.coll('record')
+  await coll.update_many({'_id': {'$in': rids}}, _REJUDGE_UPDATE)
+  async for rdoc in coll.find({'_id': {'$in': rids}}, projection=PROJECTION_CHANGE):
+    publish_change(rdoc)
+  await queue.publish_many('judge', [{'rid': rid} for rid in rids])
+
+
+async def _wait_judge_queue():
+  if not options.rejudge_max_pending:
+    return
+  while await queue.get_message_count('judge') > options.rejudge_max_pending:
+    await asyncio.sleep(REJUDGE_POLL_SECONDS)
+
+
 @argmethod.wrap
 async def rejudge_all(domain_id: str, uid: str='', pid: str='', tid: str=''):
+  """Rejudge matching records from the newest, throttled so that new submissions are not starved.
+
+  Records are reset and enqueued in batches of rejudge_batch_size, at most rejudge_rate records
+  per second and only while the judge queue holds no more than rejudge_max_pending messages.
+  Returns the number of rejudged records.
+  """
   query = dict()
   if uid:
     query['uid'] = int(uid)
@@ -85,10 +141,28 @@ async def rejudge_all(domain_id: str, uid: str='', pid: str='', tid: str=''):
       query['pid'] = document.convert_doc_id(pid)
     if tid:
       query['tid'] = document.convert_doc_id(tid)
-  rdocs = get_all_multi(**query, fields={'_id': 1}).sort([('_id', -1)]).batch_size(100)
-  async for rdoc in rdocs:
-    await rejudge(rdoc['_id'])
-
+  total = await db.coll('record').count_documents(query)
+  loop = asyncio.get_event_loop()
+  begin_at = loop.time()
+  count = 0
+  end_id = None
+  while True:
+    # Each batch is a new query, so waiting never times out a cursor.
+    rdocs = await get_all_multi(end_id, **query, fields={'_id': 1}) \
+                  .sort([('_id', -1)]) \
+                  .limit(options.rejudge_batch_size) \
+                  .to_list()
+    if not rdocs:
+      break
+    await _wait_judge_queue()
+    rids = [rdoc['_id'] for rdoc in rdocs]
+    await _rejudge_batch(rids)
+    count += len(rids)
+    end_id = rids[-1]
+    _logger.info('Rejudging: %d/%d', count, total)
+    if options.rejudge_rate:
+      await asyncio.sleep(max(0, begin_at + count / options.rejudge_rate - loop.time()))
+  return count
 
 
 @argmethod.wrap
@@ -157,7 +231,8 @@ async def begin_judge(record_id: objectid.ObjectId,
                                                         'compiler_texts': [],
                                                         'judge_texts': [],
                                                         'cases': [],
-                                                        'progress': 0.0}},
+                                                        'progress': 0.0},
+                                               '$inc': {'rev': 1}},
                                        return_document=ReturnDocument.AFTER)
   return doc
 
@@ -167,7 +242,8 @@ async def next_judge(record_id, judge_uid, judge_token, **kwargs):
   doc = await coll.find_one_and_update(filter={'_id': record_id,
                                                'judge_uid': judge_uid,
                                                'judge_token': judge_token},
-                                       update=kwargs,
+                                       update={**kwargs, '$inc': {'rev': 1}},
+                                       projection=PROJECTION_CHANGE,
                                        return_document=ReturnDocument.AFTER)
   return doc
 
@@ -184,7 +260,8 @@ async def end_judge(record_id: objectid.ObjectId, judge_uid: int, judge_token: s
                                                         'time_ms': time_ms,
                                                         'memory_kb': memory_kb},
                                                '$unset': {'judge_token': '',
-                                                          'progress': ''}},
+                                                          'progress': ''},
+                                               '$inc': {'rev': 1}},
                                        return_document=ReturnDocument.AFTER)
   return doc
 
@@ -8,7 +8,7 @@ from vj4 import error
 from vj4.util import argmethod
 
 
-EXPECTED_DB_VERSION = 1
+EXPECTED_DB_VERSION = 2
 
 @argmethod.wrap
 async def set_should_fetch_contest_submission(value: bool):
@@ -1,12 +1,29 @@
+import asyncio
 import binascii
+import collections
 import datetime
 import hashlib
+import logging
 import os
 
 from pymongo import ReturnDocument
+from pymongo import UpdateOne
 
 from vj4 import db
+from vj4.service import bus
 from vj4.util import argmethod
+from vj4.util import options
+
+options.define('token_cache_max_entries', default=8192,
+               help='Maximum number of sessions cached in memory.')
+options.define('token_cache_expire_seconds', default=60,
+               help='Time a cached session is used without reading the database, in seconds.')
+options.define('token_refresh_interval_seconds', default=300,
+               help='Minimum interval between two expiry refreshes of a session, in seconds.')
+options.define('token_flush_delay_seconds', default=5,
+               help='Delay before pending session expiry refreshes are written, in seconds.')
+
+_logger = logging.getLogger(__name__)
 
 TYPE_REGISTRATION = 1
 TYPE_SAVED_SESSION = 2
@@ -15,10 +32,78 @@ TYPE_LOSTPASS = 4
 TYPE_CHANGEMAIL = 5
 
 
+# Session cache: hashed ID -> (cached_at, token document).
+_cache = collections.OrderedDict()
+# Pending expiry refreshes: hashed ID -> (token type, update_at, expire_at).
+_refreshes = dict()
+
+
 def _get_id(id_binary):
   return hashlib.sha256(id_binary).digest()
 
 
+def _cache_set(doc):
+  _cache.pop(doc['_id'], None)
+  _cache[doc['_id']] = (datetime.datetime.utcnow(), doc)
+  if len(_cache) > options.token_cache_max_entries:
+    _cache.popitem(False)
+
+
+def _cache_unset(value):
+  if 'uid' in value:
+    for key in [key for key, (_, doc) in _cache.items() if doc.get('uid') == value['uid']]:
+      del _cache[key]
+      _refreshes.pop(key, None)
+  else:
+    _cache.pop(value['_id'], None)
+    _refreshes.pop(value['_id'], None)
+
+
+async def _on_unset(e):
+  _cache_unset(e['value'])
+
+
+async def _unset_global(value):
+  _cache_unset(value)
+  await bus.publish('token_unset', value)
+
+
+def init():
+  bus.subscribe(_on_unset, ['token_unset'])
+
+
+def uninit():
+  bus.unsubscribe(_on_unset)
+  _cache.clear()
+  _refreshes.clear()
+
+
+def _schedule_flush():
+  loop = asyncio.get_event_loop()
+  loop.call_later(options.token_flush_delay_seconds,
+                  lambda: loop.create_task(_flush_refreshes()))
+
+
+async def _flush_refreshes():
+  refreshes = list(_refreshes.items())
+  _refreshes.clear()
+  if not refreshes:
+    return
+  coll = db.coll('token')
+  try:
+    await coll.bulk_write([UpdateOne({'_id': _id, 'token_type': token_type},
+                                     {'$set': {'update_at': update_at, 'expire_at': expire_at}})
+                           for _id, (token_type, update_at, expire_at) in refreshes],
+                          ordered=False)
+  except Exception:
+    _logger.exception('Writing %d session refreshes failed, retrying', len(refreshes))
+    # Refreshes made during the write are newer.
+    if not _refreshes:
+      _schedule_flush()
+    for _id, refresh in refreshes:
+      _refreshes.setdefault(_id, refresh)
+
+
 @argmethod.wrap
 async def add(token_type: int, expire_seconds: int, **kwargs):
   """Add a token.
@@ -106,6 +191,55 @@ async def update(token_id: str, token_type: int, expire_seconds: int, **kwargs):
   return doc
 
 
+@argmethod.wrap
+async def refresh(token_id: str, token_type: int, expire_seconds: int, **kwargs):
+  """Get a token and extend its expire time, writing to the database only when necessary.
+
+  The token is read from an in-process cache. If kwargs differ from the stored values, the token
+  is updated immediately. Otherwise the expire time is only extended once the remaining time drops
+  token_refresh_interval_seconds below expire_seconds, and such refreshes are written in bulk
+  after token_flush_delay_seconds.
+
+  Args:
+    token_id: token ID.
+    token_type: type of the token.
+    expire_seconds: expire time, in seconds.
+    **kwargs: extra data.
+
+  Returns:
+    The token document, or None.
+  """
+  _id = _get_id(binascii.unhexlify(token_id))
+  now = datetime.datetime.utcnow()
+  cached_at, doc = _cache.get(_id, (None, None))
+  if (not doc or doc['token_type'] != token_type or doc['expire_at'] <= now
+      or now - cached_at > datetime.timedelta(seconds=options.token_cache_expire_seconds)):
+    coll = db.coll('token')
+    doc = await coll.find_one({'_id': _id, 'token_type': token_type})
+    if not doc:
+      _cache.pop(_id, None)
+      return None
+    if _id in _refreshes:
+      doc['update_at'], doc['expire_at'] = _refreshes[_id][1:]
+    _cache_set(doc)
+  else:
+    _cache.move_to_end(_id)
+  if any(doc.get(key) != value for key, value in kwargs.items()):
+    doc = await update(token_id, token_type, expire_seconds, **kwargs)
+    if doc:
+      await _unset_global({'_id': _id})
+      _cache_set(doc)
+    return dict(doc) if doc else None
+  threshold = max(expire_seconds - options.token_refresh_interval_seconds, expire_seconds / 2)
+  if doc['expire_at'] - now <= datetime.timedelta(seconds=threshold):
+    doc['update_at'] = now
+    doc['expire_at'] = now + datetime.timedelta(seconds=expire_seconds)
+    if not _refreshes:
+      _schedule_flush()
+    _refreshes[_id] = (token_type, doc['update_at'], doc['expire_at'])
+  return dict(doc)
+
+
 @argmethod.wrap
 async def delete(token_id: str, token_type: int):
   """Delete a token.
@@ -125,6 +259,7 @@ async def delete_by_hashed_id(hashed_id: str, token_type: int):
   """Delete a token by the hashed ID."""
   coll = db.coll('token')
   result = await coll.delete_one({'_id': hashed_id, 'token_type': token_type})
+  await _unset_global({'_id': hashed_id})
   return bool(result.deleted_count)
 
 
@@ -135,6 +270,7 @@ async def delete_by_uid(uid: int):
   result = await coll.delete_many({'uid': uid,
                                    'token_type': {'$in': [TYPE_SAVED_SESSION,
                                                           TYPE_UNSAVED_SESSION]}})
+  await _unset_global({'uid': uid})
   return bool(result.deleted_count)
 
 
@@ -34,6 +34,7 @@ async def add(uid: int, uname: str, password: str, mail: str, regip: str=''):
       raise error.UserAlreadyExistError(uname)
 
   salt = pwhash.gen_salt()
+  password_hash = await pwhash.hash_vj4_async(password, salt)
   coll = db.coll('user')
   try:
     await coll.insert_one({'_id': uid,
@@ -42,7 +43,7 @@ async def add(uid: int, uname: str, password: str, mail: str, regip: str=''):
                            'mail': mail,
                            'mail_lower': mail_lower,
                            'salt': salt,
-                           'hash': pwhash.hash_vj4(password, salt),
+                           'hash': password_hash,
                            'regat': datetime.datetime.utcnow(),
                            'regip': regip,
                            'priv': builtin.DEFAULT_PRIV,
@@ -107,7 +108,7 @@ async def get_dict(uids, *, fields=PROJECTION_VIEW):
 async def check_password_by_uid(uid: int, password: str):
   """Check password. Returns doc or None."""
   doc = await get_by_uid(uid, PROJECTION_ALL)
-  if doc and pwhash.check(password, doc['salt'], doc['hash']):
+  if doc and await pwhash.check_async(password, doc['salt'], doc['hash']):
     return doc
 
 
@@ -117,7 +118,7 @@ async def check_password_by_uname(uname: str, password: str, auto_upgrade: bool=
   doc = await get_by_uname(uname, PROJECTION_ALL)
   if not doc:
     raise error.UserNotFoundError(uname)
-  if pwhash.check(password, doc['salt'], doc['hash']):
+  if await pwhash.check_async(password, doc['salt'], doc['hash']):
     if auto_upgrade and pwhash.need_upgrade(doc['hash']) \
         and validator.is_password(password):
       await set_password(doc['_id'], password)
@@ -129,10 +130,10 @@ async def set_password(uid: int, password: str):
   """Set password. Returns doc or None."""
   validator.check_password(password)
   salt = pwhash.gen_salt()
+  password_hash = await pwhash.hash_vj4_async(password, salt)
   coll = db.coll('user')
   doc = await coll.find_one_and_update(filter={'_id': uid},
-                                       update={'$set': {'salt': salt,
-                                                        'hash': pwhash.hash_vj4(password, salt)}},
+                                       update={'$set': {'salt': salt, 'hash': password_hash}},
                                        return_document=ReturnDocument.AFTER)
   return doc
 
@@ -160,12 +161,12 @@ async def change_password(uid: int, current_password: str, password: str):
     return None
   validator.check_password(password)
   salt = pwhash.gen_salt()
+  password_hash = await pwhash.hash_vj4_async(password, salt)
   coll = db.coll('user')
   doc = await coll.find_one_and_update(filter={'_id': doc['_id'],
                                                'salt': doc['salt'],
                                                'hash': doc['hash']},
-                                       update={'$set': {'salt': salt,
-                                                        'hash': pwhash.hash_vj4(password, salt)}},
+                                       update={'$set': {'salt': salt, 'hash': password_hash}},
                                        return_document=ReturnDocument.AFTER)
   return doc
 
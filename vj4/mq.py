@@ -1,14 +1,91 @@
 import asyncio
+import collections
+import logging
 
 import aioamqp
+from aioamqp import channel as amqp_channel
+from aioamqp import exceptions
+from aioamqp import protocol as amqp_protocol
 
 from vj4.util import options
 
 options.define('mq_host', default='localhost', help='Message queue hostname or IP address.')
 options.define('mq_vhost', default='/', help='Message queue virtual host.')
+options.define('mq_publish_batch_delay', default=0.002,
+               help='Time publishes are collected to be sent and confirmed together, in seconds.')
+options.define('mq_publish_batch_size', default=256,
+               help='Maximum number of publishes sent and confirmed together.')
+options.define('mq_publish_timeout', default=10.0,
+               help='Time a publish waits for the broker, including retries, in seconds.')
+
+RETRY_DELAY_SECONDS = 2
+
+_logger = logging.getLogger(__name__)
 
 _protocol_future = None
 _channel_futures = {}
+# (exchange, routing_key, body, declare, future) waiting to be published, in order.
+_pending = collections.deque()
+_publish_task = None
+
+
+class Channel(amqp_channel.Channel):
+  """Channel which tracks publisher confirms by delivery tag.
+
+  aioamqp resolves one waiter per confirm and ignores the multiple flag, which the broker sets when
+  it confirms several publishes at once.
+  """
+
+  def __init__(self, *args, **kwargs):
+    super(Channel, self).__init__(*args, **kwargs)
+    self._next_delivery_tag = 1
+    self._unconfirmed = collections.OrderedDict()  # delivery tag -> future
+
+  async def publish_confirm(self, payload, exchange_name, routing_key):
+    """Publish a message in confirm mode. Returns a future resolved when it is confirmed."""
+    future = asyncio.Future()
+    delivery_tag = self._next_delivery_tag
+    self._unconfirmed[delivery_tag] = future
+    self._next_delivery_tag += 1
+    try:
+      await self.basic_publish(payload, exchange_name, routing_key)
+    except Exception:
+      # The caller gets this exception instead of the future.
+      self._unconfirmed.pop(delivery_tag, None)
+      if future.done():
+        future.exception()
+      raise
+    return future
+
+  def _confirm(self, frame, exception=None):
+    if frame.multiple:
+      delivery_tags = [tag for tag in self._unconfirmed if tag <= frame.delivery_tag]
+    else:
+      delivery_tags = [frame.delivery_tag]
+    for delivery_tag in delivery_tags:
+      future = self._unconfirmed.pop(delivery_tag, None)
+      if future and not future.done():
+        if exception:
+          future.set_exception(exception)
+        else:
+          future.set_result(True)
+
+  async def basic_server_ack(self, frame):
+    self._confirm(frame)
+
+  async def basic_server_nack(self, frame):
+    self._confirm(frame, exceptions.PublishFailed(frame.delivery_tag))
+
+  def connection_closed(self, server_code=None, server_reason=None, exception=None):
+    for future in self._unconfirmed.values():
+      if not future.done():
+        future.set_exception(exception or exceptions.ChannelClosed())
+    self._unconfirmed.clear()
+    super(Channel, self).connection_closed(server_code, server_reason, exception)
+
+
+class Protocol(amqp_protocol.AmqpProtocol):
+  CHANNEL_FACTORY = Channel
 
 
 async def _connect():
@@ -17,7 +94,8 @@ async def _connect():
     return await _protocol_future
   _protocol_future = future = asyncio.Future()
   try:
-    _, protocol = await aioamqp.connect(host=options.mq_host, virtualhost=options.mq_vhost)
+    _, protocol = await aioamqp.connect(host=options.mq_host, virtualhost=options.mq_vhost,
+                                        protocol_factory=Protocol)
     future.set_result(protocol)
     asyncio.get_event_loop().create_task(_wait_protocol(protocol))
     return protocol
@@ -56,3 +134,80 @@ async def _wait_channel(channel, key):
   global _channel_futures
   await channel.close_event.wait()
   del _channel_futures[key]
+
+
+async def _publish_batch(batch):
+  """Publish messages and wait for their confirms. Returns True or the exception of each."""
+  confirms = []
+  send_error = None
+  try:
+    # Declarations are gone after the broker restarts, redo them before publishing again.
+    declares = {}
+    for _, routing_key, _, declare, _ in batch:
+      if declare:
+        declares.setdefault(routing_key, declare)
+    for declare in declares.values():
+      await declare()
+    publish_channel = await channel('publish')
+    if not publish_channel.publisher_confirms:
+      await publish_channel.confirm_select()
+    for exchange, routing_key, body, _, _ in batch:
+      confirms.append(await publish_channel.publish_confirm(body, exchange, routing_key))
+  except Exception as e:
+    send_error = e
+  results = await asyncio.gather(*confirms, return_exceptions=True)
+  return results + [send_error] * (len(batch) - len(results))
+
+
+async def _publish_pending():
+  while _pending:
+    await asyncio.sleep(options.mq_publish_batch_delay)
+    batch = []
+    while _pending and len(batch) < options.mq_publish_batch_size:
+      message = _pending.popleft()
+      # Skip messages whose publisher timed out.
+      if not message[4].done():
+        batch.append(message)
+    if not batch:
+      continue
+    results = await _publish_batch(batch)
+    retry = []
+    for message, result in zip(batch, results):
+      future = message[4]
+      if future.done():
+        continue
+      if isinstance(result, exceptions.PublishFailed):
+        # Rejected by the broker, publishing again would not help.
+        future.set_exception(result)
+      elif isinstance(result, Exception):
+        retry.append(message)
+        last_error = result
+      else:
+        future.set_result(None)
+    if retry:
+      _logger.warning('Publishing %d messages failed, retrying: %r', len(retry), last_error)
+      _pending.extendleft(reversed(retry))
+      await asyncio.sleep(RETRY_DELAY_SECONDS)
+
+
+async def publish(exchange, routing_key, body, declare=None):
+  """Publish a message and wait until the broker confirms it.
+
+  Publishes of all callers are sent in order and confirmed in batches on a shared channel. When the
+  channel or the connection fails, unconfirmed messages are published again after reconnecting, so
+  a message may be delivered more than once. declare is an optional coroutine function which
+  declares the destination, awaited before each attempt, once per routing key in a batch.
+
+  Raises asyncio.TimeoutError if the message is not confirmed within mq_publish_timeout. It is not
+  published again after that, but an attempt in flight may still reach the broker.
+  """
+  global _publish_task
+  future = asyncio.Future()
+  _pending.append((exchange, routing_key, body, declare, future))
+  if not _publish_task or _publish_task.done():
+    _publish_task = asyncio.get_event_loop().create_task(_publish_pending())
+  try:
+    await asyncio.wait_for(asyncio.shield(future), options.mq_publish_timeout)
+  except asyncio.TimeoutError:
+    future.cancel()
+    raise
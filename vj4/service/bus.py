@@ -6,9 +6,10 @@ import bson
 
 from vj4 import mq
 from vj4.util import argmethod
+from vj4.util import subscription
 
 _logger = logging.getLogger(__name__)
-_subscribers = dict()
+_subscribers = subscription.Registry()
 _throttles = dict()
 
 
@@ -26,9 +27,7 @@ async def _consume():
 
   async def on_message(channel, body, envelope, properties):
     e = bson.BSON.decode(body)
-    coroutines = [subscriber(e)
-                  for subscriber, key_set in _subscribers.items()
-                  if e['key'] in key_set]
+    coroutines = [subscriber(e) for subscriber in _subscribers.get(e['key'])]
     await asyncio.gather(*coroutines)
 
   await channel.basic_consume(on_message, queue_name)
@@ -64,10 +63,11 @@ def subscribe(callback, keys):
 
   Args:
     callback: coroutine function for bus callback.
-    keys: list, set or tuple of object for event keys.
+    keys: list, set or tuple of object for event keys. A string key ending with '*' matches
+        every key starting with the rest of it.
   """
   assert type(keys) in (set, list, tuple)
-  _subscribers[callback] = keys
+  _subscribers.subscribe(callback, keys)
 
 
 def unsubscribe(callback):
@@ -76,8 +76,7 @@ def unsubscribe(callback):
   Args:
     callback: coroutine function for bus callback.
   """
-  if callback in _subscribers:
-    del _subscribers[callback]
+  _subscribers.unsubscribe(callback)
 
 
 @argmethod.wrap
@@ -1,16 +1,21 @@
+import asyncio
 import collections
 import copy
-import io
 import json
 import logging
 import hashlib
+import tempfile
 from enum import Enum
 from zipfile import ZipFile
 
 from vj4 import db
-from vj4.service import bus
+from vj4.service import queue
 from vj4.model.adaptor import problem
 from vj4.model import fs
+from vj4.util import options
+
+options.define('dataset_spool_max_bytes', default=16 * 1024 * 1024,
+               help='Datasets larger than this are spooled to disk for validation.')
 
 _logger = logging.getLogger(__name__)
 
@@ -212,32 +217,85 @@ def _process_sample(bytes):
     str += "```"
     return str
 
-async def _on_problem_data_change(e):
-    value = e["value"]
-    domain_id = value["domain_id"]
-    pid = value["pid"]
+async def _process_dataset(domain_id, pid):
     pdoc = await problem.get(domain_id, pid)
     pdata = await problem.get_data(pdoc)
     if not pdata:
         return
     data = await fs.get(pdata["_id"])
-    bytes = await data.read()
-    md5 = hashlib.md5(bytes).hexdigest()
-    await db.coll('fs.files').update_one({'_id': pdata["_id"]}, {'$set': {'md5': md5}})
-    zip = ZipFile(io.BytesIO(bytes))
-    try:
-        await _validate_dataset(domain_id, pid, zip)
-    except DatasetError as e:
-        _logger.error(e.args[0])
-        await problem.edit(
-            domain_id,
-            pid,
-            dataset_status=e.args[0],
-        )
-    finally:
-        zip.close()
+    with tempfile.SpooledTemporaryFile(max_size=options.dataset_spool_max_bytes) as f:
+        md5 = hashlib.md5()
+        chunk = await data.readchunk()
+        while chunk:
+            md5.update(chunk)
+            f.write(chunk)
+            chunk = await data.readchunk()
         data.close()
+        await db.coll('fs.files').update_one({'_id': pdata["_id"]},
+                                             {'$set': {'md5': md5.hexdigest()}})
+        f.seek(0)
+        zip = ZipFile(f)
+        try:
+            await _validate_dataset(domain_id, pid, zip)
+        except DatasetError as e:
+            _logger.error(e.args[0])
+            await problem.edit(
+                domain_id,
+                pid,
+                dataset_status=e.args[0],
+            )
+        finally:
+            zip.close()
+
+
+async def _consume(channel_future, tag, redelivered, domain_id, pid):
+    channel = await channel_future
+    try:
+        await _process_dataset(domain_id, pid)
+    except Exception as e:
+        _logger.exception(e)
+        ok = False
+    else:
+        ok = True
+    if not channel.is_open:
+        # The broker requeues unacknowledged messages of a closed channel.
+        return
+    if ok:
+        await channel.basic_client_ack(tag)
+    else:
+        # Retry a failed job once, possibly on another worker, then drop it.
+        await channel.basic_client_nack(tag, requeue=not redelivered)
+
+
+async def _start_consume():
+    channel_future = asyncio.Future()
+
+    async def on_message(tag, *, redelivered, domain_id, pid):
+        asyncio.get_event_loop().create_task(
+            _consume(channel_future, tag, redelivered, domain_id, pid))
+
+    channel = await queue.consume('dataset', on_message, with_redelivered=True)
+    channel_future.set_result(channel)
+    return channel
+
+
+async def _work(channel):
+    while True:
+        await channel.close_event.wait()
+        _logger.warning('Dataset queue channel died, waiting for retry.')
+        await asyncio.sleep(2)
+        try:
+            channel = await _start_consume()
+        except Exception as e:
+            _logger.exception(e)
+
 
+async def init():
+    """Consume dataset jobs, each one is delivered to exactly one worker.
 
-def init():
-    bus.subscribe(_on_problem_data_change, ["problem_data_change"])
+    The consumer callback holds up the connection, so processing runs in its own task and the
+    message is acknowledged once it finishes. queue_prefetch bounds the jobs in flight per worker.
+    Consuming starts over on a new channel when the channel dies.
+    """
+    channel = await _start_consume()
+    asyncio.get_event_loop().create_task(_work(channel))
@@ -6,14 +6,13 @@ which broadcasts events to all processes connected to the database.
 import asyncio
 
 from vj4.util import argmethod
+from vj4.util import subscription
 
-_subscribers = {}
+_subscribers = subscription.Registry()
 
 
 async def publish(key, value):
-  coroutines = [subscriber({'key': key, 'value': value})
-                for subscriber, key_set in _subscribers.items()
-                if key in key_set]
+  coroutines = [subscriber({'key': key, 'value': value}) for subscriber in _subscribers.get(key)]
   await asyncio.gather(*coroutines)
 
 
@@ -22,10 +21,11 @@ def subscribe(callback, keys):
 
   Args:
     callback: coroutine function for event callback.
-    keys: list, set or tuple of object for event keys.
+    keys: list, set or tuple of object for event keys. A string key ending with '*' matches
+        every key starting with the rest of it.
   """
   assert type(keys) in (set, list, tuple)
-  _subscribers[callback] = keys
+  _subscribers.subscribe(callback, keys)
 
 
 def unsubscribe(callback):
@@ -34,8 +34,7 @@ def unsubscribe(callback):
   Args:
     callback: coroutine function for event callback.
   """
-  if callback in _subscribers:
-    del _subscribers[callback]
+  _subscribers.unsubscribe(callback)
 
 
 def subscribes(keys):
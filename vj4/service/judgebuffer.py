@@ -0,0 +1,84 @@
+"""Write-coalescing buffer for judge progress updates.
+
+A judge sends one `next` message per test case. Instead of one record.next_judge() round-trip per
+message, the updates of a record are merged and flushed as one update after a short delay or once
+enough cases are pending. Flushes of a record run strictly in order.
+"""
+import asyncio
+import functools
+import logging
+
+from vj4.model import record
+from vj4.util import options
+
+options.define('judge_flush_delay', default=0.1,
+               help='Delay before pending judge updates are flushed, in seconds.')
+options.define('judge_flush_max_cases', default=32,
+               help='Number of pending judge cases which triggers an immediate flush.')
+
+_logger = logging.getLogger(__name__)
+
+
+class Buffer(object):
+  def __init__(self, judge_uid, judge_token):
+    self.judge_uid = judge_uid
+    self.judge_token = judge_token
+    self._sets = {}  # rid -> {field: value}
+    self._pushes = {}  # rid -> {field: [values]}
+    self._timers = {}  # rid -> asyncio.TimerHandle
+    self._tasks = {}  # rid -> last flush task
+
+  def add(self, rid, update):
+    """Merge a next_judge() update of the form {'$set': {...}, '$push': {...}}."""
+    self._sets.setdefault(rid, {}).update(update.get('$set', {}))
+    pushes = self._pushes.setdefault(rid, {})
+    for key, value in update.get('$push', {}).items():
+      pushes.setdefault(key, []).append(value)
+    if len(pushes.get('cases', [])) >= options.judge_flush_max_cases:
+      self._flush(rid)
+    elif rid not in self._timers:
+      self._timers[rid] = asyncio.get_event_loop().call_later(
+          options.judge_flush_delay, self._flush, rid)
+
+  def _flush(self, rid):
+    timer = self._timers.pop(rid, None)
+    if timer:
+      timer.cancel()
+    sets = self._sets.pop(rid, None)
+    pushes = self._pushes.pop(rid, None)
+    if not sets and not pushes:
+      return self._tasks.get(rid)
+    update = {}
+    if sets:
+      update['$set'] = sets
+    if pushes:
+      update['$push'] = {key: {'$each': values} for key, values in pushes.items()}
+    task = asyncio.get_event_loop().create_task(
+        self._next_judge(rid, update, self._tasks.get(rid)))
+    self._tasks[rid] = task
+    task.add_done_callback(functools.partial(self._on_task_done, rid))
+    return task
+
+  def _on_task_done(self, rid, task):
+    if self._tasks.get(rid) is task:
+      del self._tasks[rid]
+
+  async def _next_judge(self, rid, update, previous_task):
+    if previous_task:
+      await asyncio.wait([previous_task])
+    try:
+      rdoc = await record.next_judge(rid, self.judge_uid, self.judge_token, **update)
+    except Exception:
+      _logger.exception('Flushing judge updates failed: rid=%s', rid)
+      return
+    if rdoc:
+      record.publish_change(rdoc)
+
+  async def flush(self, rid):
+    """Flush the pending updates of a record and wait for all its flushes to finish."""
+    task = self._flush(rid)
+    if task:
+      await asyncio.wait([task])
+
+  async def flush_all(self):
+    await asyncio.gather(*[self.flush(rid) for rid in set(self._sets) | set(self._tasks)])
@@ -0,0 +1,171 @@
+"""Batched counter updates after judging.
+
+A finished record increases counters of its problem and of the domain user. Instead of one
+round-trip per counter, the increments are merged per document and written with one bulk_write
+per collection after a short delay. The difficulty of a problem and the problem status of a user
+with rejudged records are recalculated at most once per delay instead of on every verdict.
+Flushes are per process. The app flushes everything on shutdown, only a process which dies loses
+its pending updates.
+"""
+import asyncio
+import collections
+import functools
+import logging
+
+from pymongo import UpdateOne
+
+from vj4 import db
+from vj4.job import difficulty
+from vj4.job import record
+from vj4.model import document
+from vj4.util import options
+
+options.define('post_judge_flush_delay', default=0.1,
+               help='Delay before pending post-judge counter increments are written, in seconds.')
+options.define('difficulty_update_delay', default=10.0,
+               help='Delay before the difficulty of a judged problem is recalculated, in seconds.')
+options.define('user_in_problem_delay', default=5.0,
+               help='Delay before the problem status of a user is recounted after rejudging, '
+                    'in seconds.')
+
+_logger = logging.getLogger(__name__)
+
+# (domain_id, pid) -> {field: value}
+_problem_incs = collections.defaultdict(collections.Counter)
+# (domain_id, uid) -> {field: value}
+_domain_user_incs = collections.defaultdict(collections.Counter)
+_flush_timer = None
+_write_tasks = set()
+
+
+def _schedule_flush():
+  global _flush_timer
+  if not _flush_timer:
+    _flush_timer = asyncio.get_event_loop().call_later(options.post_judge_flush_delay, _flush)
+
+
+def inc_problem(domain_id, pid, **kwargs):
+  """Increase counters of a problem, like problem.inc() but batched."""
+  _problem_incs[(domain_id, pid)].update(kwargs)
+  _schedule_flush()
+
+
+def inc_domain_user(domain_id, uid, **kwargs):
+  """Increase counters of a domain user, like domain.inc_user() but batched."""
+  _domain_user_incs[(domain_id, uid)].update(kwargs)
+  _schedule_flush()
+
+
+def _get_ops(incs, get_filter, **kwargs):
+  ops = []
+  for key, counter in incs.items():
+    update = {field: value for field, value in counter.items() if value}
+    if update:
+      ops.append(UpdateOne(get_filter(*key), {'$inc': update}, **kwargs))
+  return ops
+
+
+async def _write(problem_incs, domain_user_incs):
+  problem_ops = _get_ops(problem_incs,
+                         lambda domain_id, pid: {'domain_id': domain_id,
+                                                 'doc_type': document.TYPE_PROBLEM,
+                                                 'doc_id': pid})
+  domain_user_ops = _get_ops(domain_user_incs,
+                             lambda domain_id, uid: {'domain_id': domain_id, 'uid': uid},
+                             upsert=True)
+  coros = []
+  if problem_ops:
+    coros.append(db.coll('document').bulk_write(problem_ops, ordered=False))
+  if domain_user_ops:
+    coros.append(db.coll('domain.user').bulk_write(domain_user_ops, ordered=False))
+  try:
+    await asyncio.gather(*coros)
+  except Exception:
+    _logger.exception('Writing post-judge counters failed')
+
+
+def _flush():
+  global _flush_timer
+  if _flush_timer:
+    _flush_timer.cancel()
+    _flush_timer = None
+  if not _problem_incs and not _domain_user_incs:
+    return
+  task = asyncio.get_event_loop().create_task(_write(dict(_problem_incs),
+                                                     dict(_domain_user_incs)))
+  _problem_incs.clear()
+  _domain_user_incs.clear()
+  _write_tasks.add(task)
+  task.add_done_callback(_write_tasks.discard)
+
+
+async def flush():
+  """Write the pending counters and wait for all writes in progress."""
+  _flush()
+  if _write_tasks:
+    await asyncio.wait(list(_write_tasks))
+
+
+class _Deferred(object):
+  """Runs a coroutine function at most once per key per delay, after the delay."""
+
+  def __init__(self, func, delay_option):
+    self._func = func
+    self._delay_option = delay_option
+    self._timers = {}  # key -> asyncio.TimerHandle
+    self._tasks = set()
+
+  def schedule(self, *key):
+    if key not in self._timers:
+      self._timers[key] = asyncio.get_event_loop().call_later(
+          getattr(options, self._delay_option), functools.partial(self._start, key))
+
+  def _start(self, key):
+    del self._timers[key]
+    task = asyncio.get_event_loop().create_task(self._run(key))
+    self._tasks.add(task)
+    task.add_done_callback(self._tasks.discard)
+
+  async def _run(self, key):
+    # Both difficulty and recounting read the counters.
+    await flush()
+    try:
+      await self._func(*key)
+    except Exception:
+      _logger.exception('Deferred %s failed: %r', self._func.__name__, key)
+
+  async def run_all(self):
+    for key, timer in list(self._timers.items()):
+      timer.cancel()
+      self._start(key)
+    if self._tasks:
+      await asyncio.wait(list(self._tasks))
+
+
+async def _update_difficulty(domain_id, pid):
+  await difficulty.update_problem(domain_id, pid)
+
+
+async def _user_in_problem(uid, domain_id, pid):
+  await record.user_in_problem(uid, domain_id, pid)
+
+
+_difficulty_updates = _Deferred(_update_difficulty, 'difficulty_update_delay')
+_user_in_problem_updates = _Deferred(_user_in_problem, 'user_in_problem_delay')
+
+
+def update_difficulty(domain_id, pid):
+  """Recalculate the difficulty of a problem after a delay, including all verdicts until then."""
+  _difficulty_updates.schedule(domain_id, pid)
+
+
+def user_in_problem(uid, domain_id, pid):
+  """Recount the problem status of a user after a delay, once for all rejudged records."""
+  _user_in_problem_updates.schedule(uid, domain_id, pid)
+
+
+async def flush_all():
+  """Write the pending counters and run all deferred recounts and recalculations now."""
+  await _user_in_problem_updates.run_all()
+  await _difficulty_updates.run_all()
+  await flush()
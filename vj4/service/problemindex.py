@@ -0,0 +1,160 @@
+"""Per-process index of the problems visible in a domain.
+
+Each worker keeps the pids of recently listed domains in order, together with the fields which
+decide visibility and categories. Problem list pages are sliced from the index instead of counting
+and skipping in MongoDB. Any change to those fields invalidates the index of the domain in every
+process over vj4.service.bus.
+"""
+import asyncio
+import collections
+import time
+
+from vj4 import error
+from vj4.service import bus
+from vj4.util import options
+
+options.define('problem_index_max_entries', default=64,
+               help='Maximum number of domain problem indexes kept in memory.')
+options.define('problem_index_expire_seconds', default=300,
+               help='Expire time for in-memory domain problem indexes, in seconds.')
+
+FIELDS = ['doc_id', 'hidden', 'owner_uid', 'shared_uids', 'category', 'tag']
+# Fields of a problem whose change affects the index.
+INDEX_FIELDS = frozenset(FIELDS)
+MAX_VIEWS = 256
+
+_indexes = collections.OrderedDict()
+# (domain_id, version) -> loading task.
+_loading = {}
+# domain_id -> version, increased on every invalidation so that loads racing with an
+# invalidation are not kept.
+_versions = collections.defaultdict(int)
+
+
+class Index(object):
+  """Problems of a domain ordered by pid.
+
+  Lists returned by the index are shared between requests, so callers must not modify them.
+  """
+
+  def __init__(self, pdocs):
+    self.loaded_at = time.monotonic()
+    self._pids = []
+    self._hidden = []
+    self._labels = []
+    self._public = []
+    self._restricted = collections.defaultdict(list)
+    self._views = collections.OrderedDict()
+    for position, pdoc in enumerate(pdocs):
+      self._pids.append(pdoc['doc_id'])
+      self._hidden.append(pdoc.get('hidden') is True)
+      self._labels.append(frozenset([('category', c) for c in pdoc.get('category', [])] +
+                                    [('tag', t) for t in pdoc.get('tag', [])]))
+      if pdoc.get('hidden') is False:
+        self._public.append(position)
+      else:
+        for uid in {pdoc.get('owner_uid'), *pdoc.get('shared_uids', [])}:
+          self._restricted[uid].append(position)
+
+  def _get_positions(self, uid, view_hidden, only_hidden):
+    """Positions of the visible problems, same as the $or query on hidden/owner/shared_uids."""
+    key = (uid, view_hidden, only_hidden)
+    if key in self._views:
+      self._views.move_to_end(key)
+      return self._views[key]
+    if view_hidden:
+      positions = range(len(self._pids))
+    elif uid in self._restricted:
+      positions = sorted(self._public + self._restricted[uid])
+    else:
+      positions = self._public
+    if only_hidden:
+      positions = [position for position in positions if self._hidden[position]]
+    self._views[key] = positions
+    if len(self._views) > MAX_VIEWS:
+      self._views.popitem(False)
+    return positions
+
+  def get_page(self, uid, view_hidden, page, page_size, *, only_hidden=False,
+               category_groups=None):
+    """Get a page of visible pids.
+
+    Args:
+      uid: the user who views the list.
+      view_hidden: whether the user can view all hidden problems.
+      page: 1-based page number.
+      page_size: number of pids per page.
+      only_hidden: only include hidden problems.
+      category_groups: a list of groups of ('category' or 'tag', value) pairs. A problem matches
+          if it has all labels of any group.
+
+    Returns:
+      Tuple of (pids, num_pages, count).
+    """
+    if page <= 0:
+      raise error.ValidationError('page')
+    positions = self._get_positions(uid, view_hidden, only_hidden)
+    if category_groups:
+      positions = [position for position in positions
+                   if any(self._labels[position].issuperset(group) for group in category_groups)]
+    count = len(positions)
+    begin = (page - 1) * page_size
+    pids = [self._pids[position] for position in positions[begin:begin + page_size]]
+    return pids, (count + page_size - 1) // page_size, count
+
+
+async def _on_invalidate(e):
+  domain_id = e['value']
+  _versions[domain_id] += 1
+  if domain_id in _indexes:
+    del _indexes[domain_id]
+
+
+def init():
+  bus.subscribe(_on_invalidate, ['problem_index_invalidate'])
+
+
+async def _load(domain_id, version, load):
+  try:
+    index = Index(await load(domain_id))
+  finally:
+    del _loading[(domain_id, version)]
+  if version == _versions[domain_id]:
+    _indexes[domain_id] = index
+    if len(_indexes) > options.problem_index_max_entries:
+      _indexes.popitem(False)
+  return index
+
+
+async def get(domain_id, load):
+  """Get the problem index of a domain.
+
+  Args:
+    domain_id: the domain.
+    load: coroutine function which takes the domain_id and returns problem documents with FIELDS,
+        sorted by doc_id.
+
+  Returns:
+    The Index.
+  """
+  index = _indexes.get(domain_id)
+  if index and time.monotonic() - index.loaded_at < options.problem_index_expire_seconds:
+    _indexes.move_to_end(domain_id)
+    return index
+  # Loads started before the last invalidation are not shared with new requests.
+  key = (domain_id, _versions[domain_id])
+  if key not in _loading:
+    _loading[key] = asyncio.get_event_loop().create_task(_load(*key, load))
+  return await asyncio.shield(_loading[key])
+
+
+async def invalidate(domain_id):
+  """Drop the problem index of a domain in all processes."""
+  await _on_invalidate({'value': domain_id})
+  await bus.publish('problem_index_invalidate', domain_id)
+
+
+def uninit():
+  bus.unsubscribe(_on_invalidate)
+  _indexes.clear()
+  _versions.clear()
@@ -1,3 +1,7 @@
+import asyncio
+import collections
+import functools
+
 import bson
 
 from vj4 import mq
@@ -5,17 +9,63 @@ from vj4.util import options
 
 options.define('queue_prefetch', default=1, help='Queue prefetch count.')
 
+# Queue name -> channel it was declared on. Declarations are redone on a new channel, which also
+# covers reconnecting to a restarted broker.
+_declared = {}
+# aioamqp allows one declaration of a queue name in flight per channel.
+_declare_locks = collections.defaultdict(asyncio.Lock)
 
-async def publish(key, **kwargs):
+
+async def _declare(key):
   channel = await mq.channel('queue')
-  await channel.queue_declare(key)
-  await channel.basic_publish(bson.BSON.encode(kwargs), '', key)
+  async with _declare_locks[key]:
+    result = await channel.queue_declare(key)
+  _declared[key] = channel
+  return result
+
 
+async def _ensure_declared(key):
+  channel = await mq.channel('queue')
+  if _declared.get(key) is not channel:
+    await _declare(key)
+
+
+def _get_declare(key):
+  # mq.publish declares the queue again before retrying, it may be gone after a reconnect.
+  return functools.partial(_ensure_declared, key)
 
-async def consume(key, on_message):
+
+async def publish(key, **kwargs):
+  await mq.publish('', key, bson.BSON.encode(kwargs), _get_declare(key))
+
+
+async def publish_many(key, messages):
+  """Publish a list of messages, each a dict of keyword arguments of on_message."""
+  declare = _get_declare(key)
+  await asyncio.gather(*[mq.publish('', key, bson.BSON.encode(message), declare)
+                         for message in messages])
+
+
+async def get_message_count(key):
+  """Get the number of messages waiting in the queue, not including unacknowledged ones."""
+  return (await _declare(key))['message_count']
+
+
+async def consume(key, on_message, with_redelivered=False):
+  """Consume a queue on a new channel, calling on_message(tag, **kwargs) for each message.
+
+  If with_redelivered is set, on_message also gets redelivered, which is true for messages that
+  were delivered before and not acknowledged.
+  """
   channel = await mq.channel()
   await channel.queue_declare(key)
   await channel.basic_qos(prefetch_count=options.queue_prefetch)
-  await channel.basic_consume((lambda channel, body, envelope, properties:
-                               on_message(envelope.delivery_tag, **bson.BSON.decode(body))), key)
+
+  async def on_amqp_message(channel, body, envelope, properties):
+    kwargs = bson.BSON.decode(body)
+    if with_redelivered:
+      kwargs['redelivered'] = envelope.is_redeliver
+    await on_message(envelope.delivery_tag, **kwargs)
+
+  await channel.basic_consume(on_amqp_message, key)
   return channel
@@ -0,0 +1,163 @@
+"""Per-process scoreboard engine for contests and homework.
+
+Each worker keeps the ranked status documents of recently viewed contests in memory. Deltas
+published by contest.update_status are applied in place, so a scoreboard view does not need to
+re-read every status document. Invalidations and deltas are broadcast over vj4.service.bus, which
+keeps every prefork worker consistent.
+"""
+import asyncio
+import bisect
+import collections
+import time
+
+from vj4.service import bus
+from vj4.util import options
+
+options.define('scoreboard_max_entries', default=16,
+               help='Maximum number of scoreboards kept in memory.')
+options.define('scoreboard_expire_seconds', default=60,
+               help='Expire time for in-memory scoreboards, in seconds.')
+
+_boards = collections.OrderedDict()
+_loading = {}
+_pending = {}
+
+
+class Board(object):
+  """Status documents of a contest, kept sorted by the rule's status order.
+
+  The rows built from a board are cached until the next delta and shared between requests, so
+  callers must not modify them.
+  """
+
+  def __init__(self, tdoc, tsdocs, udict, dudict, pdict, sort_key):
+    self.tdoc = tdoc
+    self.udict = udict
+    self.dudict = dudict
+    self.pdict = pdict
+    self.loaded_at = time.monotonic()
+    self._sort_key = sort_key
+    self._tsdocs = sorted(tsdocs, key=sort_key)
+    self._keys = [sort_key(tsdoc) for tsdoc in self._tsdocs]
+    self._uid_keys = {tsdoc['uid']: key for tsdoc, key in zip(self._tsdocs, self._keys)}
+    self._uid_revs = {tsdoc['uid']: tsdoc.get('rev', 0) for tsdoc in self._tsdocs}
+    self._rows = {}
+
+  @property
+  def tsdocs(self):
+    return self._tsdocs
+
+  def apply(self, tsdoc):
+    """Apply an updated status document.
+
+    Returns:
+      False if the status document belongs to an unknown user and the board has to be reloaded.
+    """
+    uid = tsdoc['uid']
+    if uid not in self._uid_revs or uid not in self.udict:
+      return False
+    if tsdoc.get('rev', 0) <= self._uid_revs[uid]:
+      return True
+    old_key = self._uid_keys[uid]
+    index = bisect.bisect_left(self._keys, old_key)
+    while self._tsdocs[index]['uid'] != uid:
+      index += 1
+    del self._keys[index]
+    del self._tsdocs[index]
+    key = self._sort_key(tsdoc)
+    index = bisect.bisect_right(self._keys, key)
+    self._keys.insert(index, key)
+    self._tsdocs.insert(index, tsdoc)
+    self._uid_keys[uid] = key
+    self._uid_revs[uid] = tsdoc.get('rev', 0)
+    self._rows.clear()
+    return True
+
+  def get_rows(self, cache_key, build_func):
+    if cache_key not in self._rows:
+      self._rows[cache_key] = build_func(self)
+    return self._rows[cache_key]
+
+
+async def _on_status_change(e):
+  value = e['value']
+  key = (value['domain_id'], value['doc_type'], value['tid'])
+  if key in _pending:
+    _pending[key].append(value['tsdoc'])
+  board = _boards.get(key)
+  if board and not board.apply(value['tsdoc']):
+    del _boards[key]
+
+
+def _drop(key):
+  if key in _pending:
+    _pending[key].append(None)
+  if key in _boards:
+    del _boards[key]
+
+
+async def _on_invalidate(e):
+  value = e['value']
+  _drop((value['domain_id'], value['doc_type'], value['tid']))
+
+
+def init():
+  bus.subscribe(_on_status_change, ['scoreboard_status_change'])
+  bus.subscribe(_on_invalidate, ['scoreboard_invalidate'])
+
+
+async def _load(key, load):
+  _pending[key] = []
+  try:
+    board = await load(*key)
+  finally:
+    pending = _pending.pop(key)
+    del _loading[key]
+  # Deltas which arrived during loading may or may not be included in the loaded documents,
+  # the revision check in Board.apply() sorts it out.
+  if all(tsdoc is not None and board.apply(tsdoc) for tsdoc in pending):
+    _boards[key] = board
+    if len(_boards) > options.scoreboard_max_entries:
+      _boards.popitem(False)
+  return board
+
+
+async def get(key, load):
+  """Get the board of a contest.
+
+  Args:
+    key: tuple of (domain_id, doc_type, tid).
+    load: coroutine function which takes the elements of key and returns a Board.
+
+  Returns:
+    The Board.
+  """
+  board = _boards.get(key)
+  if board and time.monotonic() - board.loaded_at < options.scoreboard_expire_seconds:
+    _boards.move_to_end(key)
+    return board
+  if key not in _loading:
+    _loading[key] = asyncio.get_event_loop().create_task(_load(key, load))
+  return await asyncio.shield(_loading[key])
+
+
+def publish_status(domain_id, doc_type, tid, tsdoc):
+  """Broadcast an updated status document to the boards of all processes."""
+  tsdoc = {k: v for k, v in tsdoc.items() if k != 'journal'}
+  bus.publish_throttle('scoreboard_status_change',
+                       {'domain_id': domain_id, 'doc_type': doc_type, 'tid': tid, 'tsdoc': tsdoc},
+                       ('scoreboard_status_change', domain_id, doc_type, tid, tsdoc['uid']))
+
+
+def invalidate(domain_id, doc_type, tid):
+  """Drop the board of a contest in all processes, in this process before returning."""
+  _drop((domain_id, doc_type, tid))
+  bus.publish_throttle('scoreboard_invalidate',
+                       {'domain_id': domain_id, 'doc_type': doc_type, 'tid': tid},
+                       ('scoreboard_invalidate', domain_id, doc_type, tid))
+
+
+def uninit():
+  bus.unsubscribe(_on_status_change)
+  bus.unsubscribe(_on_invalidate)
+  _boards.clear()
@@ -1,20 +1,28 @@
 import collections
 import copy
+import time
 
 from vj4.service import bus
 from vj4.util import options
 
 PREFIX_DISCUSSION_NODES = 'discussion-nodes-'
+PREFIX_DOMAIN = 'domain-'
 
 options.define('smallcache_max_entries', default=64,
                help='Maximum number of entries in smallcache.')
 
 _cache = collections.OrderedDict()
+_expire_at = dict()
+
+
+def _unset_local(key):
+  if key in _cache:
+    del _cache[key]
+  _expire_at.pop(key, None)
 
 
 async def _on_unset(e):
-  if e['value'] in _cache:
-    del _cache[e['value']]
+  _unset_local(e['value'])
 
 
 def init():
@@ -24,6 +32,9 @@ def init():
 def get_direct(key, default=None):
   if key not in _cache:
     return default
+  if key in _expire_at and _expire_at[key] <= time.monotonic():
+    _unset_local(key)
+    return default
   _cache.move_to_end(key)
   return _cache[key]
 
@@ -32,22 +43,25 @@ def get(key, default=None):
   return copy.deepcopy(get_direct(key, default))
 
 
-def set_local_direct(key, value):
-  if key in _cache:
-    del _cache[key]
+def set_local_direct(key, value, expire_seconds=None):
+  _unset_local(key)
   _cache[key] = value
+  if expire_seconds is not None:
+    _expire_at[key] = time.monotonic() + expire_seconds
   if len(_cache) > options.smallcache_max_entries:
-    _cache.popitem(False)
+    _unset_local(next(iter(_cache)))
 
 
-def set_local(key, value):
-  set_local_direct(key, copy.deepcopy(value))
+def set_local(key, value, expire_seconds=None):
+  set_local_direct(key, copy.deepcopy(value), expire_seconds)
 
 
 async def unset_global(key):
+  _unset_local(key)
   await bus.publish('smallcache-unset', key)
 
 
 def uninit():
   bus.unsubscribe(_on_unset)
   _cache.clear()
+  _expire_at.clear()
@@ -8,6 +8,7 @@ import pymongo
 from vj4 import db
 from vj4.service import bus
 from vj4.service import event
+from vj4.service import problemindex
 from vj4.service import queue
 from vj4.service import smallcache
 from vj4.util import options
@@ -23,6 +24,9 @@ class DatabaseTestCase(unittest.TestCase):
     db.coll.cache_clear()
     db.fs.cache_clear()
     options.db_name = 'unittest_' + str(os.getpid())
+    # Cached documents must not outlive the database of a previous test.
+    smallcache.uninit()
+    problemindex.uninit()
     wait(db.init())
     wait(tools.ensure_all_indexes())
 
@@ -53,15 +57,24 @@ class QueueTestCase(DatabaseTestCase):
   async def noop(*args, **kwargs):
     pass
 
+  async def zero(*args, **kwargs):
+    return 0
+
   def setUp(self):
     super(QueueTestCase, self).setUp()
     self.old_publish = queue.publish
     queue.publish = QueueTestCase.noop
+    self.old_publish_many = queue.publish_many
+    queue.publish_many = QueueTestCase.noop
+    self.old_get_message_count = queue.get_message_count
+    queue.get_message_count = QueueTestCase.zero
     self.old_consume = queue.consume
     queue.consume = QueueTestCase.noop
 
   def tearDown(self):
     queue.publish = self.old_publish
+    queue.publish_many = self.old_publish_many
+    queue.get_message_count = self.old_get_message_count
     queue.consume = self.old_consume
     super(QueueTestCase, self).tearDown()
 
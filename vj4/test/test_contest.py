@@ -293,7 +293,7 @@ class CfMaxScoresValidationTest(unittest.TestCase):
                      [500, 1000])
 
 
-class OuterTest(base.DatabaseTestCase):
+class OuterTest(base.BusTestCase):
   @base.wrap_coro
   async def test_add_get(self):
     begin_at = datetime.datetime.utcnow()
@@ -312,7 +312,7 @@ class OuterTest(base.DatabaseTestCase):
     self.assertFalse('content' in tdocs[0])
 
 
-class InnerTest(base.DatabaseTestCase):
+class InnerTest(base.BusTestCase):
   def setUp(self):
     super(InnerTest, self).setUp()
     begin_at = NOW
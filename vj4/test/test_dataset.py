@@ -0,0 +1,68 @@
+import asyncio
+import unittest
+
+from vj4.service import dataset
+from vj4.test import base
+
+DOMAIN_ID = 'dummy_domain'
+PID = 1
+TAG = 7
+
+
+class FakeChannel(object):
+  def __init__(self, is_open=True):
+    self.is_open = is_open
+    self.acks = []
+    self.nacks = []
+
+  async def basic_client_ack(self, tag):
+    self.acks.append(tag)
+
+  async def basic_client_nack(self, tag, requeue=True):
+    self.nacks.append((tag, requeue))
+
+
+class ConsumeTest(unittest.TestCase):
+  def setUp(self):
+    self.error = None
+    self.old_process_dataset = dataset._process_dataset
+    dataset._process_dataset = self.process_dataset
+
+  def tearDown(self):
+    dataset._process_dataset = self.old_process_dataset
+
+  async def process_dataset(self, domain_id, pid):
+    if self.error:
+      raise self.error
+
+  async def consume(self, channel, redelivered=False):
+    channel_future = asyncio.Future()
+    channel_future.set_result(channel)
+    await dataset._consume(channel_future, TAG, redelivered, DOMAIN_ID, PID)
+
+  @base.wrap_coro
+  async def test_ack(self):
+    channel = FakeChannel()
+    await self.consume(channel)
+    self.assertEqual(channel.acks, [TAG])
+    self.assertEqual(channel.nacks, [])
+
+  @base.wrap_coro
+  async def test_retry_once(self):
+    self.error = ValueError()
+    channel = FakeChannel()
+    await self.consume(channel)
+    await self.consume(channel, redelivered=True)
+    self.assertEqual(channel.acks, [])
+    self.assertEqual(channel.nacks, [(TAG, True), (TAG, False)])
+
+  @base.wrap_coro
+  async def test_closed(self):
+    channel = FakeChannel(is_open=False)
+    await self.consume(channel)
+    self.assertEqual(channel.acks, [])
+    self.assertEqual(channel.nacks, [])
+
+
+if __name__ == '__main__':
+  unittest.main()
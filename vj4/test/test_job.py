@@ -1,11 +1,15 @@
+import random
 import unittest
 
 from vj4 import constant
 from vj4 import job
+from vj4.job import rating
 from vj4.model import domain
 from vj4.model import record
 from vj4.model.adaptor import problem
+from vj4.service import queue
 from vj4.test import base
+from vj4.util import options
 
 DOMAIN_ID = 'system'
 OWNER_UID = 20
@@ -133,7 +137,70 @@ class RankTest(RecordTestCase):
     self.assertGreaterEqual(dudoc1['level'], dudoc2['level'])
 
 
+class RejudgeTest(RecordTestCase):
+  def setUp(self):
+    super(RejudgeTest, self).setUp()
+    self.messages = []
+    self.old_publish_many = queue.publish_many
+    queue.publish_many = self.publish_many
+    self.old_rejudge_batch_size = options.rejudge_batch_size
+    options.rejudge_batch_size = 2
+
+  def tearDown(self):
+    options.rejudge_batch_size = self.old_rejudge_batch_size
+    queue.publish_many = self.old_publish_many
+    super(RejudgeTest, self).tearDown()
+
+  async def publish_many(self, key, messages):
+    self.assertEqual(key, 'judge')
+    self.assertLessEqual(len(messages), options.rejudge_batch_size)
+    self.messages.extend(messages)
+
+  @base.wrap_coro
+  async def test_rejudge_all(self):
+    await self.init_record()
+    self.assertEqual(await record.rejudge_all(DOMAIN_ID, pid=str(self.pid1)), 4)
+    self.assertEqual([message['rid'] for message in self.messages],
+                     [self.rid_p1u2_wa, self.rid_p1_ac2, self.rid_p1_ac, self.rid_p1_wa_to_ac])
+    rdoc = await record.get(self.rid_p1_ac)
+    self.assertEqual(rdoc['status'], constant.record.STATUS_WAITING)
+    self.assertTrue(rdoc['rejudged'])
+    rdoc = await record.get(self.rid_p2_ac)
+    self.assertEqual(rdoc['status'], constant.record.STATUS_ACCEPTED)
+
+
 class DifficultyTest(unittest.TestCase):
   def test_integrate(self):
     for x in range(1000):
       self.assertEqual(job.difficulty._integrate(x), job.difficulty._integrate_direct(x))
+
+
+class RatingTest(unittest.TestCase):
+  def test_seed_table(self):
+    rand = random.Random(1)
+    ratings = [400, 400, 1] + [rand.randint(-200, 9000) for _ in range(200)]
+    contestants = [rating.Contestant(uid, uid + 1, r) for uid, r in enumerate(ratings)]
+    table = rating.SeedTable(contestants)
+    seed_cache = {}
+    for r in set(ratings) | set(range(1, 8001, 7)):
+      self.assertEqual(table.get(r), rating.get_seed(contestants, r, seed_cache))
+
+  def test_process(self):
+    contestants = [rating.Contestant(uid, 20 - uid, 1500 - uid * 10) for uid in range(20)]
+    deltas = rating.calculate_rating_changes(contestants)
+    self.assertEqual(len(deltas), 20)
+    self.assertLessEqual(sum(deltas.values()), 0)
+    self.assertGreater(deltas[19], 0)
+    self.assertLess(deltas[0], 0)
+
+  def test_contest_rating_changes(self):
+    tdoc = {'doc_id': 'tid', 'begin_at': None, 'title': 'contest'}
+    rows = [[]] + [[{'value': rank}, {'raw': {'_id': uid}}] for rank, uid in [(1, 10), (2, 11)]]
+    changes = rating.get_contest_rating_changes(DOMAIN_ID, tdoc, rows, {11: 1000}, None)
+    changes = {change['uid']: change for change in changes}
+    self.assertEqual(changes[10]['previous_rating'], rating.DEFAULT_RATING)
+    self.assertEqual(changes[11]['previous_rating'], 1000)
+    for change in changes.values():
+      self.assertEqual(change['rating_id'], 'tid')
+      self.assertEqual(change['new_rating'], change['previous_rating'] + change['delta'])
+    self.assertGreater(changes[10]['delta'], 0)
@@ -0,0 +1,64 @@
+import asyncio
+import unittest
+
+from vj4.model import record
+from vj4.service import bus
+from vj4.service import judgebuffer
+from vj4.test import base
+from vj4.util import options
+
+RID = 'rid'
+
+
+class BufferTest(unittest.TestCase):
+  def setUp(self):
+    self.updates = []
+    self.published = []
+    self.old_next_judge = record.next_judge
+    record.next_judge = self.next_judge
+    self.old_publish_throttle = bus.publish_throttle
+    bus.publish_throttle = lambda key, value, throttle_id: self.published.append(value)
+    self.buffer = judgebuffer.Buffer(0, 'token')
+
+  def tearDown(self):
+    record.next_judge = self.old_next_judge
+    bus.publish_throttle = self.old_publish_throttle
+
+  async def next_judge(self, rid, judge_uid, judge_token, **kwargs):
+    await asyncio.sleep(0)
+    self.updates.append(kwargs)
+    return {'_id': rid}
+
+  @base.wrap_coro
+  async def test_merge(self):
+    self.buffer.add(RID, {'$set': {'status': 1}, '$push': {'compiler_texts': 'a'}})
+    self.buffer.add(RID, {'$push': {'cases': 1}, '$set': {'progress': 0.5}})
+    self.buffer.add(RID, {'$push': {'cases': 2}, '$set': {'status': 2}})
+    await self.buffer.flush(RID)
+    self.assertEqual(self.updates, [{'$set': {'status': 2, 'progress': 0.5},
+                                     '$push': {'compiler_texts': {'$each': ['a']},
+                                               'cases': {'$each': [1, 2]}}}])
+    self.assertEqual(len(self.published), 1)
+    await self.buffer.flush(RID)
+    self.assertEqual(len(self.updates), 1)
+
+  @base.wrap_coro
+  async def test_max_cases(self):
+    for i in range(options.judge_flush_max_cases * 2 + 1):
+      self.buffer.add(RID, {'$push': {'cases': i}})
+    await self.buffer.flush(RID)
+    cases = [update['$push']['cases']['$each'] for update in self.updates]
+    self.assertEqual(len(cases), 3)
+    self.assertEqual(sum(cases, []), list(range(options.judge_flush_max_cases * 2 + 1)))
+
+  @base.wrap_coro
+  async def test_delay(self):
+    self.buffer.add(RID, {'$push': {'cases': 1}})
+    await asyncio.sleep(options.judge_flush_delay * 2)
+    self.assertEqual(len(self.updates), 1)
+    await self.buffer.flush_all()
+    self.assertEqual(len(self.updates), 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 
 from vj4.util import misc
+from vj4.util import options
 
 
 class Test(unittest.TestCase):
@@ -12,6 +13,35 @@ class Test(unittest.TestCase):
     self.assertListEqual(misc.dedupe([0]),[0])
 
 
+class MarkdownTest(unittest.TestCase):
+  def setUp(self):
+    self.old_markdown_cache_max_size = options.markdown_cache_max_size
+    misc._markdown_cache.clear()
+    misc._markdown_cache_size = 0
+
+  def tearDown(self):
+    options.markdown_cache_max_size = self.old_markdown_cache_max_size
+    misc._markdown_cache.clear()
+    misc._markdown_cache_size = 0
+
+  def test_cache(self):
+    html = misc.markdown('**bold**')
+    self.assertEqual(html, misc._render_markdown('**bold**'))
+    self.assertIs(misc.markdown('**bold**'), html)
+    self.assertNotEqual(misc.markdown('*italic*'), html)
+    self.assertEqual(len(misc._markdown_cache), 2)
+
+  def test_evict(self):
+    options.markdown_cache_max_size = len(misc._render_markdown('a')) * 2
+    misc.markdown('a')
+    misc.markdown('b')
+    misc.markdown('a')
+    misc.markdown('c')
+    self.assertEqual(list(misc._markdown_cache.values()),
+                     [misc._render_markdown('a'), misc._render_markdown('c')])
+    self.assertLessEqual(misc._markdown_cache_size, options.markdown_cache_max_size)
+
+
 class ProblemLabelTest(unittest.TestCase):
   def test_first_letters(self):
     self.assertEqual(misc.problem_label(0), 'A')
@@ -1,5 +1,8 @@
 import datetime
 import hashlib
+import io
+import os
+import tempfile
 import time
 import unittest
 
@@ -16,8 +19,10 @@ from vj4.model import fs
 from vj4.model import opcount
 from vj4.model import rating
 from vj4.model import system
+from vj4.model import token
 from vj4.model import user
 from vj4.test import base
+from vj4.util import options
 
 CONTENT = 'dummy_content'
 CONTENT2 = 'dummy_dummy'
@@ -128,7 +133,7 @@ class DocumentTest(base.DatabaseTestCase):
       await document.capped_inc_status(DOMAIN_ID, DOC_TYPE, doc_id, OWNER_UID, STATUS_KEY, 1)
 
 
-class DomainTest(base.DatabaseTestCase):
+class DomainTest(base.SmallcacheTestCase):
   @base.wrap_coro
   async def test_add_get_transfer(self):
     inserted_id = await domain.add(DOMAIN_ID, OWNER_UID, ROLES, name=DOMAIN_NAME)
@@ -328,9 +333,10 @@ class DomainTest(base.DatabaseTestCase):
     self.assertEqual(ddoc['roles'][BAR_ROLE], 666)
 
 
-class FsTest(base.DatabaseTestCase):
+class FsTest(base.BusTestCase):
   CONTENT = b'dummy_content'
   CONTENT_MD5 = hashlib.md5(CONTENT).hexdigest()
+  CONTENT_SHA256 = hashlib.sha256(CONTENT).hexdigest()
   SECRET = 'dummy_secret'
 
   @base.wrap_coro
@@ -343,20 +349,28 @@ class FsTest(base.DatabaseTestCase):
     content = await grid_out.read()
     self.assertEqual(content, self.CONTENT)
     md5 = await fs.get_md5(file_id)
-    # MD5 is no longer calculated by default in Motor 3.x, so it may be None
-    if md5:
-      self.assertEqual(md5, self.CONTENT_MD5)
-      file_id_2 = await fs.link_by_md5(md5)
-      self.assertEqual(file_id, file_id_2)
-      # Two links exist, so unlink twice
-      await fs.unlink(file_id)
-      self.assertTrue(await fs.get(file_id))
-      await fs.unlink(file_id)
-    else:
-      # Only one link exists, so unlink once
-      await fs.unlink(file_id)
+    self.assertEqual(md5, self.CONTENT_MD5)
+    file_id_2 = await fs.link_by_md5(md5)
+    self.assertEqual(file_id, file_id_2)
+    # Two links exist, so unlink twice
+    await fs.unlink(file_id)
+    self.assertTrue(await fs.get(file_id))
+    await fs.unlink(file_id)
     with self.assertRaises(gridfs_errors.NoFile):
       await fs.get(file_id)
+    self.assertIsNone(await fs.link_by_md5(md5))
+
+  @base.wrap_coro
+  async def test_link_by_sha256(self):
+    file_id = await fs.add_data('application/octet-stream', self.CONTENT)
+    grid_in = await fs.add('application/octet-stream')
+    await grid_in.write(io.BytesIO(self.CONTENT))
+    await grid_in.close()
+    self.assertEqual(grid_in.sha256, self.CONTENT_SHA256)
+    self.assertEqual((await fs.get_meta(file_id))['sha256'], self.CONTENT_SHA256)
+    self.assertEqual(await fs.link_by_sha256(grid_in.sha256, grid_in._id), file_id)
+    await fs.unlink(grid_in._id)
+    self.assertIsNone(await fs.link_by_sha256(grid_in.sha256, file_id))
 
   @base.wrap_coro
   async def test_secret(self):
@@ -367,20 +381,82 @@ class FsTest(base.DatabaseTestCase):
     grid_out = await fs.get_by_secret(secret)
     content = await grid_out.read()
     self.assertEqual(content, self.CONTENT)
+    fdoc = await fs.get_meta_by_secret(secret)
+    self.assertEqual(fdoc['_id'], fid)
+    self.assertEqual(await fs.open_meta(fdoc).read(), self.CONTENT)
     await fs.unlink(fid)
     with self.assertRaises(error.NotFoundError):
       await fs.get_by_secret(secret)
+    with self.assertRaises(error.NotFoundError):
+      await fs.get_meta_by_secret(secret)
     self.assertEqual(bool(await fs.get_file_id(secret)), False)
 
 
+class FsDiskCacheTest(unittest.TestCase):
+  CONTENT = b'dummy_content'
+
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.old_dir = options.fs_disk_cache_dir
+    self.old_max_bytes = options.fs_disk_cache_max_bytes
+    options.fs_disk_cache_dir = self.temp_dir.name
+    options.fs_disk_cache_max_bytes = len(self.CONTENT) * 2
+
+  def tearDown(self):
+    options.fs_disk_cache_dir = self.old_dir
+    options.fs_disk_cache_max_bytes = self.old_max_bytes
+    self.temp_dir.cleanup()
+
+  async def add(self, secret, content):
+    fdoc = {'length': len(content), 'metadata': {'secret': secret}}
+    writer = fs.create_disk_cache_writer(fdoc)
+    writer.write(content[:4])
+    writer.write(content[4:])
+    await writer.commit()
+    return fdoc
+
+  @base.wrap_coro
+  async def test_add_open(self):
+    fdoc = await self.add('secret1', self.CONTENT)
+    with await fs.open_disk_cache(fdoc) as file_object:
+      self.assertEqual(file_object.read(), self.CONTENT)
+    self.assertIsNone(await fs.open_disk_cache({'length': 1, 'metadata': {'secret': 'secret1'}}))
+    fs._disk_cache_unset('secret1')
+    self.assertIsNone(await fs.open_disk_cache(fdoc))
+
+  @base.wrap_coro
+  async def test_abort(self):
+    fdoc = {'length': len(self.CONTENT), 'metadata': {'secret': 'secret1'}}
+    writer = fs.create_disk_cache_writer(fdoc)
+    writer.write(self.CONTENT)
+    writer.abort()
+    self.assertIsNone(await fs.open_disk_cache(fdoc))
+    self.assertEqual(os.listdir(self.temp_dir.name), [])
+
+  @base.wrap_coro
+  async def test_evict(self):
+    fdoc1 = await self.add('secret1', self.CONTENT)
+    fdoc2 = await self.add('secret2', self.CONTENT)
+    os.utime(os.path.join(self.temp_dir.name, 'secret1'), (0, 0))
+    fdoc3 = await self.add('secret3', self.CONTENT)
+    self.assertIsNone(await fs.open_disk_cache(fdoc1))
+    (await fs.open_disk_cache(fdoc2)).close()
+    (await fs.open_disk_cache(fdoc3)).close()
+    self.assertIsNone(fs.create_disk_cache_writer(
+        {'length': len(self.CONTENT) * 3, 'metadata': {'secret': 'secret4'}}))
+
+
 class OpcountTest(base.DatabaseTestCase):
   def setUp(self):
     super().setUp()
+    self.old_backend = options.opcount_backend
+    options.opcount_backend = 'db'
     self.old_time = time.time
     time.time = lambda: 0
 
   def tearDown(self):
     time.time = self.old_time
+    options.opcount_backend = self.old_backend
     super().tearDown()
 
   @base.wrap_coro
@@ -397,6 +473,55 @@ class OpcountTest(base.DatabaseTestCase):
     await opcount.inc(OP2, IDENT, 1, 2)
 
 
+class OpcountMemoryTest(unittest.TestCase):
+  def setUp(self):
+    self.old_backend = options.opcount_backend
+    options.opcount_backend = 'memory'
+    self.old_time = time.time
+    time.time = lambda: 0
+
+  def tearDown(self):
+    time.time = self.old_time
+    options.opcount_backend = self.old_backend
+    opcount._windows.clear()
+    opcount._remote_counts.clear()
+    opcount._dirty_keys.clear()
+
+  @base.wrap_coro
+  async def test_inc(self):
+    await opcount.inc(OP1, IDENT, 1, 1)
+    await opcount.inc(OP2, IDENT, 1, 2)
+    with self.assertRaises(error.OpcountExceededError):
+      await opcount.inc(OP1, IDENT, 1, 1)
+    await opcount.inc(OP2, IDENT, 1, 2)
+    with self.assertRaises(error.OpcountExceededError):
+      await opcount.inc(OP2, IDENT, 1, 2)
+    time.time = lambda: 1
+    await opcount.inc(OP1, IDENT, 1, 1)
+    await opcount.inc(OP2, IDENT, 1, 2)
+
+  @base.wrap_coro
+  async def test_sliding_window(self):
+    await opcount.inc(OP1, IDENT, 10, 2)
+    time.time = lambda: 9
+    await opcount.inc(OP1, IDENT, 10, 2)
+    time.time = lambda: 11
+    await opcount.inc(OP1, IDENT, 10, 2)
+    with self.assertRaises(error.OpcountExceededError):
+      await opcount.inc(OP1, IDENT, 10, 2)
+
+  @base.wrap_coro
+  async def test_remote_counts(self):
+    await opcount._on_sync({'value': {'worker_id': 'other', 'reported_at': 0,
+                                      'counts': [[OP1, IDENT, 10, 2]]}})
+    await opcount.inc(OP1, IDENT, 10, 3)
+    with self.assertRaises(error.OpcountExceededError):
+      await opcount.inc(OP1, IDENT, 10, 3)
+    time.time = lambda: 10
+    await opcount.inc(OP1, IDENT, 10, 3)
+    await opcount.inc(OP1, IDENT, 10, 3)
+
+
 class RatingTest(base.DatabaseTestCase):
   @base.wrap_coro
   async def test_get_user_max_rating(self):
@@ -444,5 +569,69 @@ class RatingChartDictTest(unittest.TestCase):
     self.assertEqual(d['rating'], 1485)
 
 
+class TokenTest(base.BusTestCase):
+  def setUp(self):
+    super(TokenTest, self).setUp()
+    token.init()
+
+  def tearDown(self):
+    token.uninit()
+    super(TokenTest, self).tearDown()
+
+  @base.wrap_coro
+  async def test_refresh_cached(self):
+    sid, doc = await token.add(token.TYPE_SAVED_SESSION, 3600, uid=UID)
+    await db.coll('token').update_one({'_id': doc['_id']}, {'$set': {'uid': UID + 1}})
+    session = await token.refresh(sid, token.TYPE_SAVED_SESSION, 3600)
+    self.assertEqual(session['uid'], UID + 1)
+    await db.coll('token').update_one({'_id': doc['_id']}, {'$set': {'uid': UID}})
+    session = await token.refresh(sid, token.TYPE_SAVED_SESSION, 3600)
+    self.assertEqual(session['uid'], UID + 1)
+    self.assertIsNone(await token.refresh(sid, token.TYPE_UNSAVED_SESSION, 3600))
+
+  @base.wrap_coro
+  async def test_refresh_expire(self):
+    sid, doc = await token.add(token.TYPE_SAVED_SESSION, 3600, uid=UID)
+    old_session = await token.refresh(sid, token.TYPE_SAVED_SESSION, 3600)
+    session = await token.refresh(sid, token.TYPE_SAVED_SESSION, 7200)
+    self.assertGreater(session['expire_at'], old_session['expire_at'])
+    ddoc = await db.coll('token').find_one(doc['_id'])
+    self.assertEqual(ddoc['expire_at'], old_session['expire_at'])
+    await token._flush_refreshes()
+    ddoc = await db.coll('token').find_one(doc['_id'])
+    self.assertAlmostEqual(ddoc['expire_at'], session['expire_at'],
+                           delta=datetime.timedelta(milliseconds=1))
+
+  @base.wrap_coro
+  async def test_refresh_write(self):
+    sid, doc = await token.add(token.TYPE_SAVED_SESSION, 3600, uid=UID)
+    await token.refresh(sid, token.TYPE_SAVED_SESSION, 3600, update_ip='::1')
+    ddoc = await db.coll('token').find_one(doc['_id'])
+    self.assertEqual(ddoc['update_ip'], '::1')
+    await token.delete(sid, token.TYPE_SAVED_SESSION)
+    self.assertIsNone(await token.refresh(sid, token.TYPE_SAVED_SESSION, 3600))
+
+
+class TokenFlushFailureTest(unittest.TestCase):
+  class FailingCollection(object):
+    async def bulk_write(self, ops, ordered=True):
+      raise RuntimeError()
+
+  def setUp(self):
+    self.old_coll = db.coll
+    db.coll = lambda name: TokenFlushFailureTest.FailingCollection()
+
+  def tearDown(self):
+    db.coll = self.old_coll
+    token._refreshes.clear()
+
+  @base.wrap_coro
+  async def test_requeue(self):
+    now = datetime.datetime.utcnow()
+    token._refreshes[b'id'] = (token.TYPE_SAVED_SESSION, now, now)
+    await token._flush_refreshes()
+    self.assertEqual(token._refreshes, {b'id': (token.TYPE_SAVED_SESSION, now, now)})
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,113 @@
+import asyncio
+import collections
+import unittest
+
+from aioamqp import exceptions
+
+from vj4 import mq
+from vj4.test import base
+from vj4.util import options
+
+Frame = collections.namedtuple('Frame', ['delivery_tag', 'multiple'])
+
+
+class Protocol(object):
+  def release_channel_id(self, channel_id):
+    pass
+
+
+class Channel(mq.Channel):
+  """Channel which confirms publishes when told to, without a broker."""
+
+  def __init__(self, fail_at=None, log=None):
+    super(Channel, self).__init__(Protocol(), 1)
+    self.publisher_confirms = False
+    self.published = []
+    self.fail_at = fail_at
+    self.log = log if log is not None else []
+
+  async def confirm_select(self):
+    self.publisher_confirms = True
+
+  async def basic_publish(self, payload, exchange_name, routing_key):
+    if len(self.published) == self.fail_at:
+      self.connection_closed()
+      raise exceptions.ChannelClosed()
+    self.published.append(payload)
+    self.log.append(('publish', payload))
+    if len(self.published) % 2 == 0:
+      await self.basic_server_ack(Frame(len(self.published), True))
+
+
+class ChannelTest(unittest.TestCase):
+  @base.wrap_coro
+  async def test_confirm_multiple(self):
+    channel = Channel()
+    channel.basic_publish = lambda *args: asyncio.sleep(0)
+    futures = [await channel.publish_confirm(b'', '', 'key') for _ in range(4)]
+    await channel.basic_server_ack(Frame(2, True))
+    self.assertTrue(futures[0].done() and futures[1].done())
+    self.assertFalse(futures[2].done())
+    await channel.basic_server_nack(Frame(3, False))
+    self.assertTrue(all(await asyncio.gather(*futures[:2])))
+    with self.assertRaises(exceptions.PublishFailed):
+      await futures[2]
+    channel.connection_closed()
+    with self.assertRaises(exceptions.ChannelClosed):
+      await futures[3]
+
+
+class PublishTest(unittest.TestCase):
+  def setUp(self):
+    self.log = []
+    self.channels = [Channel(fail_at=3, log=self.log), Channel(log=self.log)]
+    self.old_channel = mq.channel
+    mq.channel = self.channel
+    self.old_retry_delay = mq.RETRY_DELAY_SECONDS
+    mq.RETRY_DELAY_SECONDS = 0
+    self.old_timeout = options.mq_publish_timeout
+
+  def tearDown(self):
+    mq.channel = self.old_channel
+    mq.RETRY_DELAY_SECONDS = self.old_retry_delay
+    options.mq_publish_timeout = self.old_timeout
+
+  async def declare(self):
+    self.log.append(('declare', self.channels[0].is_open))
+
+  async def channel(self, key=None):
+    self.assertEqual(key, 'publish')
+    return next((channel for channel in self.channels if channel.is_open), self.channels[-1])
+
+  @base.wrap_coro
+  async def test_publish(self):
+    await asyncio.gather(*[mq.publish('', 'key', bytes([i])) for i in range(6)])
+    # The first channel dies after 2 confirmed and 1 unconfirmed publishes, the rest are
+    # published again in order.
+    self.assertEqual(self.channels[0].published, [bytes([0]), bytes([1]), bytes([2])])
+    self.assertEqual(self.channels[1].published, [bytes([2]), bytes([3]), bytes([4]), bytes([5])])
+
+  @base.wrap_coro
+  async def test_declare(self):
+    await asyncio.gather(*[mq.publish('', 'key', bytes([i]), self.declare) for i in range(4)])
+    # Declared once per batch, and again before publishing on the new channel.
+    self.assertEqual(self.log, [('declare', True),
+                                ('publish', bytes([0])), ('publish', bytes([1])),
+                                ('publish', bytes([2])),
+                                ('declare', False),
+                                ('publish', bytes([2])), ('publish', bytes([3]))])
+
+  @base.wrap_coro
+  async def test_timeout(self):
+    options.mq_publish_timeout = 0.05
+    mq.RETRY_DELAY_SECONDS = 0.01
+    # Fails every attempt.
+    self.channels = [Channel(fail_at=0)]
+    with self.assertRaises(asyncio.TimeoutError):
+      await mq.publish('', 'key', b'')
+    await mq._publish_task
+    self.assertFalse(mq._pending)
+
+
+if __name__ == '__main__':
+  unittest.main()
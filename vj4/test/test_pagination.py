@@ -0,0 +1,72 @@
+import unittest
+
+from vj4 import error
+from vj4.test import base
+from vj4.util import pagination
+
+
+class FakeCursor(object):
+  def __init__(self, docs, query):
+    self.docs = docs
+    self.query = query
+
+  def sort(self, sort):
+    for key, direction in reversed(sort):
+      self.docs = sorted(self.docs, key=lambda doc: doc[key], reverse=direction < 0)
+    return self
+
+  def limit(self, limit):
+    self.docs = self.docs[:limit]
+    return self
+
+  async def to_list(self):
+    return self.docs
+
+
+def match(doc, query):
+  for sub_query in query.get('$or', [{}]):
+    if all(doc[key] > value['$gt'] if isinstance(value, dict) and '$gt' in value
+           else doc[key] < value['$lt'] if isinstance(value, dict)
+           else doc[key] == value
+           for key, value in sub_query.items()):
+      return True
+  return False
+
+
+DOCS = [{'update_at': update_at, 'doc_id': doc_id}
+        for update_at, doc_id in [(3, 1), (1, 2), (3, 3), (2, 4), (1, 5), (3, 6), (2, 7)]]
+SORT = [('update_at', -1), ('doc_id', -1)]
+
+
+class PaginationTest(unittest.TestCase):
+  def test_token(self):
+    token = pagination.encode_token([3, 'a', None])
+    self.assertEqual(pagination.decode_token(token), [3, 'a', None])
+    with self.assertRaises(error.ValidationError):
+      pagination.decode_token('bogus')
+
+  def test_keyset_query(self):
+    self.assertEqual(pagination.get_keyset_query(SORT, [3, 6]),
+                     {'$or': [{'update_at': {'$lt': 3}},
+                              {'update_at': 3, 'doc_id': {'$lt': 6}}]})
+
+  @base.wrap_coro
+  async def test_paginate_keyset(self):
+    get_cursor = lambda query: FakeCursor([doc for doc in DOCS if match(doc, query)], query)
+    expected = sorted(DOCS, key=lambda doc: (-doc['update_at'], -doc['doc_id']))
+    token = ''
+    pages = []
+    while True:
+      docs, token, count = await pagination.paginate_keyset(get_cursor, SORT, token, 3)
+      self.assertIsNone(count)
+      pages.append(docs)
+      if not token:
+        break
+    self.assertEqual([len(docs) for docs in pages], [3, 3, 1])
+    self.assertEqual(sum(pages, []), expected)
+    with self.assertRaises(error.ValidationError):
+      await pagination.paginate_keyset(get_cursor, SORT, pagination.encode_token([1]), 3)
+
+
+if __name__ == '__main__':
+  unittest.main()
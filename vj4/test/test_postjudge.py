@@ -0,0 +1,115 @@
+import asyncio
+import unittest
+
+from pymongo import UpdateOne
+
+from vj4 import db
+from vj4.job import difficulty
+from vj4.job import record
+from vj4.model import document
+from vj4.service import postjudge
+from vj4.test import base
+from vj4.util import options
+
+DOMAIN_ID = 'dummy_domain'
+PID = 1
+UID = 22
+
+
+class FakeCollection(object):
+  def __init__(self, writes, name):
+    self.writes = writes
+    self.name = name
+
+  async def bulk_write(self, ops, ordered=True):
+    await asyncio.sleep(0)
+    self.writes.append((self.name, ops))
+
+
+class PostJudgeTest(unittest.TestCase):
+  def setUp(self):
+    self.writes = []
+    self.difficulties = []
+    self.old_coll = db.coll
+    db.coll = lambda name: FakeCollection(self.writes, name)
+    self.old_update_problem = difficulty.update_problem
+    difficulty.update_problem = self.update_problem
+    self.recounts = []
+    self.recount_time = 0
+    self.old_user_in_problem = record.user_in_problem
+    record.user_in_problem = self.user_in_problem
+
+  def tearDown(self):
+    db.coll = self.old_coll
+    difficulty.update_problem = self.old_update_problem
+    record.user_in_problem = self.old_user_in_problem
+
+  async def update_problem(self, domain_id, pid):
+    # Counters are written before the difficulty is recalculated.
+    self.difficulties.append((domain_id, pid, len(self.writes)))
+
+  async def user_in_problem(self, uid, domain_id, pid):
+    await asyncio.sleep(self.recount_time)
+    self.recounts.append((uid, domain_id, pid))
+
+  @base.wrap_coro
+  async def test_merge(self):
+    postjudge.inc_problem(DOMAIN_ID, PID, num_accept=1)
+    postjudge.inc_problem(DOMAIN_ID, PID, num_ac_submit=1)
+    postjudge.inc_problem(DOMAIN_ID, PID, num_ac_submit=1)
+    postjudge.inc_problem(DOMAIN_ID, PID + 1, num_accept=0)
+    postjudge.inc_domain_user(DOMAIN_ID, UID, num_accept=1)
+    await postjudge.flush()
+    self.assertEqual(sorted(self.writes, key=lambda write: write[0]), [
+      ('document', [UpdateOne({'domain_id': DOMAIN_ID, 'doc_type': document.TYPE_PROBLEM,
+                                'doc_id': PID},
+                               {'$inc': {'num_accept': 1, 'num_ac_submit': 2}})]),
+      ('domain.user', [UpdateOne({'domain_id': DOMAIN_ID, 'uid': UID},
+                                 {'$inc': {'num_accept': 1}}, upsert=True)])])
+    await postjudge.flush()
+    self.assertEqual(len(self.writes), 2)
+
+  @base.wrap_coro
+  async def test_delay(self):
+    postjudge.inc_problem(DOMAIN_ID, PID, num_accept=1)
+    await asyncio.sleep(options.post_judge_flush_delay * 2)
+    self.assertEqual(len(self.writes), 1)
+
+  @base.wrap_coro
+  async def test_difficulty(self):
+    for _ in range(3):
+      postjudge.inc_problem(DOMAIN_ID, PID, num_ac_submit=1)
+      postjudge.update_difficulty(DOMAIN_ID, PID)
+    postjudge.update_difficulty(DOMAIN_ID, PID + 1)
+    await postjudge.flush_all()
+    self.assertEqual(sorted(self.difficulties), [(DOMAIN_ID, PID, 1), (DOMAIN_ID, PID + 1, 1)])
+    await postjudge.flush_all()
+    self.assertEqual(len(self.difficulties), 2)
+
+  @base.wrap_coro
+  async def test_user_in_problem(self):
+    for _ in range(3):
+      postjudge.user_in_problem(UID, DOMAIN_ID, PID)
+    postjudge.user_in_problem(UID + 1, DOMAIN_ID, PID)
+    await postjudge.flush_all()
+    self.assertEqual(sorted(self.recounts), [(UID, DOMAIN_ID, PID), (UID + 1, DOMAIN_ID, PID)])
+
+  @base.wrap_coro
+  async def test_user_in_problem_shutdown(self):
+    # The app runs flush_all() on shutdown, it waits for recounts started before it too.
+    self.recount_time = 0.05
+    old_delay = options.user_in_problem_delay
+    options.user_in_problem_delay = 0
+    try:
+      postjudge.user_in_problem(UID, DOMAIN_ID, PID)
+      await asyncio.sleep(0.01)
+    finally:
+      options.user_in_problem_delay = old_delay
+    postjudge.user_in_problem(UID + 1, DOMAIN_ID, PID)
+    self.assertEqual(self.recounts, [])
+    await postjudge.flush_all()
+    self.assertEqual(sorted(self.recounts), [(UID, DOMAIN_ID, PID), (UID + 1, DOMAIN_ID, PID)])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,6 +1,10 @@
 import unittest
+from bson import objectid
 
+from vj4 import db
 from vj4 import error
+from vj4.job import problem as problem_job
+from vj4.model import fs
 from vj4.model.adaptor import problem
 from vj4.test import base
 
@@ -11,9 +15,10 @@ UID = 22
 PID = 777
 CONTENT2 = 'dummy_content2'
 UID2 = 222
+DOMAIN_ID2 = 'dummy_domain2'
 
 
-class ProblemTest(base.DatabaseTestCase):
+class ProblemTest(base.BusTestCase):
   @base.wrap_coro
   async def test_add_get(self):
     pid = await problem.add(DOMAIN_ID, TITLE, CONTENT, UID, PID)
@@ -45,7 +50,77 @@ class ProblemTest(base.DatabaseTestCase):
     self.assertTrue(psdoc['star'])
 
 
-class ProblemSolutionTest(base.DatabaseTestCase):
+  @base.wrap_coro
+  async def test_index(self):
+    await problem.add(DOMAIN_ID, TITLE, CONTENT, UID, PID, tag=['dp'])
+    await problem.add(DOMAIN_ID, TITLE, CONTENT, UID, PID + 1, hidden=True)
+    index = await problem.get_index(DOMAIN_ID)
+    self.assertIs(await problem.get_index(DOMAIN_ID), index)
+    self.assertEqual(index.get_page(UID2, False, 1, 10), ([PID], 1, 1))
+    self.assertEqual(index.get_page(UID, False, 1, 10), ([PID, PID + 1], 1, 2))
+    self.assertEqual(index.get_page(UID2, False, 1, 10, category_groups=[[('tag', 'dp')]]),
+                     ([PID], 1, 1))
+    await problem.share(DOMAIN_ID, PID + 1, UID2)
+    index = await problem.get_index(DOMAIN_ID)
+    self.assertEqual(index.get_page(UID2, False, 1, 10), ([PID, PID + 1], 1, 2))
+    await problem.set_hidden(DOMAIN_ID, PID, True)
+    index = await problem.get_index(DOMAIN_ID)
+    self.assertEqual(index.get_page(3, False, 1, 10), ([], 0, 0))
+
+  @base.wrap_coro
+  async def test_search(self):
+    await problem.add(DOMAIN_ID, 'Shortest path', CONTENT, UID, PID, tag=['graph'])
+    await problem.add(DOMAIN_ID, TITLE, 'Find the shortest path.', UID, PID + 1, hidden=True)
+    await problem.add(DOMAIN_ID2, 'Shortest path', CONTENT, UID, PID)
+    pdocs = await problem.search(DOMAIN_ID, 'shortest').to_list()
+    self.assertEqual([pdoc['doc_id'] for pdoc in pdocs], [PID, PID + 1])
+    pdocs = await problem.search(DOMAIN_ID, 'graph').to_list()
+    self.assertEqual([pdoc['doc_id'] for pdoc in pdocs], [PID])
+    pdocs = await problem.search(DOMAIN_ID, 'shortest', hidden=False).to_list()
+    self.assertEqual([pdoc['doc_id'] for pdoc in pdocs], [PID])
+    pdocs = await problem.search(DOMAIN_ID, 'nothing').to_list()
+    self.assertEqual(pdocs, [])
+
+
+class ProblemDataTest(base.BusTestCase, base.QueueTestCase):
+  @base.wrap_coro
+  async def test_data_list(self):
+    await problem.add(DOMAIN_ID, TITLE, CONTENT, UID, PID)
+    await problem.add(DOMAIN_ID, TITLE, CONTENT, UID, PID + 1, data=objectid.ObjectId())
+    self.assertEqual([(domain_id, pid) for domain_id, pid, _ in await problem.get_data_list(0)],
+                     [(DOMAIN_ID, PID + 1)])
+    pdoc = await problem.get(DOMAIN_ID, PID)
+    await problem.copy(pdoc, DOMAIN_ID2, UID, PID)
+    await problem.set_data(DOMAIN_ID, PID, objectid.ObjectId())
+    pids = await problem.get_data_list(0)
+    self.assertEqual(len(pids), 3)
+    self.assertEqual(pids[-1][2], pids[-2][2])
+    self.assertEqual(set((domain_id, pid) for domain_id, pid, _ in pids[-2:]),
+                     {(DOMAIN_ID, PID), (DOMAIN_ID2, PID)})
+    page = await problem.get_data_list(0, 1)
+    pages = [page]
+    while page:
+      page = await problem.get_data_list(0, 1, page[-1])
+      pages.append(page)
+    self.assertEqual(sum(pages, []), pids)
+
+  @base.wrap_coro
+  async def test_sync_data_changed_at(self):
+    file_id = await fs.add_data('application/octet-stream', b'data')
+    await problem.add(DOMAIN_ID, TITLE, CONTENT, UID, PID, data=file_id)
+    # Copied from a problem which was deleted, skipped.
+    await problem.add(DOMAIN_ID2, TITLE, CONTENT, UID, PID,
+                      data={'domain': DOMAIN_ID, 'pid': PID + 1})
+    await db.coll('document').update_many({'doc_id': PID},
+                                          {'$unset': {'data_changed_at': ''}})
+    self.assertEqual(await problem.get_data_list(0), [])
+    await problem_job.sync_data_changed_at()
+    pids = await problem.get_data_list(0)
+    self.assertEqual([(domain_id, pid) for domain_id, pid, _ in pids], [(DOMAIN_ID, PID)])
+    self.assertEqual(pids[0][2], (await fs.get_meta(file_id))['uploadDate'])
+
+
+class ProblemSolutionTest(base.BusTestCase):
   def setUp(self):
     super(ProblemSolutionTest, self).setUp()
     base.wait(problem.add(DOMAIN_ID, TITLE, CONTENT, UID, PID))
@@ -0,0 +1,53 @@
+import unittest
+
+from vj4 import error
+from vj4.service import problemindex
+
+UID = 22
+UID2 = 222
+
+PDOCS = [
+  {'doc_id': 1, 'hidden': False, 'owner_uid': UID, 'category': ['dp'], 'tag': ['knapsack']},
+  {'doc_id': 2, 'hidden': True, 'owner_uid': UID, 'category': ['dp'], 'tag': []},
+  {'doc_id': 3, 'hidden': False, 'owner_uid': UID2, 'category': ['graph'], 'tag': ['bfs']},
+  {'doc_id': 4, 'hidden': True, 'owner_uid': UID2, 'shared_uids': [UID], 'category': [],
+   'tag': ['bfs']},
+  {'doc_id': 5, 'hidden': False, 'owner_uid': UID2, 'category': ['dp', 'graph'], 'tag': []},
+]
+
+
+class IndexTest(unittest.TestCase):
+  def setUp(self):
+    self.index = problemindex.Index(PDOCS)
+
+  def test_visibility(self):
+    self.assertEqual(self.index.get_page(0, False, 1, 10), ([1, 3, 5], 1, 3))
+    self.assertEqual(self.index.get_page(UID, False, 1, 10), ([1, 2, 3, 4, 5], 1, 5))
+    self.assertEqual(self.index.get_page(UID2, False, 1, 10), ([1, 3, 4, 5], 1, 4))
+    self.assertEqual(self.index.get_page(0, True, 1, 10), ([1, 2, 3, 4, 5], 1, 5))
+
+  def test_only_hidden(self):
+    self.assertEqual(self.index.get_page(0, False, 1, 10, only_hidden=True), ([], 0, 0))
+    self.assertEqual(self.index.get_page(UID2, False, 1, 10, only_hidden=True), ([4], 1, 1))
+    self.assertEqual(self.index.get_page(0, True, 1, 10, only_hidden=True), ([2, 4], 1, 2))
+
+  def test_pages(self):
+    self.assertEqual(self.index.get_page(UID, False, 1, 2), ([1, 2], 3, 5))
+    self.assertEqual(self.index.get_page(UID, False, 3, 2), ([5], 3, 5))
+    self.assertEqual(self.index.get_page(UID, False, 4, 2), ([], 3, 5))
+    with self.assertRaises(error.ValidationError):
+      self.index.get_page(UID, False, 0, 2)
+
+  def test_category_groups(self):
+    groups = [[('category', 'dp'), ('category', 'graph')], [('tag', 'bfs')]]
+    self.assertEqual(self.index.get_page(0, False, 1, 10, category_groups=groups),
+                     ([3, 5], 1, 2))
+    self.assertEqual(self.index.get_page(UID, False, 1, 10, category_groups=groups),
+                     ([3, 4, 5], 1, 3))
+    self.assertEqual(self.index.get_page(UID, False, 1, 10,
+                                         category_groups=[[('category', 'dp')]]),
+                     ([1, 2, 5], 1, 3))
+
+
+if __name__ == '__main__':
+  unittest.main()
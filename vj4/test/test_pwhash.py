@@ -1,5 +1,7 @@
+import asyncio
 import unittest
 
+from vj4.test import base
 from vj4.util import pwhash
 
 
@@ -32,6 +34,18 @@ class Test(unittest.TestCase):
     password2 = 'password2'
     self.assertFalse(pwhash.check(password2, salt1, hash1))
 
+  @base.wrap_coro
+  async def test_hash_check_async(self):
+    password1 = 'password1'
+    salt1 = pwhash.gen_salt()
+    hash1 = await pwhash.hash_vj4_async(password1, salt1)
+    self.assertEqual(hash1, pwhash.hash_vj4(password1, salt1))
+    self.assertEqual(await asyncio.gather(pwhash.check_async(password1, salt1, hash1),
+                                          pwhash.check_async(password1, salt1, hash1),
+                                          pwhash.check_async('password2', salt1, hash1)),
+                     [True, True, False])
+    self.assertEqual(pwhash._checks, {})
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+
+from vj4 import constant
+from vj4.model.adaptor import contest
+from vj4.service import bus
+from vj4.service import scoreboard
+from vj4.test import base
+
+KEY = ('system', 30, 'tid')
+UDICT = {1: {'_id': 1, 'uname': 'a'}, 2: {'_id': 2, 'uname': 'b'}, 3: {'_id': 3, 'uname': 'c'}}
+
+
+def _board(*tsdocs):
+  return scoreboard.Board({'rule': constant.contest.RULE_ACM}, list(tsdocs), UDICT, {}, {},
+                          contest._get_status_sort_key(constant.contest.RULE_ACM))
+
+
+class BoardTest(unittest.TestCase):
+  def test_sorted(self):
+    board = _board({'uid': 1, 'accept': 1, 'time': 50.0, 'rev': 1},
+                   {'uid': 2, 'accept': 2, 'time': 90.0, 'rev': 1},
+                   {'uid': 3, 'accept': 1, 'time': 30.0, 'rev': 1})
+    self.assertEqual([tsdoc['uid'] for tsdoc in board.tsdocs], [2, 3, 1])
+
+  def test_apply_moves(self):
+    board = _board({'uid': 1, 'accept': 1, 'time': 50.0, 'rev': 1},
+                   {'uid': 2, 'accept': 2, 'time': 90.0, 'rev': 1},
+                   {'uid': 3, 'rev': 1})
+    self.assertTrue(board.apply({'uid': 3, 'accept': 2, 'time': 80.0, 'rev': 3}))
+    self.assertEqual([tsdoc['uid'] for tsdoc in board.tsdocs], [3, 2, 1])
+    self.assertTrue(board.apply({'uid': 2, 'accept': 1, 'time': 10.0, 'rev': 2}))
+    self.assertEqual([tsdoc['uid'] for tsdoc in board.tsdocs], [3, 2, 1])
+    self.assertEqual(board.tsdocs[1]['accept'], 1)
+
+  def test_apply_stale(self):
+    board = _board({'uid': 1, 'accept': 1, 'time': 50.0, 'rev': 5})
+    self.assertTrue(board.apply({'uid': 1, 'accept': 0, 'rev': 4}))
+    self.assertEqual(board.tsdocs[0]['accept'], 1)
+
+  def test_apply_unknown(self):
+    board = _board({'uid': 1, 'accept': 1, 'time': 50.0, 'rev': 1})
+    self.assertFalse(board.apply({'uid': 2, 'accept': 1, 'time': 10.0, 'rev': 1}))
+
+  def test_rows_cached(self):
+    board = _board({'uid': 1, 'rev': 1})
+    built = []
+    build = lambda board: built.append(1) or len(built)
+    self.assertEqual(board.get_rows('k', build), 1)
+    self.assertEqual(board.get_rows('k', build), 1)
+    board.apply({'uid': 1, 'accept': 1, 'time': 1.0, 'rev': 2})
+    self.assertEqual(board.get_rows('k', build), 2)
+
+
+class EngineTest(unittest.TestCase):
+  def setUp(self):
+    self.num_loads = 0
+
+  def tearDown(self):
+    scoreboard._boards.clear()
+
+  async def load(self, domain_id, doc_type, tid):
+    self.num_loads += 1
+    return _board({'uid': 1, 'accept': 1, 'time': 50.0, 'rev': 1},
+                  {'uid': 2, 'accept': 1, 'time': 90.0, 'rev': 1})
+
+  @base.wrap_coro
+  async def test_cached(self):
+    board = await scoreboard.get(KEY, self.load)
+    self.assertIs(await scoreboard.get(KEY, self.load), board)
+    self.assertEqual(self.num_loads, 1)
+
+  @base.wrap_coro
+  async def test_status_change(self):
+    board = await scoreboard.get(KEY, self.load)
+    await scoreboard._on_status_change({'value': {'domain_id': KEY[0], 'doc_type': KEY[1],
+                                                  'tid': KEY[2],
+                                                  'tsdoc': {'uid': 2, 'accept': 2, 'time': 1.0,
+                                                            'rev': 2}}})
+    self.assertIs(await scoreboard.get(KEY, self.load), board)
+    self.assertEqual([tsdoc['uid'] for tsdoc in board.tsdocs], [2, 1])
+
+  @base.wrap_coro
+  async def test_invalidate(self):
+    await scoreboard.get(KEY, self.load)
+    await scoreboard._on_invalidate({'value': {'domain_id': KEY[0], 'doc_type': KEY[1],
+                                               'tid': KEY[2]}})
+    await scoreboard.get(KEY, self.load)
+    self.assertEqual(self.num_loads, 2)
+
+  @base.wrap_coro
+  async def test_invalidate_local(self):
+    await scoreboard.get(KEY, self.load)
+    old_publish_throttle = bus.publish_throttle
+    bus.publish_throttle = lambda *args: None
+    try:
+      scoreboard.invalidate(*KEY)
+    finally:
+      bus.publish_throttle = old_publish_throttle
+    await scoreboard.get(KEY, self.load)
+    self.assertEqual(self.num_loads, 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
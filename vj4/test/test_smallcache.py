@@ -11,6 +11,7 @@ class OfflineTest(unittest.TestCase):
 
   def tearDown(self):
     smallcache._cache.clear()
+    smallcache._expire_at.clear()
 
   def test_none(self):
     self.assertIsNone(smallcache.get(0))
@@ -73,6 +74,20 @@ class OfflineTest(unittest.TestCase):
     self.assertEqual(smallcache.get(3), 1)
     self.assertEqual(smallcache.get(4), 4)
 
+  def test_expire(self):
+    smallcache.set_local(0, 7, expire_seconds=0)
+    smallcache.set_local(1, 0, expire_seconds=60)
+    self.assertIsNone(smallcache.get(0))
+    self.assertEqual(smallcache.get(1), 0)
+    smallcache.set_local(1, 5)
+    self.assertNotIn(1, smallcache._expire_at)
+
+  def test_expire_evict(self):
+    for i in range(5):
+      smallcache.set_local(i, i, expire_seconds=60)
+    self.assertIsNone(smallcache.get(0))
+    self.assertNotIn(0, smallcache._expire_at)
+
 
 class OnlineTest(base.SmallcacheTestCase):
   @base.wrap_coro
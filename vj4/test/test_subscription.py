@@ -0,0 +1,65 @@
+import unittest
+
+from vj4.util import subscription
+
+
+class Connection(object):
+  def __init__(self):
+    self.events = []
+
+  def on_event(self, e):
+    self.events.append(e)
+
+
+class RegistryTest(unittest.TestCase):
+  def setUp(self):
+    self.registry = subscription.Registry()
+
+  def test_exact(self):
+    c1, c2 = Connection(), Connection()
+    self.registry.subscribe(c1.on_event, ['push_received-1', 'record_change'])
+    self.registry.subscribe(c2.on_event, ['push_received-2', 'record_change'])
+    self.assertEqual(self.registry.get('push_received-1'), [c1.on_event])
+    self.assertEqual(self.registry.get('record_change'), [c1.on_event, c2.on_event])
+    self.assertEqual(self.registry.get('push_received-3'), [])
+    self.registry.unsubscribe(c1.on_event)
+    self.assertEqual(self.registry.get('push_received-1'), [])
+    self.assertEqual(self.registry.get('record_change'), [c2.on_event])
+    self.assertEqual(len(self.registry), 1)
+    self.registry.unsubscribe(c1.on_event)
+    self.registry.unsubscribe(c2.on_event)
+    self.assertEqual(len(self.registry), 0)
+
+  def test_resubscribe(self):
+    c = Connection()
+    self.registry.subscribe(c.on_event, ['a'])
+    self.registry.subscribe(c.on_event, ['b'])
+    self.assertEqual(self.registry.get('a'), [])
+    self.assertEqual(self.registry.get('b'), [c.on_event])
+
+  def test_prefix(self):
+    c1, c2 = Connection(), Connection()
+    self.registry.subscribe(c1.on_event, ['push_received-*'])
+    self.registry.subscribe(c2.on_event, ['push_received-2', '*'])
+    self.assertCountEqual(self.registry.get('push_received-1'), [c1.on_event, c2.on_event])
+    self.assertCountEqual(self.registry.get('push_received-2'), [c1.on_event, c2.on_event])
+    self.assertEqual(self.registry.get('push'), [c2.on_event])
+    self.assertEqual(self.registry.get(1), [])
+    self.registry.unsubscribe(c2.on_event)
+    self.assertEqual(self.registry.get('push'), [])
+    self.assertEqual(self.registry.get('push_received-2'), [c1.on_event])
+
+  def test_functions(self):
+    events = []
+
+    def on_event(e):
+      events.append(e)
+
+    self.registry.subscribe(on_event, ('a',))
+    self.assertEqual(self.registry.get('a'), [on_event])
+    self.registry.unsubscribe(on_event)
+    self.assertEqual(self.registry.get('a'), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
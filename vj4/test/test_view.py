@@ -1,6 +1,16 @@
+import asyncio
+import datetime
+import os
+import tempfile
 import unittest
 
+from aiohttp import web
+
 from vj4.handler import base
+from vj4.handler import fs as fs_handler
+from vj4.model import fs
+from vj4.test import base as test_base
+from vj4.util import options
 
 PERM_DUMMY = 1
 PRIV_DUMMY = 2
@@ -39,5 +49,66 @@ class DecoratorTest(unittest.TestCase, DummyHandler):
     self.assert_priv_checked(PRIV_DUMMY)
 
 
+class FsGetHandlerTest(unittest.TestCase):
+  CONTENT = b'dummy_content'
+  SECRET = 'a' * 40
+
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.old_dir = options.fs_disk_cache_dir
+    options.fs_disk_cache_dir = self.temp_dir.name
+    with open(os.path.join(self.temp_dir.name, self.SECRET), 'wb') as file_object:
+      file_object.write(self.CONTENT)
+    self.old_get_meta_by_secret = fs.get_meta_by_secret
+    fs.get_meta_by_secret = self.get_meta_by_secret
+
+  def tearDown(self):
+    fs.get_meta_by_secret = self.old_get_meta_by_secret
+    options.fs_disk_cache_dir = self.old_dir
+    self.temp_dir.cleanup()
+
+  async def get_meta_by_secret(self, secret):
+    return {'_id': secret, 'length': len(self.CONTENT), 'metadata': {'secret': secret},
+            'uploadDate': datetime.datetime(2000, 1, 1)}
+
+  async def handle(self, request):
+    # Skips HandlerBase.prepare(), which needs the database.
+    handler = fs_handler.FsGetHandler(request)
+    handler.response = web.Response()
+    await handler.get()
+    return handler.response
+
+  async def request(self, *headers):
+    app = web.Application()
+    app.router.add_get('/fs/{secret}', self.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    try:
+      port = site._server.sockets[0].getsockname()[1]
+      reader, writer = await asyncio.open_connection('127.0.0.1', port)
+      writer.write('GET /fs/{} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n{}\r\n'
+                   .format(self.SECRET, ''.join(h + '\r\n' for h in headers)).encode())
+      data = await reader.read()
+      writer.close()
+      return data
+    finally:
+      await runner.cleanup()
+
+  @test_base.wrap_coro
+  async def test_disk_cache(self):
+    data = await self.request()
+    self.assertTrue(data.startswith(b'HTTP/1.1 200 OK\r\n'))
+    self.assertTrue(data.endswith(b'\r\n\r\n' + self.CONTENT))
+    self.assertIn(b'Content-Length: 13\r\n', data)
+
+  @test_base.wrap_coro
+  async def test_disk_cache_range(self):
+    data = await self.request('Range: bytes=2-4')
+    self.assertTrue(data.startswith(b'HTTP/1.1 206 Partial Content\r\n'))
+    self.assertTrue(data.endswith(b'\r\n\r\n' + self.CONTENT[2:5]))
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,44 @@
+import io
+import unittest
+import zipfile
+
+from vj4.test import base
+from vj4.util import zipstream
+
+
+class FakeResponse(object):
+  def __init__(self):
+    self.chunks = []
+    self.eof = False
+
+  async def write(self, data):
+    self.chunks.append(data)
+
+  async def write_eof(self):
+    self.eof = True
+
+
+class ZipStreamTest(unittest.TestCase):
+  @base.wrap_coro
+  async def test_writestr(self):
+    response = FakeResponse()
+    zip_writer = zipstream.ZipStreamWriter(response)
+    await zip_writer.writestr('U1_P2_R3.cc', 'int main() {}\n' * 100)
+    num_chunks = len(response.chunks)
+    self.assertGreater(num_chunks, 0)
+    await zip_writer.writestr('U4_P5_R6.py', 'print(42)\n')
+    self.assertGreater(len(response.chunks), num_chunks)
+    await zip_writer.close()
+    self.assertTrue(response.eof)
+    with zipfile.ZipFile(io.BytesIO(b''.join(response.chunks))) as zip_file:
+      self.assertIsNone(zip_file.testzip())
+      self.assertEqual(zip_file.namelist(), ['U1_P2_R3.cc', 'U4_P5_R6.py'])
+      self.assertEqual(zip_file.read('U4_P5_R6.py'), b'print(42)\n')
+      self.assertEqual(zip_file.read('U1_P2_R3.cc'), b'int main() {}\n' * 100)
+      for zinfo in zip_file.infolist():
+        self.assertEqual(zinfo.create_system, 0)
+        self.assertEqual(zinfo.compress_type, zipfile.ZIP_DEFLATED)
+
+
+if __name__ == '__main__':
+  unittest.main()
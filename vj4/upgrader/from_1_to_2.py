@@ -0,0 +1,28 @@
+import logging
+
+from vj4.job import problem as problem_job
+from vj4.model import system
+from vj4.util import argmethod
+
+
+_logger = logging.getLogger(__name__)
+
+
+@argmethod.wrap
+async def run():
+  lock = await system.acquire_upgrade_lock()
+  try:
+    await system.ensure_db_version(1)
+
+    # add `data_changed_at` attribute to problems with data
+    _logger.info('Updating data_changed_at ...')
+    await problem_job.sync_data_changed_at()
+
+    _logger.info('Bumping database version...')
+    await system.set_db_version(2)
+  finally:
+    await system.release_upgrade_lock(lock)
+
+
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
@@ -1,4 +1,5 @@
 import base64
+import collections
 import hashlib
 import jinja2
 import markupsafe
@@ -8,10 +9,17 @@ from urllib import parse
 
 from vj4.util import options
 
+options.define('markdown_cache_max_size', default=64 * 2 ** 20,
+               help='Maximum total length of rendered markdown cached in memory, in characters.')
+
 markdown_parser = mistune.create_markdown(escape=True, hard_wrap=True, renderer='html', plugins=['table', 'url', 'math', 'spoiler'])
 
 FS_RE = re.compile(r'\(vijos\:\/\/fs\/([0-9a-f]{40,})\)')
 
+# Digest of text -> rendered markup, least recently used first.
+_markdown_cache = collections.OrderedDict()
+_markdown_cache_size = 0
+
 def nl2br(text):
   markup = markupsafe.escape(text)
   return markupsafe.Markup('<br>'.join(markup.split('\n')))
@@ -22,11 +30,28 @@ def fs_replace(m):
   return '(' + options.cdn_prefix.rstrip('/') + '/fs/' + m.group(1) + ')'
 
 
-def markdown(text):
+def _render_markdown(text):
   text = FS_RE.sub(fs_replace, text)
   return markupsafe.Markup(markdown_parser(text))
 
 
+def markdown(text):
+  global _markdown_cache_size
+  key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+  markup = _markdown_cache.get(key)
+  if markup is not None:
+    _markdown_cache.move_to_end(key)
+    return markup
+  markup = _render_markdown(text)
+  if len(markup) <= options.markdown_cache_max_size:
+    _markdown_cache[key] = markup
+    _markdown_cache_size += len(markup)
+    while _markdown_cache_size > options.markdown_cache_max_size:
+      _, evicted = _markdown_cache.popitem(False)
+      _markdown_cache_size -= len(evicted)
+  return markup
+
+
 def gravatar_url(gravatar, size=200):
   # TODO: 'd' should be https://domain/img/avatar.png
   if gravatar:
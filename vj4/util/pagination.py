@@ -1,4 +1,8 @@
 import asyncio
+import base64
+import bson
+from bson import errors
+
 from vj4 import error
 
 
@@ -20,3 +24,66 @@ async def paginate(cursor, page: int, page_size: int):
   
   num_pages = (count + page_size - 1) // page_size
   return page_docs, num_pages, count
+
+
+def encode_token(values):
+  """Encode a list of BSON values into an opaque URL-safe continuation token."""
+  return base64.urlsafe_b64encode(bson.BSON.encode({'v': list(values)})).decode()
+
+
+def decode_token(token, name='cursor'):
+  try:
+    return bson.BSON(base64.urlsafe_b64decode(token.encode())).decode()['v']
+  except (ValueError, KeyError, errors.BSONError):
+    raise error.ValidationError(name)
+
+
+def get_keyset_query(sort, values):
+  """Build the query of documents after values in the order of sort.
+
+  For sort [(a, -1), (b, 1)], this is {'$or': [{a: {'$lt': va}}, {a: va, b: {'$gt': vb}}]}.
+  """
+  query = {'$or': []}
+  for i, (key, direction) in enumerate(sort):
+    sub_query = {k: v for (k, _), v in zip(sort[:i], values)}
+    sub_query[key] = {'$gt' if direction > 0 else '$lt': values[i]}
+    query['$or'].append(sub_query)
+  return query
+
+
+async def paginate_keyset(get_cursor, sort, token: str, page_size: int, *,
+                          estimate_count: bool=False):
+  """Seek pagination, the cost of a page does not depend on its position.
+
+  Args:
+    get_cursor: function which takes a query dict and returns a cursor of the documents which also
+        match it. The query has a top level '$or', so combine it with '$and' if the filter of the
+        cursor has one too.
+    sort: list of (key, direction). The keys together must be unique, e.g. end with '_id' or
+        'doc_id'. The keys must be top level, present in every document and included in the
+        projection.
+    token: the continuation token returned for the previous page, or empty for the first page.
+    page_size: number of documents per page.
+    estimate_count: also return the estimated number of documents in the whole collection, from
+        its metadata. Only meaningful when the query does not filter much of the collection.
+
+  Returns:
+    Tuple of (documents, continuation token of the next page or None, count or None).
+  """
+  query = {}
+  if token:
+    values = decode_token(token)
+    if len(values) != len(sort):
+      raise error.ValidationError('cursor')
+    query = get_keyset_query(sort, values)
+  cursor = get_cursor(query).sort(sort).limit(page_size + 1)
+  if estimate_count:
+    docs, count = await asyncio.gather(cursor.to_list(),
+                                       cursor.collection.estimated_document_count())
+  else:
+    docs, count = await cursor.to_list(), None
+  next_token = None
+  if len(docs) > page_size:
+    docs = docs[:page_size]
+    next_token = encode_token(docs[-1][key] for key, _ in sort)
+  return docs, next_token, count
@@ -1,15 +1,27 @@
+import asyncio
 import base64
 import binascii
-import functools
 import hashlib
+import hmac
 import os
+from concurrent import futures
 
 from vj4 import error
 from vj4.util import argmethod
+from vj4.util import options
+
+options.define('pwhash_max_workers', default=2,
+               help='Number of threads hashing passwords, which caps concurrent hashing.')
 
 _HASH_TYPE_VJ2 = 'vj2'
 _HASH_TYPE_VJ4 = 'vj4'
 
+_executor = None
+# Keyed digest of the arguments -> future of a check in progress, so that the same credentials
+# submitted again while being checked are only hashed once. Nothing is kept after the check.
+_checks = {}
+_CHECK_KEY = os.urandom(32)
+
 
 def _md5(s):
   return hashlib.md5(s.encode()).hexdigest()
@@ -52,20 +64,47 @@ def hash_vj4(password: str, salt: str):
   return _HASH_TYPE_VJ4 + '|' + binascii.hexlify(dk).decode()
 
 
-@functools.lru_cache()
 @argmethod.wrap
 def check(password: str, salt: str, hash: str):
   hash_type, rest = hash.split('|', 1)
   if hash_type == _HASH_TYPE_VJ2:
     uname_b64 = rest.split('|', 1)[0]
     uname = _b64decode(uname_b64)
-    return hash == hash_vj2(uname, password, salt)
+    return hmac.compare_digest(hash, hash_vj2(uname, password, salt))
   elif hash_type == _HASH_TYPE_VJ4:
-    return hash == hash_vj4(password, salt)
+    return hmac.compare_digest(hash, hash_vj4(password, salt))
   else:
     raise error.HashError('unsupported hash type')
 
 
+def _get_executor():
+  global _executor
+  if not _executor:
+    _executor = futures.ThreadPoolExecutor(max_workers=options.pwhash_max_workers,
+                                           thread_name_prefix='pwhash')
+  return _executor
+
+
+async def _run(func, *args):
+  # pbkdf2_hmac releases the GIL, so threads hash in parallel with the event loop.
+  return await asyncio.get_event_loop().run_in_executor(_get_executor(), func, *args)
+
+
+async def hash_vj4_async(password, salt):
+  """Same as hash_vj4() but runs in the hashing thread pool."""
+  return await _run(hash_vj4, password, salt)
+
+
+async def check_async(password, salt, hash):
+  """Same as check() but runs in the hashing thread pool."""
+  key = hmac.new(_CHECK_KEY, repr((password, salt, hash)).encode(), hashlib.sha256).digest()
+  if key not in _checks:
+    future = asyncio.ensure_future(_run(check, password, salt, hash))
+    _checks[key] = future
+    future.add_done_callback(lambda _: _checks.pop(key))
+  return await asyncio.shield(_checks[key])
+
+
 @argmethod.wrap
 def need_upgrade(hash: str):
   hash_type, rest = hash.split('|', 1)
@@ -0,0 +1,73 @@
+"""Callbacks subscribed to event keys, used by vj4.service.bus and vj4.service.event.
+
+Callbacks are indexed by key, so finding the subscribers of an event costs one dict lookup plus
+one per distinct prefix length instead of a scan over all subscribers. A string key ending with
+'*' subscribes every key starting with the rest of it.
+"""
+import collections
+
+WILDCARD = '*'
+
+
+def _get_id(callback):
+  # Bound methods are created on every attribute access. Identify them by the object and the
+  # function, so that the same method of two connections never shares a subscription.
+  if hasattr(callback, '__self__') and hasattr(callback, '__func__'):
+    return id(callback.__self__), callback.__func__
+  return callback
+
+
+class Registry(object):
+  def __init__(self):
+    self._keys = {}  # callback id -> keys
+    self._exact = collections.defaultdict(dict)  # key -> {callback id: callback}
+    self._prefixes = collections.defaultdict(dict)  # prefix -> {callback id: callback}
+    self._prefix_lengths = collections.Counter()  # length -> number of prefixes
+
+  def __len__(self):
+    return len(self._keys)
+
+  def subscribe(self, callback, keys):
+    """Subscribe a callback to keys, replacing the keys it was subscribed to before."""
+    callback_id = _get_id(callback)
+    self.unsubscribe(callback)
+    self._keys[callback_id] = keys = frozenset(keys)
+    for key in keys:
+      if isinstance(key, str) and key.endswith(WILDCARD):
+        prefix = key[:-len(WILDCARD)]
+        if not self._prefixes[prefix]:
+          self._prefix_lengths[len(prefix)] += 1
+        self._prefixes[prefix][callback_id] = callback
+      else:
+        self._exact[key][callback_id] = callback
+
+  def unsubscribe(self, callback):
+    callback_id = _get_id(callback)
+    for key in self._keys.pop(callback_id, ()):
+      if isinstance(key, str) and key.endswith(WILDCARD):
+        prefix = key[:-len(WILDCARD)]
+        del self._prefixes[prefix][callback_id]
+        if not self._prefixes[prefix]:
+          del self._prefixes[prefix]
+          self._prefix_lengths[len(prefix)] -= 1
+          if not self._prefix_lengths[len(prefix)]:
+            del self._prefix_lengths[len(prefix)]
+      else:
+        del self._exact[key][callback_id]
+        if not self._exact[key]:
+          del self._exact[key]
+
+  def get(self, key):
+    """Get the callbacks subscribed to a key."""
+    callbacks = dict(self._exact.get(key, ()))
+    if isinstance(key, str):
+      for length in self._prefix_lengths:
+        if length <= len(key):
+          callbacks.update(self._prefixes.get(key[:length], ()))
+    return list(callbacks.values())
+
+  def clear(self):
+    self._keys.clear()
+    self._exact.clear()
+    self._prefixes.clear()
+    self._prefix_lengths.clear()
@@ -0,0 +1,56 @@
+import time
+import zipfile
+
+
+class _ChunkBuffer(object):
+  """Write-only file object collecting the bytes written by zipfile since the last drain.
+
+  It has no tell() or seek(), so zipfile writes sizes and CRCs in data descriptors instead of
+  seeking back to the local headers.
+  """
+
+  def __init__(self):
+    self.chunks = []
+
+  def write(self, data):
+    self.chunks.append(bytes(data))
+    return len(data)
+
+  def flush(self):
+    pass
+
+  def drain(self):
+    data = b''.join(self.chunks)
+    self.chunks.clear()
+    return data
+
+
+class ZipStreamWriter(object):
+  """Writes a zip archive entry by entry to a prepared StreamResponse.
+
+  Only the entry being compressed and the central directory records are kept in memory.
+  """
+
+  def __init__(self, response, compression=zipfile.ZIP_DEFLATED):
+    self.response = response
+    self.buffer = _ChunkBuffer()
+    self.zip_file = zipfile.ZipFile(self.buffer, 'w', compression)
+
+  async def _drain(self):
+    data = self.buffer.drain()
+    if data:
+      await self.response.write(data)
+
+  async def writestr(self, name, data):
+    zinfo = zipfile.ZipInfo(name, time.localtime(time.time())[:6])
+    zinfo.compress_type = self.zip_file.compression
+    zinfo.external_attr = 0o600 << 16
+    # mark all files as created in Windows :p
+    zinfo.create_system = 0
+    self.zip_file.writestr(zinfo, data)
+    await self._drain()
+
+  async def close(self):
+    self.zip_file.close()
+    await self._drain()
+    await self.response.write_eof()